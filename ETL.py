@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*- 
 import pandas as pd
 import os
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from sqlalchemy import create_engine, inspect, text
 from datetime import datetime, date
-import openpyxl
+import agrupacion
+import lectores
 import hashlib
 import logging
 import re
@@ -74,6 +78,9 @@ COLUMN_MAPPING = {
     }
 }
 
+# --workers: archivos en vuelo por proceso lector (cada resultado es un archivo completo en memoria)
+PARALLEL_WINDOW_PER_WORKER = 2
+
 def calculate_file_hash(file_path):
     hash_md5 = hashlib.md5()
     with open(file_path, "rb") as f:
@@ -105,9 +112,6 @@ def get_processed_files():
         logger.error(f"Error al obtener archivos procesados: {str(e)}")
         return {}
 
-def is_excel_file(filename):
-    return (filename.endswith(('.xlsx', '.xls')) and not filename.startswith('~$'))
-
 def detect_version_structure(filename: str, headers: List[str]) -> str:
     year_match = re.search(r'20(1[5-9]|2[0-4])', filename)
     if year_match:
@@ -195,7 +199,8 @@ def create_split_tables():
             conn.execute(create_corporaciones_query)
             
             try:
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_principal_folio ON principal(FOLIO)"))
+                # FOLIO ya tiene el índice de su restricción UNIQUE
+                conn.execute(text("DROP INDEX IF EXISTS idx_principal_folio"))
                 conn.execute(text("CREATE INDEX IF NOT EXISTS idx_principal_fecha ON principal(FECHA)"))
                 conn.execute(text("CREATE INDEX IF NOT EXISTS idx_corporaciones_folio ON corporaciones(FOLIO)"))
                 conn.execute(text("CREATE INDEX IF NOT EXISTS idx_corporaciones_corporacion ON corporaciones(CORPORACION)"))
@@ -209,12 +214,24 @@ def create_split_tables():
         logger.error(f"ERROR: Error creando tablas: {str(e)}")
         raise
 
+def aggregate_comments(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Comentarios únicos por FOLIO unidos con " | " en orden de aparición (determinista), con
+    agrupacion.unir_por_grupo.
+    """
+    folios = pd.Index(df['folio'].drop_duplicates(), name='folio').sort_values()
+    piezas = pd.DataFrame({'folio': df['folio'], 'comentarios': df['comentarios'].astype(str).str.strip()})
+    piezas = piezas[piezas['comentarios'] != ''].drop_duplicates()
+    if piezas.empty:
+        return pd.DataFrame({'folio': folios, 'comentarios': ''})
+
+    comentarios = agrupacion.unir_por_grupo(piezas, ['folio'], 'comentarios')
+    return pd.DataFrame({'folio': folios, 'comentarios': comentarios.reindex(folios).fillna('').to_numpy()})
+
 def split_data_into_tables(df: pd.DataFrame, filename: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
     logger.info(f"SPLIT: Dividiendo datos de {filename} en 2 tablas...")
     
-    df_comentarios_agg = df.groupby('folio').agg({
-        'comentarios': lambda x: ' | '.join(filter(None, set(x.astype(str).str.strip()))),
-    }).reset_index()
+    df_comentarios_agg = aggregate_comments(df)
 
     df_principal = df.drop_duplicates(subset=['folio'], keep='first').copy()
     
@@ -267,82 +284,128 @@ def filter_new_data(df_principal: pd.DataFrame, df_corporaciones: pd.DataFrame,
     
     return df_principal_new, df_corporaciones_new
 
-def process_excel_file_split(file_path: str) -> bool:
-    try:
-        filename = os.path.basename(file_path)
-        logger.info(f"\nPROCESANDO: Procesando archivo: {filename}")
-
-        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
-        sheet = wb.active
-        
-        headers = [str(cell.value).strip() if cell.value is not None else f'columna_{i+1}' for i, cell in enumerate(next(sheet.rows))]
+def prepare_file(file_path: str) -> Tuple[str, Optional[pd.DataFrame], Optional[pd.DataFrame]]:
+    """Lee, transforma y divide un archivo (sin tocar la base). Devuelve (version, df_principal, df_corporaciones)"""
+    filename = os.path.basename(file_path)
+    with lectores.abrir_lector(file_path) as reader:
+        headers = [str(v).strip() if v is not None else f'columna_{i+1}' for i, v in enumerate(reader.encabezados())]
         
         version = detect_version_structure(filename, headers)
-        logger.info(f"VERSION: Versión detectada: {version}")
+        logger.info(f"VERSION: Versión detectada para {filename}: {version}")
 
         transformed_data = []
-        for i, row in enumerate(sheet.iter_rows(min_row=2)):
-            row_data = [cell.value for cell in row]
+        for row_data in reader.filas():
             if any(x is not None for x in row_data):
                 transformed_row = transform_row_data(row_data, version, headers)
                 transformed_row['origen_archivo'] = filename
                 transformed_data.append(transformed_row)
 
-        if not transformed_data:
-            logger.warning(f"WARNING: No se encontraron datos válidos en {filename}")
-            return False
+    if not transformed_data:
+        return version, None, None
 
-        df_unified = pd.DataFrame(transformed_data)
-        df_unified.columns = [c.strip().lower() for c in df_unified.columns]
-        df_unified['fecha'] = pd.to_datetime(df_unified['fecha'], errors='coerce').dt.date
+    df_unified = pd.DataFrame(transformed_data)
+    df_unified.columns = [c.strip().lower() for c in df_unified.columns]
+    df_unified['fecha'] = pd.to_datetime(df_unified['fecha'], errors='coerce').dt.date
 
-        df_principal, df_corporaciones = split_data_into_tables(df_unified, filename)
-        
-        existing_folios_principal = get_existing_folios()
-        
-        df_principal_new, df_corporaciones_new = filter_new_data(
-            df_principal, df_corporaciones, existing_folios_principal
-        )
-        
-        if len(df_principal_new) == 0 and len(df_corporaciones_new) == 0:
-            logger.info(f"INFO: No hay datos nuevos en {filename}")
-            return True
-        
-        # Cargar datos
-        if not df_principal_new.empty:
-            df_principal_new.to_sql('principal', con=engine, if_exists='append', index=False)
-            logger.info(f"OK: Tabla PRINCIPAL actualizada con {len(df_principal_new)} filas nuevas")
-        
-        if not df_corporaciones_new.empty:
-            df_corporaciones_new.to_sql('corporaciones', con=engine, if_exists='append', index=False)
-            logger.info(f"OK: Tabla CORPORACIONES actualizada con {len(df_corporaciones_new)} filas nuevas")
+    df_principal, df_corporaciones = split_data_into_tables(df_unified, filename)
+    return version, df_principal, df_corporaciones
 
-        file_hash = calculate_file_hash(file_path)
-        with engine.connect() as conn:
-            conn.execute(
-                text("""
-                    INSERT INTO processed_files_split (filename, file_hash, processed_date, version_estructura, 
-                     filas_principales, filas_corporaciones) 
-                    VALUES (:filename, :file_hash, :processed_date, :version_estructura,
-                            :filas_principales, :filas_corporaciones)
-                """),
-                {
-                    "filename": filename, "file_hash": file_hash, "processed_date": datetime.now(),
-                    "version_estructura": version, "filas_principales": len(df_principal_new),
-                    "filas_corporaciones": len(df_corporaciones_new)
-                }
-            )
-            conn.commit()
+def load_prepared_file(file_path: str, version: str, df_principal: Optional[pd.DataFrame], df_corporaciones: Optional[pd.DataFrame]) -> bool:
+    """Filtra folios ya existentes, carga las 2 tablas y registra el archivo como procesado"""
+    filename = os.path.basename(file_path)
+    if df_principal is None:
+        logger.warning(f"WARNING: No se encontraron datos válidos en {filename}")
+        return False
 
-        logger.info(f"OK: Archivo {filename} procesado y acumulado exitosamente")
+    existing_folios_principal = get_existing_folios()
+    
+    df_principal_new, df_corporaciones_new = filter_new_data(
+        df_principal, df_corporaciones, existing_folios_principal
+    )
+    
+    if len(df_principal_new) == 0 and len(df_corporaciones_new) == 0:
+        logger.info(f"INFO: No hay datos nuevos en {filename}")
         return True
+    
+    # Cargar datos
+    if not df_principal_new.empty:
+        df_principal_new.to_sql('principal', con=engine, if_exists='append', index=False)
+        logger.info(f"OK: Tabla PRINCIPAL actualizada con {len(df_principal_new)} filas nuevas")
+    
+    if not df_corporaciones_new.empty:
+        df_corporaciones_new.to_sql('corporaciones', con=engine, if_exists='append', index=False)
+        logger.info(f"OK: Tabla CORPORACIONES actualizada con {len(df_corporaciones_new)} filas nuevas")
+
+    file_hash = calculate_file_hash(file_path)
+    with engine.connect() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO processed_files_split (filename, file_hash, processed_date, version_estructura, 
+                 filas_principales, filas_corporaciones) 
+                VALUES (:filename, :file_hash, :processed_date, :version_estructura,
+                        :filas_principales, :filas_corporaciones)
+            """),
+            {
+                "filename": filename, "file_hash": file_hash, "processed_date": datetime.now(),
+                "version_estructura": version, "filas_principales": len(df_principal_new),
+                "filas_corporaciones": len(df_corporaciones_new)
+            }
+        )
+        conn.commit()
+
+    logger.info(f"OK: Archivo {filename} procesado y acumulado exitosamente")
+    return True
 
+def _log_file_error(filename: str, e: Exception):
+    logger.error(f"ERROR: Error procesando {filename}: {str(e)}")
+    import traceback
+    logger.error(traceback.format_exc())
+
+def process_excel_file_split(file_path: str) -> bool:
+    filename = os.path.basename(file_path)
+    try:
+        logger.info(f"\nPROCESANDO: Procesando archivo: {filename}")
+        return load_prepared_file(file_path, *prepare_file(file_path))
     except Exception as e:
-        logger.error(f"ERROR: Error procesando {filename}: {str(e)}")
-        import traceback
-        logger.error(traceback.format_exc())
+        _log_file_error(filename, e)
         return False
 
+def process_files_parallel(file_paths: List[str], workers: int) -> Tuple[int, int]:
+    """
+    `workers` procesos leen y transforman archivos en paralelo; este proceso carga los resultados
+    uno por uno en el orden de file_paths (el primer archivo gana cada folio). Devuelve (procesados, fallidos).
+    Cada resultado trae los DataFrames completos del archivo, así que solo hay PARALLEL_WINDOW_PER_WORKER
+    archivos por proceso en vuelo: el siguiente se envía cuando se termina de cargar uno.
+    """
+    processed = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        remaining = iter(file_paths)
+        in_flight = deque()
+
+        def submit_next():
+            file_path = next(remaining, None)
+            if file_path is not None:
+                in_flight.append((file_path, pool.submit(prepare_file, file_path)))
+
+        for _ in range(workers * PARALLEL_WINDOW_PER_WORKER):
+            submit_next()
+        while in_flight:
+            file_path, future = in_flight.popleft()
+            filename = os.path.basename(file_path)
+            try:
+                logger.info(f"\nPROCESANDO: Cargando archivo: {filename}")
+                ok = load_prepared_file(file_path, *future.result())
+            except Exception as e:
+                _log_file_error(filename, e)
+                ok = False
+            del future
+            submit_next()
+            if ok:
+                processed += 1
+            else:
+                failed += 1
+    return processed, failed
+
 def verify_integrity():
     try:
         with engine.connect() as conn:
@@ -368,7 +431,7 @@ def verify_integrity():
         logger.error(f"ERROR: Error verificando integridad: {str(e)}")
         return False
 
-def main():
+def main(workers: int = 1):
     data_folder = 'DATA'
     logger.info("INICIANDO: Proceso de ETL con estructura de 2 tablas...")
 
@@ -377,15 +440,16 @@ def main():
         return
 
     create_split_tables()
-    excel_files = [f for f in os.listdir(data_folder) if is_excel_file(f)]
+    excel_files = sorted(f for f in os.listdir(data_folder) if lectores.is_input_file(f))
     if not excel_files:
-        logger.warning(f"ERROR: No se encontraron archivos Excel en {data_folder}")
+        logger.warning(f"ERROR: No se encontraron archivos Excel o CSV en {data_folder}")
         return
 
     processed_files = get_processed_files()
     logger.info(f"ARCHIVOS: {len(excel_files)} archivos encontrados. {len(processed_files)} ya procesados.")
     
     summary = {"processed": 0, "skipped": 0, "failed": 0}
+    pending = []
     for excel_file in excel_files:
         file_path = os.path.join(data_folder, excel_file)
         file_hash = calculate_file_hash(file_path)
@@ -394,16 +458,25 @@ def main():
             logger.info(f"SALTANDO: {excel_file} (ya procesado)")
             summary["skipped"] += 1
             continue
-        
-        if process_excel_file_split(file_path):
-            summary["processed"] += 1
-        else:
-            summary["failed"] += 1
+        pending.append(file_path)
+
+    if workers > 1 and len(pending) > 1:
+        logger.info(f"PARALELO: {len(pending)} archivos con {workers} procesos de lectura")
+        summary["processed"], summary["failed"] = process_files_parallel(pending, workers)
+    else:
+        for file_path in pending:
+            if process_excel_file_split(file_path):
+                summary["processed"] += 1
+            else:
+                summary["failed"] += 1
 
     verify_integrity()
     logger.info("\nRESUMEN: Proceso de acumulación finalizado:")
     logger.info(f"   - Procesados: {summary['processed']}, Saltados: {summary['skipped']}, Fallidos: {summary['failed']}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="ETL de 2 tablas (principal, corporaciones)")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos de lectura en paralelo (1 = secuencial)")
+    args = parser.parse_args()
+    main(workers=args.workers)
     logger.info("\nCOMPLETADO: Proceso de ETL finalizado.")
@@ -1,14 +1,35 @@
 # -*- coding: utf-8 -*- 
 # -*- coding: utf-8 -*-
 import pandas as pd
+import numpy as np
+from pandas.api.types import union_categoricals
 import os
+import argparse
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import psycopg2
 from sqlalchemy import create_engine, inspect, text
-from datetime import datetime, date
-import openpyxl
+from datetime import datetime, date, timedelta
 import hashlib
+import io
+import json
 import logging
 import re
-from typing import Dict, List, Tuple, Optional 
+from itertools import islice
+from typing import Dict, Iterator, List, Tuple, Optional 
+import agrupacion
+import analitico
+import lectores
+import perfil
+
+try:
+    from watchfiles import Change, watch
+except ImportError:
+    watch = None
 
 """ESTE CODIGO TRANSFORMA ARCHIVOS EXCEL CON DIFERENTES ESTRUCTURAS HISTÓRICAS (2015-2024) 
 A UN FORMATO UNIFICADO Y LUEGO LOS DIVIDE EN 3 TABLAS RELACIONADAS PARA POSTGRESQL"""
@@ -144,13 +165,295 @@ COLUMN_MAPPING = {
     }
 }
 
-def calculate_file_hash(file_path):
-    """Calcula el hash MD5 de un archivo"""
-    hash_md5 = hashlib.md5()
+# Tablas destino en orden de carga (la padre primero por las FK)
+SPLIT_TABLES = ["principal", "corporaciones", "comentarios"]
+
+# Modo --upsert: un folio que ya existe se actualiza si su contenido cambió (por defecto se ignora)
+UPSERT_MODE = False
+
+# Columnas que definen el contenido de una fila (sin folio ni metadatos de carga); su hash MD5 se
+# guarda en hash_contenido para detectar cambios en modo upsert
+CONTENT_HASH_COLUMNS = {
+    "principal": [
+        'fecha','telefono','ubicacion','colonia','municipio','tipo','makedesc','model','color','vyr',
+        'vlic','st','additional','clsdesc','operador','despachador','unidad','div','chlname','chfname',
+        'origen','latitud','longitud','procedente','sector','personasinv','vehiculosinv'
+    ],
+    "corporaciones": [
+        'corporacion','rcbd','desp','lleg','libr','t1','t2','t3','t4','tmptipificacion','tmpdespacho'
+    ],
+}
+
+# Lector de archivos: "auto" (calamine si está instalado y el archivo no es muy grande), "calamine" u "openpyxl"
+READER_BACKEND = "auto"
+
+# Tipos en memoria de los DataFrames del ETL. Los valores siguen siendo el texto que se guarda en la
+# base ('' = celda vacía); cambia cómo se guardan mientras el lote pasa por transformación, split y carga:
+# - categoría: columnas de pocos valores que se repiten en todo el lote (un código por fila)
+# - FECHA: datetime64 (NaT = NULL), fecha_carga: un solo timestamp por archivo
+# - el resto (folio, notas, direcciones...): texto libre en string[pyarrow], un búfer por columna
+CATEGORY_COLUMNS = {
+    'municipio', 'colonia', 'tipo', 'corporacion', 'operador', 'despachador', 'origen', 'sector',
+    'procedente', 'st', 'clsdesc', 'div', 'unidad', 'makedesc', 'color', 'version_estructura', 'origen_archivo'
+}
+try:
+    TEXT_DTYPE = pd.StringDtype("pyarrow")
+    pd.array([""], dtype=TEXT_DTYPE)
+except ImportError:
+    TEXT_DTYPE = object  # sin pyarrow: str de Python
+
+# Filas de Excel que se transforman y cargan por lote (la memoria pico depende de este valor, no del archivo)
+CHUNK_SIZE = 50_000
+# Filas que se leen como tuplas de Python antes de pasarlas a columnas tipadas; el lote completo
+# solo existe ya convertido
+TRANSFORM_BLOCK = 5_000
+# --workers: archivos en vuelo por proceso lector (cada uno deja todos sus lotes en disco hasta cargarse)
+PARALLEL_WINDOW_PER_WORKER = 2
+
+# Duraciones de cada corporación en segundos desde RCBD (hora en que se recibió la llamada), con la
+# columna de la que sale cada una. Se calculan al dividir el archivo (add_duration_columns) según
+# DURATION_SOURCE_KIND; NULL si el valor falta, no se reconoce o queda fuera de 0..MAX_DURATION_SECONDS
+DURATION_COLUMNS = {
+    "seg_despacho": ("RCBD", "DESP"),
+    "seg_llegada": ("RCBD", "LLEG"),
+    "seg_solucion": ("RCBD", "LIBR"),
+}
+# Qué trae DESP/LLEG/LIBR en cada estructura: "hora" = hora del día (la duración es la diferencia con
+# RCBD); "duracion" = TIEMPO_DESPACHO/LLEGADA/SOLUCION, tiempo ya transcurrido desde la llamada
+DURATION_SOURCE_KIND = {
+    "principal": "hora",
+    "2024": "duracion",
+    "2015-2023": "duracion",
+}
+# En "hora", una hora final antes de RCBD es un cruce de medianoche (se suma un día); un tiempo
+# transcurrido negativo o mayor a un día es un dato inválido
+MAX_DURATION_SECONDS = 86_400
+_CLOCK_TIME_PATTERN = r'^\s*(?:\d{4}-\d{2}-\d{2}[ T])?([01]?\d|2[0-3]):([0-5]\d)(?::([0-5]\d))?(?:\.\d+)?\s*$'
+# HH:MM[:SS] sin tope de horas, o como lo escribe un timedelta de Python ("1 day, 0:05:00")
+_ELAPSED_TIME_PATTERN = r'^\s*(?:(\d+) days?, )?(\d+):([0-5]\d)(?::([0-5]\d))?(?:\.\d+)?\s*$'
+
+# Índices secundarios de las tablas finales (nombre: tabla(columnas)). FOLIO de principal y de
+# comentarios no lleva índice aparte: ya lo tiene su restricción UNIQUE
+SECONDARY_INDEXES = {
+    "idx_principal_fecha": "principal(FECHA)",
+    "idx_corporaciones_folio": "corporaciones(FOLIO)",
+    "idx_corporaciones_fecha": "corporaciones(fecha_carga)",
+    "idx_corporaciones_corporacion": "corporaciones(CORPORACION)",
+    "idx_corporaciones_seg_despacho": "corporaciones(seg_despacho)",
+    "idx_corporaciones_seg_llegada": "corporaciones(seg_llegada)",
+    "idx_corporaciones_seg_solucion": "corporaciones(seg_solucion)",
+    "idx_comentarios_fecha": "comentarios(fecha_carga)",
+}
+# Índices que la propia carga consulta en modo --upsert (corporaciones actuales de cada folio)
+UPSERT_LOOKUP_INDEXES = {"idx_corporaciones_folio"}
+
+# Carga masiva (--bulk-indexes): "auto" quita los índices secundarios durante la carga y los
+# reconstruye al final (un ordenamiento por índice en lugar de mantenerlos fila por fila) cuando las
+# filas estimadas a cargar son al menos BULK_LOAD_MIN_ROWS y BULK_LOAD_TABLE_FRACTION de las que ya
+# tiene corporaciones; "always" o "never" fuerzan la decisión
+BULK_INDEX_MODE = "auto"
+BULK_LOAD_MIN_ROWS = 500_000
+BULK_LOAD_TABLE_FRACTION = 0.2
+BYTES_PER_ROW_ESTIMATE = 150  # tamaño aproximado de una fila en los .xlsx (filas estimadas = bytes / esto)
+INDEX_MAINTENANCE_WORKERS = 4  # max_parallel_maintenance_workers al reconstruir
+INDEX_MAINTENANCE_MEM = '512MB'
+
+# Verificación de integridad al final de cada corrida: por defecto solo los folios que cargó la
+# corrida (folios_corrida) y los conteos que mantienen los triggers (conteo_filas); la completa
+# recorre las tablas y corre con --verify-full o si la última tiene más de FULL_INTEGRITY_CHECK_DAYS días
+FULL_INTEGRITY_CHECK_DAYS = 7
+
+# Carpeta de entrada y modo daemon (--daemon): un archivo se carga cuando pasan WATCH_DEBOUNCE_MS
+# sin eventos y su tamaño/mtime no cambian durante WATCH_STABLE_SECONDS (copias o guardados a medias)
+DATA_FOLDER = 'DATA'
+WATCH_DEBOUNCE_MS = 2000
+WATCH_STABLE_SECONDS = 1.0
+WATCH_STABLE_TIMEOUT = 300
+
+# Clave del pg_advisory_lock que toma cada corrida: las tablas de paso (staging_*, staging_folios_*,
+# folios_corrida) son compartidas, así que solo puede haber un ETL a la vez sobre la base
+RUN_LOCK_KEY = 7_201_501
+
+# Carpeta de reportes del perfilador (--profile)
+PROFILE_DIR = 'PERFILES'
+
+# Exportar snapshots Parquet para el motor analítico del backend (requiere duckdb y pyarrow)
+EXPORT_PARQUET_SNAPSHOTS = True
+
+# Columnas de baja cardinalidad con diccionario de valores (autocompletado de filtros en /api/values)
+DICTIONARY_COLUMNS = {
+    "principal": ["municipio", "colonia", "tipo", "origen", "operador", "despachador", "sector", "version_estructura"],
+    "corporaciones": ["corporacion"],
+}
+
+def calculate_file_hash(file_path: str, with_md5: bool = False) -> Tuple[str, Optional[str]]:
+    """
+    Calcula en una sola lectura el hash blake2b (16 bytes) del archivo y, si with_md5, también el
+    MD5 con el que se registraban los archivos antes del manifiesto. Devuelve (blake2b, md5 o None)
+    """
+    hash_blake2b = hashlib.blake2b(digest_size=16)
+    hash_md5 = hashlib.md5() if with_md5 else None
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_blake2b.update(chunk)
+            if hash_md5 is not None:
+                hash_md5.update(chunk)
+    return hash_blake2b.hexdigest(), hash_md5.hexdigest() if hash_md5 is not None else None
+
+def create_stage_table():
+    """Tabla de etapas por archivo (tiempos del ETL entre corridas), ligada a processed_files_split"""
+    with engine.connect() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS etapas_archivo (
+                id SERIAL PRIMARY KEY,
+                processed_file_id INTEGER REFERENCES processed_files_split(id) ON DELETE CASCADE,
+                filename VARCHAR(255),
+                fecha TIMESTAMP,
+                etapa VARCHAR(50),
+                filas INTEGER,
+                pared_s DOUBLE PRECISION,
+                cpu_s DOUBLE PRECISION,
+                rss_mb DOUBLE PRECISION,
+                filas_por_s DOUBLE PRECISION
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_etapas_archivo_processed_file ON etapas_archivo(processed_file_id)"))
+        conn.commit()
+
+def create_quarantine_table():
+    """Tabla de cuarentena: filas que no se pudieron cargar, con su archivo, fila de origen y error"""
+    with engine.connect() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS cuarentena (
+                id SERIAL PRIMARY KEY,
+                filename VARCHAR(255) NOT NULL,
+                fila INTEGER,
+                tabla VARCHAR(50) NOT NULL,
+                folio TEXT,
+                datos JSONB NOT NULL,
+                error TEXT,
+                fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_cuarentena_filename ON cuarentena(filename)"))
+        conn.commit()
+
+def save_file_stages(conn, filename: str, processed_file_id: Optional[int], medidor: perfil.Medidor):
+    """Guarda las etapas medidas de un archivo (processed_file_id None si no se registró por no traer datos nuevos)"""
+    if not medidor.etapas:
+        return
+    fecha = datetime.now()
+    conn.execute(
+        text("""
+            INSERT INTO etapas_archivo
+            (processed_file_id, filename, fecha, etapa, filas, pared_s, cpu_s, rss_mb, filas_por_s)
+            VALUES (:processed_file_id, :filename, :fecha, :etapa, :filas, :pared_s, :cpu_s, :rss_mb, :filas_por_s)
+        """),
+        [
+            {"processed_file_id": processed_file_id, "filename": filename, "fecha": fecha,
+             "etapa": e["etapa"], "filas": e["filas"], "pared_s": e["pared_s"], "cpu_s": e["cpu_s"],
+             "rss_mb": e["rss_mb"], "filas_por_s": e["filas_por_s"]}
+            for e in medidor.etapas
+        ]
+    )
+
+def get_ingest_manifest() -> Dict[str, Dict]:
+    """
+    Manifiesto de ingesta: por archivo, tamaño y mtime (para saltar sin leerlo si no cambió), hash
+    del contenido y la marca de agua (filas de datos ya ingeridas + hash de esas filas), con la que
+    un archivo al que solo se le agregaron filas al final se ingiere desde la primera fila nueva.
+    """
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS ingest_manifest (
+                    filename VARCHAR(255) PRIMARY KEY,
+                    file_size BIGINT NOT NULL,
+                    file_mtime_ns BIGINT NOT NULL,
+                    file_hash VARCHAR(32) NOT NULL,
+                    filas_leidas INTEGER,
+                    prefix_hash VARCHAR(32),
+                    updated_at TIMESTAMP
+                )
+            """))
+            conn.commit()
+
+            result = conn.execute(text("""
+                SELECT filename, file_size, file_mtime_ns, file_hash, filas_leidas, prefix_hash
+                FROM ingest_manifest
+            """))
+            return {row.filename: dict(row._mapping) for row in result}
+    except Exception as e:
+        logger.error(f"Error al obtener el manifiesto de ingesta: {str(e)}")
+        return {}
+
+def upsert_manifest(conn, filename: str, file_info: Dict, filas_leidas: Optional[int] = None,
+                    prefix_hash: Optional[str] = None):
+    """Registra el estado del archivo en ingest_manifest (filas_leidas None = sin marca de agua)"""
+    conn.execute(
+        text("""
+            INSERT INTO ingest_manifest
+            (filename, file_size, file_mtime_ns, file_hash, filas_leidas, prefix_hash, updated_at)
+            VALUES (:filename, :file_size, :file_mtime_ns, :file_hash, :filas_leidas, :prefix_hash, :updated_at)
+            ON CONFLICT (filename) DO UPDATE SET
+                file_size = EXCLUDED.file_size,
+                file_mtime_ns = EXCLUDED.file_mtime_ns,
+                file_hash = EXCLUDED.file_hash,
+                filas_leidas = EXCLUDED.filas_leidas,
+                prefix_hash = EXCLUDED.prefix_hash,
+                updated_at = EXCLUDED.updated_at
+        """),
+        {
+            "filename": filename,
+            "file_size": file_info["file_size"],
+            "file_mtime_ns": file_info["file_mtime_ns"],
+            "file_hash": file_info["file_hash"],
+            "filas_leidas": filas_leidas,
+            "prefix_hash": prefix_hash,
+            "updated_at": datetime.now(),
+        }
+    )
+
+def touch_manifest(filename: str, file_info: Dict):
+    """Actualiza tamaño/mtime de un archivo cuyo contenido no cambió (conserva la marca de agua)"""
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+                UPDATE ingest_manifest
+                SET file_size = :file_size, file_mtime_ns = :file_mtime_ns, updated_at = :updated_at
+                WHERE filename = :filename
+            """),
+            {"filename": filename, "file_size": file_info["file_size"],
+             "file_mtime_ns": file_info["file_mtime_ns"], "updated_at": datetime.now()}
+        )
+
+class RowWatermark:
+    """
+    Cuenta y hashea (blake2b) los encabezados y las filas que entrega el lector, incluidas las
+    vacías, para guardar la marca de agua del archivo al terminar de cargarlo.
+    """
+
+    def __init__(self, headers: List[str]):
+        self._hasher = hashlib.blake2b(repr(headers).encode(), digest_size=16)
+        self.filas = 0
+        self.skipped = 0
+        self.prefix_hash = None
+
+    def track(self, rows: Iterator[tuple]) -> Iterator[tuple]:
+        for row in rows:
+            self._hasher.update(repr(row).encode())
+            self.filas += 1
+            yield row
+
+    def digest(self) -> str:
+        return self._hasher.hexdigest()
+
+    def finish(self) -> "RowWatermark":
+        """Fija prefix_hash; después de esto el objeto se puede enviar entre procesos"""
+        if self._hasher is not None:
+            self.prefix_hash = self._hasher.hexdigest()
+            self._hasher = None
+        return self
 
 def get_processed_files():
     """Obtiene la lista de archivos ya procesados desde la base de datos"""
@@ -170,6 +473,10 @@ def get_processed_files():
                 )
             """)
             conn.execute(create_table_query)
+            # Conteo por folio: nuevos, con cambios (modo upsert) y sin cambios (solo en modo upsert)
+            # y filas del archivo que quedaron en cuarentena
+            for column in ["folios_insertados", "folios_actualizados", "folios_sin_cambios", "filas_cuarentena"]:
+                conn.execute(text(f"ALTER TABLE processed_files_split ADD COLUMN IF NOT EXISTS {column} INTEGER"))
             conn.commit()
             
             # Obtener lista de archivos procesados
@@ -180,11 +487,6 @@ def get_processed_files():
         logger.error(f"Error al obtener archivos procesados: {str(e)}")
         return {}
 
-def is_excel_file(filename):
-    """Verifica si el archivo es un Excel válido (ignora archivos temporales)"""
-    return (filename.endswith(('.xlsx', '.xls')) and 
-            not filename.startswith('~$'))
-
 def detect_version_structure(filename: str, headers: List[str]) -> str:
     """
     Detecta la versión de estructura basándose en el nombre del archivo y los headers
@@ -250,81 +552,70 @@ def get_column_index(column_ref: str) -> int:
         result = result * 26 + (ord(char.upper()) - ord('A') + 1)
     return result - 1
 
-def extract_column_value(row_data: List, column_ref: str) -> str:
-    """Extrae valor de una columna específica usando referencia Excel"""
-    try:
-        index = get_column_index(column_ref)
-        if index < len(row_data):
-            value = row_data[index]
-            if value is None:
-                return ""
-            elif isinstance(value, (datetime, date)):
-                return str(value)
-            else:
-                return str(value)
-        return ""
-    except:
-        return ""
-
-def combine_columns(row_data: List, column_refs: List[str]) -> str:
-    """Combina múltiples columnas en un solo valor"""
-    values = []
-    for ref in column_refs:
-        value = extract_column_value(row_data, ref)
-        if value and value.strip():
-            values.append(value.strip())
-    return " | ".join(values)
-
-def transform_row_data(row_data: List, version: str, headers: List[str] = None) -> Dict:
-    """
-    Transforma una fila de datos según la versión de estructura
-    """
-    transformed = {}
-    mapping = COLUMN_MAPPING.get(version, {})
-    
-    for target_col, source_info in mapping.items():
+def compile_extraction_plan(version: str, headers: List[str] = None) -> List[Tuple[str, List[int]]]:
+    """
+    Compila COLUMN_MAPPING de la versión a un plan posicional, una sola vez por archivo:
+    [(columna_destino, [índices 0-based de las columnas fuente])]. Lista vacía = columna sin fuente.
+    """
+    plan = []
+    for target_col, source_info in COLUMN_MAPPING.get(version, {}).items():
+        indices = []
         if isinstance(source_info, str):
-            # Mapeo directo (estructura principal) - buscar en headers
-            if headers:
-                try:
-                    # Buscar el índice de la columna en los headers
-                    col_index = headers.index(source_info)
-                    if col_index < len(row_data):
-                        value = row_data[col_index]
-                        # Convertir a string de forma segura
-                        if value is None:
-                            transformed[target_col] = ""
-                        elif isinstance(value, (datetime, date)):
-                            transformed[target_col] = str(value)
-                        else:
-                            transformed[target_col] = str(value)
-                    else:
-                        transformed[target_col] = ""
-                except ValueError:
-                    # Si no encuentra la columna, usar valor vacío
-                    transformed[target_col] = ""
-            else:
-                transformed[target_col] = ""
-        elif isinstance(source_info, tuple):
-            if len(source_info) == 2:
-                if isinstance(source_info[1], str):
-                    # Mapeo simple con referencia de columna
-                    value = extract_column_value(row_data, source_info[1])
-                    transformed[target_col] = str(value) if value else ""
-                elif isinstance(source_info[1], list):
-                    # Mapeo de columnas combinadas
-                    value = combine_columns(row_data, source_info[1])
-                    transformed[target_col] = str(value) if value else ""
-            else:
-                transformed[target_col] = ""
+            # Mapeo directo (estructura principal) - posición del header
+            if headers and source_info in headers:
+                indices = [headers.index(source_info)]
+        elif isinstance(source_info, tuple) and len(source_info) == 2:
+            # Referencia Excel simple ("B") o columnas combinadas (["AM", "AP"])
+            refs = source_info[1] if isinstance(source_info[1], list) else [source_info[1]]
+            indices = [get_column_index(ref) for ref in refs]
+        plan.append((target_col, indices))
+    return plan
+
+def _column_as_text(values) -> List[str]:
+    """Valores de una columna como texto ('' para celdas vacías)"""
+    return ["" if value is None else str(value) for value in values]
+
+def _typed_column(target_col: str, values: List[str]):
+    """Columna de texto con el tipo en memoria del plan (CATEGORY_COLUMNS o TEXT_DTYPE)"""
+    if target_col.lower() in CATEGORY_COLUMNS:
+        return pd.Categorical(values)
+    return pd.array(values, dtype=TEXT_DTYPE)
+
+def _constant_category(value: str, total: int) -> pd.Categorical:
+    """Columna categórica con el mismo valor en todas las filas (metadatos del archivo)"""
+    return pd.Categorical.from_codes(np.zeros(total, dtype=np.int8), [value])
+
+def transform_rows(rows: List[tuple], plan: List[Tuple[str, List[int]]], version: str, filename: str,
+                   fecha_carga: Optional[datetime] = None) -> pd.DataFrame:
+    """
+    Transforma las filas de un archivo al formato unificado construyendo cada columna completa
+    a partir de su posición en el plan (en lugar de un diccionario por fila).
+    """
+    total = len(rows)
+    width = max((i for _, indices in plan for i in indices), default=-1) + 1
+    # Filas más cortas que el plan (celdas finales vacías) se completan con None
+    rows = [row if len(row) >= width else tuple(row) + (None,) * (width - len(row)) for row in rows]
+    source_columns = list(zip(*rows)) if rows else []
+
+    # Cada columna se convierte a su tipo del plan apenas se arma (sin tener todas como listas de str)
+    data = {}
+    for target_col, indices in plan:
+        if not indices or not source_columns:
+            values = [""] * total
+        elif len(indices) == 1:
+            values = _column_as_text(source_columns[indices[0]])
         else:
-            transformed[target_col] = ""
-    
-    # Agregar campos de metadatos
-    transformed['fecha_carga'] = datetime.now()
-    transformed['version_estructura'] = str(version)
-    
-    return transformed
+            # Columnas combinadas: valores no vacíos unidos con " | "
+            parts = [[value.strip() for value in _column_as_text(source_columns[i])] for i in indices]
+            values = [" | ".join(filter(None, values)) for values in zip(*parts)]
+        data[target_col] = _typed_column(target_col, values)
+
+    df = pd.DataFrame(data, copy=False)
+    # Metadatos (un solo timestamp por archivo)
+    df['fecha_carga'] = fecha_carga or datetime.now()
+    df['version_estructura'] = _constant_category(str(version), total)
+    df['origen_archivo'] = _constant_category(filename, total)
+    return df
 
 def create_split_tables():
     """Crea las 3 tablas separadas con la estructura optimizada y relaciones"""
@@ -364,11 +655,12 @@ def create_split_tables():
                     VEHICULOSINV TEXT,
                     fecha_carga TIMESTAMP,
                     version_estructura TEXT,
-                    origen_archivo TEXT
+                    origen_archivo TEXT,
+                    hash_contenido TEXT
                 )
             """)
             conn.execute(create_principal_query)
-            
+
             # 2. Tabla CORPORACIONES (múltiples corporaciones por folio) - TABLA HIJA
             create_corporaciones_query = text("""
                 CREATE TABLE IF NOT EXISTS corporaciones (
@@ -386,6 +678,7 @@ def create_split_tables():
                     TMPTIPIFICACION TEXT,
                     TMPDESPACHO TEXT,
                     fecha_carga TIMESTAMP,
+                    hash_contenido TEXT,
                     CONSTRAINT fk_corporaciones_principal 
                     FOREIGN KEY (FOLIO) REFERENCES principal(FOLIO) 
                     ON DELETE CASCADE ON UPDATE CASCADE
@@ -409,26 +702,60 @@ def create_split_tables():
                 )
             """)
             conn.execute(create_comentarios_query)
+
+            # Tablas creadas antes del modo upsert
+            conn.execute(text("ALTER TABLE principal ADD COLUMN IF NOT EXISTS hash_contenido TEXT"))
+            conn.execute(text("ALTER TABLE corporaciones ADD COLUMN IF NOT EXISTS hash_contenido TEXT"))
+            # Duraciones en segundos (add_duration_columns)
+            for column in DURATION_COLUMNS:
+                conn.execute(text(f"ALTER TABLE corporaciones ADD COLUMN IF NOT EXISTS {column} INTEGER"))
             
-            # Crear índices para optimizar JOINs y consultas
+            # Crear índices para optimizar JOINs y consultas (también recrea los que una carga masiva
+            # interrumpida no alcanzó a reconstruir)
             try:
-                # Índices para la tabla principal
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_principal_folio ON principal(FOLIO)"))
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_principal_fecha ON principal(FECHA)"))
-                
-                # Índices para la tabla corporaciones
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_corporaciones_folio ON corporaciones(FOLIO)"))
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_corporaciones_fecha ON corporaciones(fecha_carga)"))
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_corporaciones_corporacion ON corporaciones(CORPORACION)"))
-                
-                # Índices para la tabla comentarios
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_comentarios_folio ON comentarios(FOLIO)"))
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_comentarios_fecha ON comentarios(fecha_carga)"))
+                for index_name, definition in SECONDARY_INDEXES.items():
+                    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index_name} ON {definition}"))
+
+                # Duplicaban el índice de la restricción UNIQUE (FOLIO) y encarecían cada inserción
+                conn.execute(text("DROP INDEX IF EXISTS idx_principal_folio"))
+                conn.execute(text("DROP INDEX IF EXISTS idx_comentarios_folio"))
                 
                 logger.info("OK: Índices creados/verificados exitosamente")
             except Exception as e:
                 logger.warning(f"WARNING: Error creando índices (pueden ya existir): {str(e)}")
             
+            # Tablas de paso UNLOGGED para la carga masiva con COPY (mismas columnas, sin restricciones)
+            for table_name in SPLIT_TABLES:
+                conn.execute(text(f"""
+                    CREATE UNLOGGED TABLE IF NOT EXISTS staging_{table_name}
+                    AS SELECT * FROM {table_name} WITH NO DATA
+                """))
+            for column in DURATION_COLUMNS:
+                conn.execute(text(f"ALTER TABLE staging_corporaciones ADD COLUMN IF NOT EXISTS {column} INTEGER"))
+            # Folios que el archivo en curso agregó a principal / comentarios (deduplicación en la base);
+            # en modo upsert, todos los folios del archivo con su estado, y los del lote en curso
+            conn.execute(text("CREATE UNLOGGED TABLE IF NOT EXISTS staging_folios_principal (FOLIO TEXT PRIMARY KEY)"))
+            conn.execute(text("ALTER TABLE staging_folios_principal ADD COLUMN IF NOT EXISTS estado TEXT NOT NULL DEFAULT 'insertado'"))
+            conn.execute(text("CREATE UNLOGGED TABLE IF NOT EXISTS staging_folios_comentarios (FOLIO TEXT PRIMARY KEY)"))
+            conn.execute(text("""
+                CREATE UNLOGGED TABLE IF NOT EXISTS staging_folios_lote (
+                    FOLIO TEXT PRIMARY KEY,
+                    estado TEXT NOT NULL DEFAULT 'sin_cambios'
+                )
+            """))
+            # Folios que cargó la corrida en curso (verificación de integridad incremental)
+            conn.execute(text("CREATE UNLOGGED TABLE IF NOT EXISTS folios_corrida (FOLIO TEXT PRIMARY KEY)"))
+            # Versión de los datos (una fila): el backend la usa para los ETag de sus respuestas
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS version_datos (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version BIGINT NOT NULL,
+                    actualizado TIMESTAMP
+                )
+            """))
+            create_integrity_tables(conn)
+            create_data_version_triggers(conn)
+
             conn.commit()
             logger.info("OK: Tablas separadas con relaciones creadas/verificadas exitosamente")
             logger.info("   - PRINCIPAL: Tabla padre con FOLIO único")
@@ -439,6 +766,177 @@ def create_split_tables():
         logger.error(f"ERROR: Error creando tablas separadas: {str(e)}")
         raise
 
+# Conteo de filas por tabla mantenido por triggers de sentencia (tablas de transición): una
+# actualización por INSERT/DELETE, no por fila
+_ROW_COUNTER_TRIGGERS = {
+    "insert": ("AFTER INSERT", "REFERENCING NEW TABLE AS nuevas", "filas + (SELECT COUNT(*) FROM nuevas)"),
+    "delete": ("AFTER DELETE", "REFERENCING OLD TABLE AS borradas", "filas - (SELECT COUNT(*) FROM borradas)"),
+    "truncate": ("AFTER TRUNCATE", "", "0"),
+}
+
+def create_integrity_tables(conn):
+    """
+    Conteos mantenidos (conteo_filas y sus triggers en las 3 tablas) e historial de verificaciones
+    (verificaciones_integridad). El conteo de una tabla se inicializa con COUNT(*) solo la primera
+    vez, dentro de la transacción que crea sus triggers (que bloquea escrituras mientras tanto).
+    """
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS conteo_filas (
+            tabla VARCHAR(50) PRIMARY KEY,
+            filas BIGINT NOT NULL,
+            actualizado TIMESTAMP
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS verificaciones_integridad (
+            id SERIAL PRIMARY KEY,
+            fecha TIMESTAMP,
+            modo VARCHAR(20),
+            folios_verificados INTEGER,
+            huerfanos_corporaciones BIGINT,
+            huerfanos_comentarios BIGINT,
+            total_principal BIGINT,
+            total_corporaciones BIGINT,
+            total_comentarios BIGINT,
+            duracion_s DOUBLE PRECISION,
+            ok BOOLEAN
+        )
+    """))
+    for event, (_, _, new_value) in _ROW_COUNTER_TRIGGERS.items():
+        conn.execute(text(f"""
+            CREATE OR REPLACE FUNCTION conteo_filas_{event}() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                UPDATE conteo_filas SET filas = {new_value}, actualizado = now() WHERE tabla = TG_TABLE_NAME;
+                RETURN NULL;
+            END $$
+        """))
+    for table_name in SPLIT_TABLES:
+        for event, (timing, transition, _) in _ROW_COUNTER_TRIGGERS.items():
+            conn.execute(text(f"""
+                CREATE OR REPLACE TRIGGER trg_conteo_{table_name}_{event} {timing} ON {table_name}
+                {transition} FOR EACH STATEMENT EXECUTE FUNCTION conteo_filas_{event}()
+            """))
+        seeded = conn.execute(text("SELECT 1 FROM conteo_filas WHERE tabla = :tabla"), {"tabla": table_name}).scalar()
+        if not seeded:
+            conn.execute(text(f"INSERT INTO conteo_filas (tabla, filas, actualizado) SELECT :tabla, COUNT(*), now() FROM {table_name}"),
+                         {"tabla": table_name})
+
+# Triggers de sentencia que incrementan version_datos con cada escritura en las 3 tablas (también las
+# de ETL.py o de un UPDATE manual); las sentencias que no tocaron filas no cambian la versión
+_DATA_VERSION_TRIGGERS = {
+    "insert": "REFERENCING NEW TABLE AS filas",
+    "update": "REFERENCING NEW TABLE AS filas",
+    "delete": "REFERENCING OLD TABLE AS filas",
+    "truncate": "",
+}
+
+def create_data_version_triggers(conn):
+    """Función y triggers de _DATA_VERSION_TRIGGERS (el ETag del backend cambia en cuanto se confirma la escritura)"""
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION version_datos_incrementar() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP <> 'TRUNCATE' THEN
+                IF NOT EXISTS (SELECT 1 FROM filas) THEN
+                    RETURN NULL;
+                END IF;
+            END IF;
+            INSERT INTO version_datos (id, version, actualizado) VALUES (1, 1, now())
+            ON CONFLICT (id) DO UPDATE SET version = version_datos.version + 1, actualizado = EXCLUDED.actualizado;
+            RETURN NULL;
+        END $$
+    """))
+    for table_name in SPLIT_TABLES:
+        for event, transition in _DATA_VERSION_TRIGGERS.items():
+            conn.execute(text(f"""
+                CREATE OR REPLACE TRIGGER trg_version_{table_name}_{event} AFTER {event.upper()} ON {table_name}
+                {transition} FOR EACH STATEMENT EXECUTE FUNCTION version_datos_incrementar()
+            """))
+
+def create_value_dictionary_table():
+    """Crea la tabla de diccionarios de valores por columna y su índice de trigramas"""
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS diccionario_valores (
+                    tabla TEXT NOT NULL,
+                    columna TEXT NOT NULL,
+                    valor TEXT NOT NULL,
+                    conteo BIGINT NOT NULL,
+                    actualizado TIMESTAMP,
+                    PRIMARY KEY (tabla, columna, valor)
+                )
+            """))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"ERROR: Error creando tabla diccionario_valores: {str(e)}")
+        raise
+
+    # La extensión pg_trgm es opcional: sin ella /api/values sigue funcionando sin búsqueda difusa
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_diccionario_valor_trgm
+                ON diccionario_valores USING gin (valor gin_trgm_ops)
+            """))
+            conn.commit()
+            logger.info("OK: Índice de trigramas para diccionario_valores creado/verificado")
+    except Exception as e:
+        logger.warning(f"WARNING: pg_trgm no disponible, sin búsqueda difusa de valores: {str(e)}")
+
+def refresh_value_dictionaries():
+    """Recalcula los valores distintos (con conteo) de las columnas de DICTIONARY_COLUMNS"""
+    try:
+        with engine.connect() as conn:
+            for tabla, columnas in DICTIONARY_COLUMNS.items():
+                for columna in columnas:
+                    conn.execute(
+                        text("DELETE FROM diccionario_valores WHERE tabla = :tabla AND columna = :columna"),
+                        {"tabla": tabla, "columna": columna}
+                    )
+                    result = conn.execute(
+                        text(f"""
+                            INSERT INTO diccionario_valores (tabla, columna, valor, conteo, actualizado)
+                            SELECT :tabla, :columna, {columna}, COUNT(*), :actualizado
+                            FROM {tabla}
+                            WHERE {columna} IS NOT NULL AND {columna} <> ''
+                            GROUP BY {columna}
+                        """),
+                        {"tabla": tabla, "columna": columna, "actualizado": datetime.now()}
+                    )
+                    logger.info(f"   - Diccionario {tabla}.{columna}: {result.rowcount} valores distintos")
+            conn.commit()
+        logger.info("OK: Diccionarios de valores actualizados")
+    except Exception as e:
+        logger.error(f"ERROR: Error actualizando diccionarios de valores: {str(e)}")
+
+def value_dictionaries_empty() -> bool:
+    """Indica si los diccionarios de valores aún no se han calculado"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT 1 FROM diccionario_valores LIMIT 1")).first() is None
+    except Exception:
+        return True
+
+def aggregate_notes(df: pd.DataFrame, columnas_notas: List[str], separador: str = ' | ') -> pd.DataFrame:
+    """
+    Una fila por FOLIO con las notas únicas de cada columna unidas con separador en orden de
+    aparición (estable entre corridas, lo compara --upsert). Las 4 columnas se procesan juntas
+    en formato largo (folio, columna, valor) sin duplicados y se unen con agrupacion.unir_por_grupo.
+    """
+    folios = pd.Index(df['folio'].drop_duplicates(), name='folio').sort_values()
+    largo = df.melt(id_vars='folio', value_vars=columnas_notas, var_name='columna', value_name='valor')
+    largo = largo[largo['valor'].notna() & (largo['valor'] != '')]
+    if separador != ' | ':
+        # El separador no puede aparecer dentro de una nota (partiría la nota al combinar lotes)
+        largo['valor'] = largo['valor'].astype(object).str.replace(separador, ' ', regex=False)
+    largo = largo.drop_duplicates()
+    if largo.empty:
+        return pd.DataFrame('', index=folios, columns=columnas_notas).reset_index()
+
+    tabla = agrupacion.unir_por_grupo(largo, ['folio', 'columna'], 'valor', separador).unstack('columna')
+    return tabla.reindex(index=folios, columns=columnas_notas).fillna('').rename_axis(columns=None).reset_index()
+
 def split_data_into_tables(df: pd.DataFrame, filename: str) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     Divide los datos unificados en las 3 tablas separadas
@@ -471,15 +969,13 @@ def split_data_into_tables(df: pd.DataFrame, filename: str) -> Tuple[pd.DataFram
     # Filtrar solo las columnas que existen en el DataFrame
     columnas_existentes_corp = [col for col in columnas_corporaciones if col in df.columns]
     df_corporaciones = df[columnas_existentes_corp].copy()
+    version = str(df['version_estructura'].iloc[0]) if len(df) else None
+    df_corporaciones = add_duration_columns(df_corporaciones, version)
     
     # 3. Tabla COMENTARIOS - Obtener comentarios únicos por folio
-    # Agrupar por FOLIO y combinar comentarios únicos
-    df_comentarios = df.groupby('folio').agg({
-        'comentarios': lambda x: ' | '.join(filter(None, set(x.astype(str)))),
-        'mtvocierre': lambda x: ' | '.join(filter(None, set(x.astype(str)))) if 'mtvocierre' in df.columns else '',
-        'notacierre': lambda x: ' | '.join(filter(None, set(x.astype(str)))) if 'notacierre' in df.columns else '',
-        'notasusr': lambda x: ' | '.join(filter(None, set(x.astype(str)))) if 'notasusr' in df.columns else ''
-    }).reset_index()
+    # (las estructuras 2015-2023 y 2024 no traen mtvocierre/notacierre/notasusr)
+    columnas_notas = [col for col in ['comentarios', 'mtvocierre', 'notacierre', 'notasusr'] if col in df.columns]
+    df_comentarios = aggregate_notes(df, columnas_notas, NOTE_SEPARATOR)
     
     # Agregar fecha_carga
     df_comentarios['fecha_carga'] = datetime.now()
@@ -499,259 +995,666 @@ def split_data_into_tables(df: pd.DataFrame, filename: str) -> Tuple[pd.DataFram
     
     return df_principal, df_corporaciones, df_comentarios
 
-def get_existing_folios():
-    """Obtiene los folios que ya existen en las tablas para evitar duplicados"""
+def _seconds_from_text(values: pd.Series, kind: str) -> pd.Series:
+    """Segundos (NaN si el texto no se reconoce) de horas del día ("hora") o de tiempos transcurridos ("duracion")"""
+    if kind == "hora":
+        parts = values.astype(str).str.extract(_CLOCK_TIME_PATTERN).astype(float)
+        return parts[0] * 3600 + parts[1] * 60 + parts[2].fillna(0)
+    parts = values.astype(str).str.extract(_ELAPSED_TIME_PATTERN).astype(float)
+    return parts[0].fillna(0) * 86400 + parts[1] * 3600 + parts[2] * 60 + parts[3].fillna(0)
+
+def add_duration_columns(df_corporaciones: pd.DataFrame, version: Optional[str]) -> pd.DataFrame:
+    """
+    Agrega las columnas de DURATION_COLUMNS leyendo DESP/LLEG/LIBR como indica DURATION_SOURCE_KIND
+    para la estructura del archivo: horas del día se restan de RCBD, tiempos transcurridos se guardan
+    tal cual. Una hora final menor que RCBD cruzó la medianoche y suma un día; fuera de
+    0..MAX_DURATION_SECONDS queda en NULL.
+    """
+    kind = DURATION_SOURCE_KIND.get(version)
+    for column, (start, end) in DURATION_COLUMNS.items():
+        start, end = start.lower(), end.lower()
+        if kind is None or end not in df_corporaciones.columns or (kind == "hora" and start not in df_corporaciones.columns):
+            seconds = pd.Series(np.nan, index=df_corporaciones.index)
+        elif kind == "hora":
+            seconds = _seconds_from_text(df_corporaciones[end], kind) - _seconds_from_text(df_corporaciones[start], kind)
+            seconds = seconds.mask(seconds < 0, seconds + 86400)
+        else:
+            seconds = _seconds_from_text(df_corporaciones[end], kind)
+        df_corporaciones[column] = seconds.where(seconds.between(0, MAX_DURATION_SECONDS)).astype('Int32')
+    return df_corporaciones
+
+def concat_typed_frames(pieces: List[pd.DataFrame]) -> pd.DataFrame:
+    """Une los bloques transformados de un lote conservando los tipos del plan (categorías unidas)"""
+    if len(pieces) == 1:
+        return pieces[0]
+    data = {}
+    for col in pieces[0].columns:
+        parts = [piece[col] for piece in pieces]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            data[col] = union_categoricals(parts)
+        else:
+            data[col] = pd.concat(parts).array
+    index = pieces[0].index.append([piece.index for piece in pieces[1:]])
+    return pd.DataFrame(data, index=index, copy=False)
+
+# Un folio puede aparecer en varios lotes del mismo archivo: las notas del lote nuevo se combinan
+# con las ya cargadas, sin repetir notas y conservando el orden de aparición. En las staging las
+# notas de distintas filas van unidas con NOTE_SEPARATOR (" | " ya separa las piezas de COMENTARIOS
+# dentro de una misma fila); al pasar a la tabla final se unen con " | ". Cada nota nueva se compara
+# completa con las piezas de la nota guardada, no fragmento por fragmento
+NOTE_COLUMNS = ['comentarios', 'mtvocierre', 'notacierre', 'notasusr']
+NOTE_SEPARATOR = '\x1f'
+_MERGE_NOTES_SQL = """COALESCE((
+    SELECT concat_ws(' | ', NULLIF(comentarios.{col}, ''), string_agg(pieza, ' | ' ORDER BY orden))
+    FROM (
+        SELECT pieza, MIN(orden) AS orden
+        FROM unnest(string_to_array(NULLIF(EXCLUDED.{col}, ''), E'\\x1f')) WITH ORDINALITY AS t(pieza, orden)
+        WHERE strpos(' | ' || COALESCE(comentarios.{col}, '') || ' | ', ' | ' || pieza || ' | ') = 0
+        GROUP BY pieza
+    ) piezas
+), '')"""
+
+def _note_source_cols(columns: List[str], own: str) -> str:
+    """
+    Columnas de staging_comentarios para el INSERT: las notas de folios que se van a combinar (own)
+    conservan NOTE_SEPARATOR para _MERGE_NOTES_SQL; las demás entran ya unidas con " | "
+    """
+    return ', '.join(
+        f"CASE WHEN {own} THEN s.{col} ELSE replace(s.{col}, E'\\x1f', ' | ') END" if col in NOTE_COLUMNS else f's.{col}'
+        for col in columns
+    )
+
+def _comentarios_conflict_clause(columns: List[str]) -> str:
+    updates = [f"{col} = {_MERGE_NOTES_SQL.format(col=col)}" for col in columns if col in NOTE_COLUMNS]
+    if 'fecha_carga' in columns:
+        updates.append("fecha_carga = EXCLUDED.fecha_carga")
+    return f"ON CONFLICT (FOLIO) DO UPDATE SET {', '.join(updates)}"
+
+def copy_dataframe(conn, df: pd.DataFrame, table_name: str):
+    """Envía el DataFrame a la tabla con COPY FROM STDIN (CSV en memoria)"""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep='\\N')
+    buffer.seek(0)
+    cursor = conn.connection.driver_connection.cursor()
     try:
-        with engine.connect() as conn:
-            # Obtener folios existentes en tabla principal
-            result_principal = conn.execute(text("SELECT DISTINCT FOLIO FROM principal"))
-            folios_principal = {row[0] for row in result_principal}
-            
-            # Obtener folios existentes en tabla comentarios
-            result_comentarios = conn.execute(text("SELECT DISTINCT FOLIO FROM comentarios"))
-            folios_comentarios = {row[0] for row in result_comentarios}
-            
-            # Obtener folios existentes en tabla corporaciones
-            result_corporaciones = conn.execute(text("SELECT DISTINCT FOLIO FROM corporaciones"))
-            folios_corporaciones = {row[0] for row in result_corporaciones}
-            
-            return folios_principal, folios_comentarios, folios_corporaciones
+        cursor.copy_expert(
+            f"COPY {table_name} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+def _move_from_staging_query(table_name: str, columns: List[str]):
+    """
+    INSERT ... SELECT de staging_<tabla> a la tabla final; la deduplicación se resuelve en la base:
+    - principal: ON CONFLICT DO NOTHING; los folios realmente insertados (RETURNING) se anotan en
+      staging_folios_principal.
+    - corporaciones: solo filas de folios que este archivo agregó a principal.
+    - comentarios: folios sin comentarios previos, o que este archivo ya cargó en un lote anterior
+      (en ese caso se combinan las notas).
+    Devuelve filas nuevas por tabla (rowcount).
+    """
+    cols = ', '.join(columns)
+    source_cols = ', '.join(f's.{col}' for col in columns)
+    if table_name in CONTENT_HASH_COLUMNS:
+        cols += ', hash_contenido'
+        source_cols += f", {_content_hash([f's.{col}' for col in CONTENT_HASH_COLUMNS[table_name]])}"
+    if table_name == 'principal':
+        return text(f"""
+            WITH nuevos AS (
+                INSERT INTO principal ({cols})
+                SELECT {source_cols} FROM staging_principal s
+                ON CONFLICT (FOLIO) DO NOTHING
+                RETURNING FOLIO
+            )
+            INSERT INTO staging_folios_principal (FOLIO) SELECT FOLIO FROM nuevos
+        """)
+    if table_name == 'corporaciones':
+        return text(f"""
+            INSERT INTO corporaciones ({cols})
+            SELECT {source_cols} FROM staging_corporaciones s
+            JOIN staging_folios_principal f ON f.FOLIO = s.FOLIO
+        """)
+    own = "EXISTS (SELECT 1 FROM staging_folios_comentarios f WHERE f.FOLIO = s.FOLIO)"
+    return text(f"""
+        WITH cargados AS (
+            INSERT INTO comentarios ({cols})
+            SELECT {_note_source_cols(columns, own)} FROM staging_comentarios s
+            WHERE NOT EXISTS (SELECT 1 FROM comentarios c WHERE c.FOLIO = s.FOLIO)
+               OR EXISTS (SELECT 1 FROM staging_folios_comentarios f WHERE f.FOLIO = s.FOLIO)
+            {_comentarios_conflict_clause(columns)}
+            RETURNING FOLIO
+        )
+        INSERT INTO staging_folios_comentarios (FOLIO) SELECT FOLIO FROM cargados
+        ON CONFLICT (FOLIO) DO NOTHING
+    """)
+
+def _content_hash(values: List[str]) -> str:
+    """Expresión SQL con el hash MD5 de una fila formada por las expresiones dadas"""
+    return f"md5(ROW({', '.join(values)})::text)"
+
+def _upsert_from_staging_queries(columns: Dict[str, List[str]]) -> List[Tuple[str, str]]:
+    """
+    Modo upsert: consultas (tabla, SQL) que pasan el lote de las staging a las tablas finales.
+    Cada una devuelve las filas escritas. Solo se comparan los folios que el archivo no trajo en un
+    lote anterior (staging_folios_lote); los demás siguen la regla normal: gana la primera fila del
+    archivo en principal, las corporaciones se agregan y las notas se combinan.
+    - principal: INSERT ... ON CONFLICT DO UPDATE solo si cambió el hash del contenido. Las columnas
+      que no trae la estructura del archivo conservan su valor (entran al hash con el valor actual).
+    - corporaciones: no tienen llave natural; por folio se compara el conjunto de hashes de sus filas
+      (en las columnas que trae el archivo) y si difiere se reemplazan todas las filas del folio.
+    - comentarios: se reemplazan si cambiaron las notas.
+    Un folio con filas a ambos lados de un corte de lote puede contarse como actualizado aunque el
+    resultado final sea el mismo.
+    """
+    queries = []
+    principal_cols = columns.get('principal')
+    if principal_cols:
+        cols = ', '.join(principal_cols)
+        source_cols = ', '.join(f's.{col}' for col in principal_cols)
+        hash_cols = CONTENT_HASH_COLUMNS['principal']
+        new_hash = _content_hash([f'EXCLUDED.{col}' if col in principal_cols else f'principal.{col}' for col in hash_cols])
+        updates = ', '.join(f'{col} = EXCLUDED.{col}' for col in principal_cols if col != 'folio')
+        queries.append(('principal', f"""
+            WITH escritos AS (
+                INSERT INTO principal ({cols}, hash_contenido)
+                SELECT {source_cols}, {_content_hash([f's.{col}' for col in hash_cols])}
+                FROM staging_principal s JOIN staging_folios_lote l ON l.FOLIO = s.FOLIO
+                ON CONFLICT (FOLIO) DO UPDATE SET {updates}, hash_contenido = {new_hash}
+                WHERE COALESCE(principal.hash_contenido, {_content_hash([f'principal.{col}' for col in hash_cols])})
+                      IS DISTINCT FROM {new_hash}
+                RETURNING FOLIO, (xmax = 0) AS insertado
+            ), marcados AS (
+                UPDATE staging_folios_lote l
+                SET estado = CASE WHEN e.insertado THEN 'insertado' ELSE 'actualizado' END
+                FROM escritos e WHERE e.FOLIO = l.FOLIO
+            )
+            SELECT COUNT(*) FROM escritos
+        """))
+
+    corp_cols = columns.get('corporaciones')
+    if corp_cols:
+        cols = ', '.join(corp_cols) + ', hash_contenido'
+        hash_cols = CONTENT_HASH_COLUMNS['corporaciones']
+        source_cols = ', '.join(f's.{col}' for col in corp_cols) + f", {_content_hash([f's.{col}' for col in hash_cols])}"
+        compared = [col for col in hash_cols if col in corp_cols]
+        staged_hash = _content_hash([f's.{col}' for col in compared])
+        current_hash = _content_hash([f'c.{col}' for col in compared])
+        if compared == hash_cols:
+            current_hash = f"COALESCE(c.hash_contenido, {current_hash})"
+        queries.append(('corporaciones', f"""
+            WITH nuevas AS (
+                SELECT s.FOLIO, string_agg({staged_hash}, ',' ORDER BY {staged_hash}) AS huella
+                FROM staging_corporaciones s JOIN staging_folios_lote l ON l.FOLIO = s.FOLIO
+                GROUP BY s.FOLIO
+            ), actuales AS (
+                SELECT c.FOLIO, string_agg({current_hash}, ',' ORDER BY {current_hash}) AS huella
+                FROM corporaciones c JOIN nuevas n ON n.FOLIO = c.FOLIO
+                GROUP BY c.FOLIO
+            ), cambiadas AS (
+                SELECT n.FOLIO FROM nuevas n LEFT JOIN actuales a ON a.FOLIO = n.FOLIO
+                WHERE a.huella IS DISTINCT FROM n.huella
+            ), borradas AS (
+                DELETE FROM corporaciones c USING cambiadas x WHERE c.FOLIO = x.FOLIO
+            ), insertadas AS (
+                INSERT INTO corporaciones ({cols})
+                SELECT {source_cols} FROM staging_corporaciones s
+                WHERE s.FOLIO IN (SELECT FOLIO FROM cambiadas)
+                   OR s.FOLIO IN (SELECT FOLIO FROM staging_folios_principal)
+                RETURNING 1
+            ), marcados AS (
+                UPDATE staging_folios_lote l SET estado = 'actualizado'
+                FROM cambiadas x WHERE x.FOLIO = l.FOLIO AND l.estado = 'sin_cambios'
+            )
+            SELECT COUNT(*) FROM insertadas
+        """))
+
+    notes_cols = columns.get('comentarios')
+    if notes_cols:
+        cols = ', '.join(notes_cols)
+        source_cols = _note_source_cols(notes_cols, "EXISTS (SELECT 1 FROM staging_folios_principal f WHERE f.FOLIO = s.FOLIO)")
+        notes = [col for col in notes_cols if col in NOTE_COLUMNS]
+        own = "EXISTS (SELECT 1 FROM staging_folios_principal f WHERE f.FOLIO = EXCLUDED.FOLIO)"
+        updates = [f"{col} = CASE WHEN {own} THEN {_MERGE_NOTES_SQL.format(col=col)} ELSE EXCLUDED.{col} END" for col in notes]
+        if 'fecha_carga' in notes_cols:
+            updates.append("fecha_carga = EXCLUDED.fecha_carga")
+        current = ', '.join(f'comentarios.{col}' for col in notes)
+        staged = ', '.join(f'EXCLUDED.{col}' for col in notes)
+        queries.append(('comentarios', f"""
+            WITH cargados AS (
+                INSERT INTO comentarios ({cols})
+                SELECT {source_cols} FROM staging_comentarios s
+                ON CONFLICT (FOLIO) DO UPDATE SET {', '.join(updates)}
+                WHERE {own} OR ROW({current}) IS DISTINCT FROM ROW({staged})
+                RETURNING FOLIO
+            ), marcados AS (
+                UPDATE staging_folios_lote l SET estado = 'actualizado'
+                FROM cargados x WHERE x.FOLIO = l.FOLIO AND l.estado = 'sin_cambios'
+            )
+            SELECT COUNT(*) FROM cargados
+        """))
+    return queries
+
+def upsert_from_staging(conn, columns: Dict[str, List[str]]) -> Dict[str, int]:
+    """
+    Modo upsert: pasa el lote ya copiado a las staging a las tablas finales (ver
+    _upsert_from_staging_queries). Los folios del lote quedan en staging_folios_principal con su
+    estado (insertado, actualizado o sin_cambios). Devuelve filas escritas por tabla.
+    """
+    conn.execute(text("TRUNCATE staging_folios_lote"))
+    conn.execute(text("""
+        INSERT INTO staging_folios_lote (FOLIO)
+        SELECT s.FOLIO FROM staging_principal s
+        WHERE NOT EXISTS (SELECT 1 FROM staging_folios_principal f WHERE f.FOLIO = s.FOLIO)
+    """))
+    loaded = {table_name: 0 for table_name in SPLIT_TABLES}
+    for table_name, query in _upsert_from_staging_queries(columns):
+        loaded[table_name] = conn.execute(text(query)).scalar()
+    conn.execute(text("INSERT INTO staging_folios_principal (FOLIO, estado) SELECT FOLIO, estado FROM staging_folios_lote"))
+    return loaded
+
+def file_folio_counts(conn) -> Dict[str, int]:
+    """Folios del archivo en curso por estado (insertado / actualizado / sin_cambios)"""
+    result = conn.execute(text("SELECT estado, COUNT(*) FROM staging_folios_principal GROUP BY estado"))
+    return {estado: total for estado, total in result}
+
+def track_run_folios(conn):
+    """Agrega a folios_corrida los folios que el archivo en curso insertó o actualizó"""
+    conn.execute(text("""
+        INSERT INTO folios_corrida (FOLIO)
+        SELECT FOLIO FROM staging_folios_principal WHERE estado <> 'sin_cambios'
+        UNION
+        SELECT FOLIO FROM staging_folios_comentarios
+        ON CONFLICT (FOLIO) DO NOTHING
+    """))
+
+def reset_file_staging(conn):
+    """Vacía las listas de folios del archivo anterior (al iniciar cada archivo)"""
+    conn.execute(text("TRUNCATE staging_folios_principal, staging_folios_comentarios"))
+
+def bulk_load_chunk(conn, df_principal: pd.DataFrame, df_corporaciones: pd.DataFrame, df_comentarios: pd.DataFrame) -> Dict[str, int]:
+    """
+    Carga masiva de un lote: COPY a las tablas staging_* y un INSERT ... SELECT por tabla destino,
+    en orden de FK. Las staging se vacían en cada lote (son UNLOGGED, no generan WAL).
+    """
+    conn.execute(text(f"TRUNCATE {', '.join(f'staging_{t}' for t in SPLIT_TABLES)}"))
+    frames = {"principal": df_principal, "corporaciones": df_corporaciones, "comentarios": df_comentarios}
+    if UPSERT_MODE:
+        columns = {}
+        for table_name, df in frames.items():
+            if len(df) > 0:
+                copy_dataframe(conn, df, f"staging_{table_name}")
+                columns[table_name] = list(df.columns)
+        return upsert_from_staging(conn, columns)
+
+    loaded = {}
+    for table_name in SPLIT_TABLES:
+        df = frames[table_name]
+        loaded[table_name] = 0
+        if len(df) == 0:
+            continue
+        copy_dataframe(conn, df, f"staging_{table_name}")
+        loaded[table_name] = conn.execute(_move_from_staging_query(table_name, list(df.columns))).rowcount
+    return loaded
+
+def load_chunk(conn, df_principal: pd.DataFrame, df_corporaciones: pd.DataFrame, df_comentarios: pd.DataFrame,
+               filename: str) -> Dict[str, int]:
+    """
+    Carga un lote a las 3 tablas dentro de la transacción del archivo (conn), respetando las FK.
+    Devuelve las filas nuevas por tabla y las filas mandadas a cuarentena ("cuarentena"). Si la
+    carga masiva falla, el lote se divide por folios (ver bisect_load): lo que sí se puede cargar
+    entra con COPY y solo los folios con error van a la tabla cuarentena.
+    """
+    frames = {"principal": df_principal, "corporaciones": df_corporaciones, "comentarios": df_comentarios}
+    loaded = {table_name: 0 for table_name in SPLIT_TABLES}
+    loaded["cuarentena"] = 0
+    try:
+        with conn.begin_nested():
+            loaded.update(bulk_load_chunk(conn, df_principal, df_corporaciones, df_comentarios))
     except Exception as e:
-        logger.warning(f"WARNING: Error obteniendo folios existentes: {str(e)}")
-        return set(), set(), set()
+        if not _is_data_error(e):
+            raise
+        logger.warning(f"WARNING: Error en la carga masiva (COPY) del lote, se divide para aislar los folios con error: {_error_text(e)}")
+        bisect_load(conn, frames, filename, _error_text(e), loaded)
+        logger.info(f"OK: Lote cargado por partes, {loaded['cuarentena']} filas en cuarentena")
+
+    accion = "nuevas o modificadas" if UPSERT_MODE else "nuevas"
+    for table_name in SPLIT_TABLES:
+        logger.info(f"OK: Tabla {table_name.upper()} actualizada con {loaded[table_name]} filas {accion}")
+    return loaded
+
+def _error_text(e: Exception) -> str:
+    """Mensaje del error de la base (sin la sentencia SQL que agrega SQLAlchemy)"""
+    return str(getattr(e, 'orig', None) or e).strip()
 
-def filter_new_data(df_principal: pd.DataFrame, df_corporaciones: pd.DataFrame, df_comentarios: pd.DataFrame, 
-                   existing_folios_principal: set, existing_folios_comentarios: set, existing_folios_corporaciones: set) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def _is_data_error(e: Exception) -> bool:
     """
-    Filtra los datos para incluir solo folios nuevos que no existen en las tablas
+    Error causado por los valores de alguna fila (DataError/IntegrityError, clases 22 y 23 de
+    PostgreSQL, también envueltos por SQLAlchemy): se aísla por folio. Los demás (conexión caída,
+    esquema, permisos) fallarían igual en cada mitad y se propagan.
     """
-    # Filtrar tabla principal - solo folios nuevos
-    df_principal_new = df_principal[~df_principal['folio'].isin(existing_folios_principal)].copy()
-    
-    # Filtrar tabla comentarios - solo folios nuevos
-    df_comentarios_new = df_comentarios[~df_comentarios['folio'].isin(existing_folios_comentarios)].copy()
-    
-    # Para corporaciones, incluir todos los registros de folios nuevos
-    folios_nuevos = set(df_principal_new['folio'])
-    df_corporaciones_new = df_corporaciones[df_corporaciones['folio'].isin(folios_nuevos)].copy()
-    
-    logger.info(f"   - Filas principales nuevas: {len(df_principal_new)}")
-    logger.info(f"   - Filas corporaciones nuevas: {len(df_corporaciones_new)}")
-    logger.info(f"   - Filas comentarios nuevos: {len(df_comentarios_new)}")
+    return isinstance(getattr(e, 'orig', None) or e, (psycopg2.DataError, psycopg2.IntegrityError))
+
+def bisect_load(conn, frames: Dict[str, pd.DataFrame], filename: str, error: str, loaded: Dict[str, int]):
+    """
+    Carga por mitades (por folio, con las filas de las 3 tablas juntas) un lote cuya carga masiva
+    falló con error: cada mitad se intenta con COPY en su propio SAVEPOINT y solo las que fallan se
+    vuelven a dividir, hasta aislar folios individuales, que van a cuarentena. Solo los errores de
+    datos (_is_data_error) se dividen; cualquier otro se propaga. Suma en loaded.
+    """
+    folios = frames["principal"]["folio"].unique()
+    if len(folios) <= 1:
+        loaded["cuarentena"] += quarantine_rows(conn, filename, frames, error)
+        return
+    half = len(folios) // 2
+    for part in (folios[:half], folios[half:]):
+        sub = {table_name: df[df['folio'].isin(part)] for table_name, df in frames.items()}
+        try:
+            with conn.begin_nested():
+                result = bulk_load_chunk(conn, sub["principal"], sub["corporaciones"], sub["comentarios"])
+        except Exception as e:
+            if not _is_data_error(e):
+                raise
+            bisect_load(conn, sub, filename, _error_text(e), loaded)
+            continue
+        for table_name in SPLIT_TABLES:
+            loaded[table_name] += result[table_name]
+
+def _records(df: pd.DataFrame) -> List[Dict]:
+    """Filas como diccionarios de valores de Python, None en lugar de NaT/NA"""
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+def quarantine_rows(conn, filename: str, frames: Dict[str, pd.DataFrame], error: str) -> int:
+    """
+    Guarda en cuarentena las filas de un folio que no se pudo cargar (las de las 3 tablas, como
+    JSON) con su número de fila en el archivo; comentarios toma la fila de su folio en principal.
+    Devuelve las filas guardadas.
+    """
+    first_rows = dict(zip(frames["principal"]["folio"], frames["principal"].index))
+    records = []
+    for table_name in SPLIT_TABLES:
+        df = frames[table_name]
+        rows = df['folio'].map(first_rows) if table_name == 'comentarios' else df.index
+        for row, values in zip(rows, _records(df)):
+            records.append({
+                "filename": filename,
+                "fila": int(row) if pd.notna(row) else None,
+                "tabla": table_name,
+                "folio": values.get('folio'),
+                "datos": json.dumps(values, default=str, ensure_ascii=False),
+                "error": error,
+            })
+    if records:
+        conn.execute(
+            text("""
+                INSERT INTO cuarentena (filename, fila, tabla, folio, datos, error)
+                VALUES (:filename, :fila, :tabla, :folio, CAST(:datos AS JSONB), :error)
+            """),
+            records
+        )
+    logger.warning(f"CUARENTENA: {filename} folio {', '.join(map(str, first_rows)) or '-'} "
+                   f"({len(records)} filas): {error.splitlines()[0] if error else ''}")
+    return len(records)
+
+def replay_quarantine() -> Tuple[int, int, int]:
+    """
+    Reintenta en bloque las filas en cuarentena, después de corregirlas (columna datos) o de corregir
+    la restricción/esquema que las rechazó. Por archivo de origen y en una transacción, las filas
+    salen de la cuarentena y se cargan como un lote más de ese archivo (COPY y bisección): las que
+    vuelven a fallar regresan con el error nuevo. Devuelve (filas escritas en las tablas, filas
+    descartadas por duplicadas (el folio ya estaba cargado), filas que siguen en cuarentena).
+    """
+    create_quarantine_table()
+    with engine.connect() as conn:
+        pending = pd.read_sql_query(text("SELECT id, filename, fila, tabla, datos FROM cuarentena ORDER BY filename, id"), conn)
+    if pending.empty:
+        logger.info("CUARENTENA: No hay filas en cuarentena")
+        return 0, 0, 0
+
+    replayed = duplicates = remaining = 0
+    for filename, group in pending.groupby('filename', sort=False):
+        frames = {}
+        for table_name in SPLIT_TABLES:
+            rows = group[group['tabla'] == table_name]
+            frames[table_name] = (pd.DataFrame(list(rows['datos']), index=rows['fila'].tolist())
+                                  if len(rows) else pd.DataFrame(columns=['folio']))
+        # Las duraciones se recalculan por si se corrigieron las horas en datos
+        principal = frames["principal"]
+        if len(frames["corporaciones"]) and 'version_estructura' in principal.columns and len(principal):
+            frames["corporaciones"] = add_duration_columns(frames["corporaciones"], str(principal['version_estructura'].iloc[0]))
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM cuarentena WHERE id = ANY(:ids)"), {"ids": group['id'].tolist()})
+            reset_file_staging(conn)
+            if not UPSERT_MODE:
+                # Folios que el archivo ya había cargado en otro lote: sus corporaciones y notas se
+                # agregan, igual que en la carga original
+                folios = frames["principal"]["folio"].tolist()
+                conn.execute(text("""
+                    INSERT INTO staging_folios_principal (FOLIO)
+                    SELECT FOLIO FROM principal WHERE origen_archivo = :filename AND FOLIO = ANY(:folios)
+                """), {"filename": filename, "folios": folios})
+                conn.execute(text("""
+                    INSERT INTO staging_folios_comentarios (FOLIO)
+                    SELECT c.FOLIO FROM comentarios c JOIN principal p ON p.FOLIO = c.FOLIO
+                    WHERE p.origen_archivo = :filename AND c.FOLIO = ANY(:folios)
+                """), {"filename": filename, "folios": folios})
+            loaded = load_chunk(conn, frames["principal"], frames["corporaciones"], frames["comentarios"], filename)
+        # Filas que escribió la carga (RETURNING / rowcount por tabla); las demás que salieron de la
+        # cuarentena chocaron con un folio ya cargado (ON CONFLICT DO NOTHING) y se descartan
+        written = sum(loaded[table_name] for table_name in SPLIT_TABLES)
+        skipped = len(group) - loaded["cuarentena"] - written
+        replayed += written
+        duplicates += skipped
+        remaining += loaded["cuarentena"]
+        logger.info(f"CUARENTENA: {filename}: {written} filas cargadas, {skipped} descartadas por folio ya cargado, "
+                    f"{loaded['cuarentena']} siguen en cuarentena")
+    return replayed, duplicates, remaining
+
+def open_workbook(file_path: str):
+    """
+    Abre el archivo (Excel o CSV/TSV) con el lector elegido por lectores.abrir_lector y detecta
+    la versión. Devuelve (lector, headers, version); el lector se cierra con close().
+    """
+    filename = os.path.basename(file_path)
+    reader = lectores.abrir_lector(file_path, READER_BACKEND)
     
-    return df_principal_new, df_corporaciones_new, df_comentarios_new
+    # Obtener headers
+    headers = []
+    for value in reader.encabezados():
+        if value is not None:
+            headers.append(str(value).strip())
+        else:
+            headers.append(f'columna_{len(headers) + 1}')
 
-def process_excel_file_split(file_path: str) -> bool:
+    # Detectar versión de estructura
+    version = detect_version_structure(filename, headers)
+    logger.info(f"VERSION: Versión detectada para {filename}: {version}")
+    return reader, headers, version
+
+def open_new_rows(file_path: str, file_info: Dict):
     """
-    Procesa un archivo Excel y lo transforma al formato unificado, luego lo divide en 3 tablas
+    Abre el archivo y salta las filas ya ingeridas según la marca de agua del manifiesto, si los
+    encabezados y esas filas no cambiaron (archivo al que solo se le agregaron filas al final).
+    Si cambiaron, se reabre y se leen todas. Devuelve (lector, headers, version, filas, watermark).
     """
-    try:
-        filename = os.path.basename(file_path)
-        logger.info(f"\nPROCESANDO: Procesando archivo: {filename}")
+    filename = os.path.basename(file_path)
+    reader, headers, version = open_workbook(file_path)
+    watermark = RowWatermark(headers)
+    rows = watermark.track(reader.filas())
 
-        # Cargar archivo Excel
-        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
-        sheet = wb.active
-        
-        # Obtener headers
-        headers = []
-        for cell in next(sheet.rows):
-            if cell.value is not None:
-                headers.append(str(cell.value).strip())
-            else:
-                headers.append(f'columna_{len(headers) + 1}')
+    ingested = file_info.get("filas_leidas") or 0
+    if ingested and file_info.get("prefix_hash"):
+        # Las filas del prefijo se leen (para verificar el hash) pero no se transforman ni se cargan
+        consumed = sum(1 for _ in islice(rows, ingested))
+        if consumed == ingested and watermark.digest() == file_info["prefix_hash"]:
+            logger.info(f"INCREMENTAL: {filename}: {ingested} filas ya ingeridas, se cargan solo las filas nuevas")
+            watermark.skipped = ingested
+            return reader, headers, version, rows, watermark
+
+        logger.info(f"INCREMENTAL: {filename}: cambiaron filas ya ingeridas, se procesa el archivo completo")
+        reader.close()
+        reader, headers, version = open_workbook(file_path)
+        watermark = RowWatermark(headers)
+        rows = watermark.track(reader.filas())
 
-        # Detectar versión de estructura
-        version = detect_version_structure(filename, headers)
-        logger.info(f"VERSION: Versión detectada: {version}")
+    return reader, headers, version, rows, watermark
 
-        # Transformar datos
-        transformed_data = []
+def iter_split_chunks(rows: Iterator[tuple], headers: List[str], version: str, filename: str,
+                      medidor: perfil.Medidor, first_row: int = 2) -> Iterator[Tuple[int, pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+    """
+    Transforma y divide las filas del lector por lotes de CHUNK_SIZE filas, midiendo cada etapa en medidor.
+    Produce (filas_leidas, df_principal, df_corporaciones, df_comentarios) por lote. El índice de
+    df_principal y df_corporaciones es el número de fila en el archivo (first_row = la primera que
+    entrega el lector), para la cuarentena.
+    """
+    # Plan posicional compilado una vez para todo el archivo
+    plan = compile_extraction_plan(version, headers)
+
+    rows = ((number, row) for number, row in enumerate(rows, first_row) if any(x is not None for x in row))
+    chunk_number = 0
+    while True:
+        # Lectura y transformación por bloques de TRANSFORM_BLOCK filas: las tuplas de cada bloque se
+        # liberan en cuanto pasan a columnas tipadas
+        pieces = []
         row_count = 0
-        
-        for row in sheet.rows:
-            if row_count == 0:  # Saltar header
-                row_count += 1
-                continue
-                
-            row_data = [cell.value for cell in row]
-            if any(x is not None for x in row_data):
-                transformed_row = transform_row_data(row_data, version, headers)
-                transformed_row['origen_archivo'] = filename
-                transformed_data.append(transformed_row)
-            row_count += 1
-
-        if not transformed_data:
+        fecha_carga = datetime.now()
+        while row_count < CHUNK_SIZE:
+            with medidor.etapa("lectura") as etapa:
+                block = list(islice(rows, min(TRANSFORM_BLOCK, CHUNK_SIZE - row_count)))
+                etapa["filas"] = len(block)
+            if not block:
+                break
+            with medidor.etapa("transformacion", len(block)):
+                numbers, block = zip(*block)
+                piece = transform_rows(block, plan, version, filename, fecha_carga)
+                piece.index = pd.Index(numbers, name='fila')
+                pieces.append(piece)
+            row_count += len(block)
+            del block, numbers
+        if not pieces:
+            return
+        chunk_number += 1
+        logger.info(f"LOTE: {filename} lote {chunk_number} ({row_count} filas)")
+
+        with medidor.etapa("dataframe", row_count):
+            df_unified = concat_typed_frames(pieces)
+            del pieces
+            df_unified.columns = [c.strip().lower() for c in df_unified.columns] # para mantener las columnas en minúsculas
+
+            # Las columnas del plan ya tienen su tipo; FECHA pasa a fecha sin hora (NaT = NULL, COPY la
+            # escribe como AAAA-MM-DD)
+            df_unified['fecha'] = pd.to_datetime(df_unified['fecha'].astype(object), errors='coerce').dt.normalize()
+
+        # Dividir datos en las 3 tablas
+        with medidor.etapa("split", row_count):
+            df_principal, df_corporaciones, df_comentarios = split_data_into_tables(df_unified, filename)
+        del df_unified
+        yield row_count, df_principal, df_corporaciones, df_comentarios
+
+def load_split_chunks(file_path: str, version: str, chunks: Iterator[Tuple[int, pd.DataFrame, pd.DataFrame, pd.DataFrame]],
+                      file_info: Dict, watermark: RowWatermark, medidor: perfil.Medidor) -> bool:
+    """
+    Escritor: carga los lotes ya divididos de un archivo en una sola transacción (un error a medias
+    no deja el archivo cargado parcialmente) y en esa misma transacción actualiza su marca de agua
+    en ingest_manifest, lo registra en processed_files_split y guarda sus etapas en etapas_archivo.
+    """
+    filename = os.path.basename(file_path)
+    total_rows = 0
+    filas_principales = filas_corporaciones = filas_comentarios = filas_cuarentena = 0
+
+    with engine.begin() as conn:
+        # La deduplicación contra lo ya cargado se hace en la base (ver _move_from_staging_query)
+        reset_file_staging(conn)
+
+        for row_count, df_principal, df_corporaciones, df_comentarios in chunks:
+            total_rows += row_count
+            # Cargar datos a las 3 tablas (respetando dependencias de FK); solo entran folios nuevos
+            with medidor.etapa("carga", len(df_principal) + len(df_corporaciones) + len(df_comentarios)):
+                loaded = load_chunk(conn, df_principal, df_corporaciones, df_comentarios, filename)
+            filas_principales += loaded['principal']
+            filas_corporaciones += loaded['corporaciones']
+            filas_comentarios += loaded['comentarios']
+            filas_cuarentena += loaded['cuarentena']
+
+        if total_rows == 0 and watermark.skipped == 0:
             logger.warning(f"WARNING: No se encontraron datos válidos en {filename}")
             return False
 
-        # Crear DataFrame unificado
-        df_unified = pd.DataFrame(transformed_data)
-        df_unified.columns = [c.strip().lower() for c in df_unified.columns] # para mantener las columnas en minúsculas
-        df_unified['fecha'] = pd.to_datetime(df_unified['fecha'], errors='coerce').dt.date
+        # Folios que tocó el archivo, para la verificación de integridad de la corrida
+        track_run_folios(conn)
 
+        # Marca de agua: todas las filas leídas del archivo quedan ingeridas
+        watermark.finish()
+        upsert_manifest(conn, filename, file_info, watermark.filas, watermark.prefix_hash)
 
-        # Convertir todas las columnas a string (excepto fecha_carga que es timestamp)
-        for col in df_unified.columns:
-            if col != 'fecha_carga':
-                df_unified[col] = df_unified[col].astype(str)
-        
-        # Dividir datos en las 3 tablas
-        df_principal, df_corporaciones, df_comentarios = split_data_into_tables(df_unified, filename)
-        
-        # Obtener folios existentes para evitar duplicados
-        existing_folios_principal, existing_folios_comentarios, existing_folios_corporaciones = get_existing_folios()
-        
-        # Filtrar solo datos nuevos
-        df_principal_new, df_corporaciones_new, df_comentarios_new = filter_new_data(
-            df_principal, df_corporaciones, df_comentarios,
-            existing_folios_principal, existing_folios_comentarios, existing_folios_corporaciones
-        )
-        
-        # Solo cargar si hay datos nuevos
-        if len(df_principal_new) == 0 and len(df_corporaciones_new) == 0 and len(df_comentarios_new) == 0:
+        # Solo registrar si hubo datos nuevos (en modo upsert siempre, para dejar el conteo sin cambios)
+        if filas_principales == 0 and filas_corporaciones == 0 and filas_comentarios == 0 and filas_cuarentena == 0 and not UPSERT_MODE:
+            save_file_stages(conn, filename, None, medidor)
             logger.info(f"INFO: No hay datos nuevos en {filename} - todos los folios ya existen")
             return True
-        
-        # Cargar datos a las 3 tablas (respetando dependencias de FK)
-        try:
-            # IMPORTANTE: Insertar en orden para respetar las claves foráneas
-            # 1. PRIMERO: Tabla PRINCIPAL (tabla padre)
-            if len(df_principal_new) > 0:
-                df_principal_new.to_sql(
-                    name='principal',
-                    con=engine,
-                    if_exists='append',
-                    index=False,
-                    chunksize=1000,
-                    method=None
-                )
-                logger.info(f"OK: Tabla PRINCIPAL actualizada con {len(df_principal_new)} filas nuevas")
-            
-            # 2. SEGUNDO: Tabla CORPORACIONES (depende de PRINCIPAL)
-            if len(df_corporaciones_new) > 0:
-                df_corporaciones_new.to_sql(
-                    name='corporaciones',
-                    con=engine,
-                    if_exists='append',
-                    index=False,
-                    chunksize=1000,
-                    method=None
-                )
-                logger.info(f"OK: Tabla CORPORACIONES actualizada con {len(df_corporaciones_new)} filas nuevas")
-            
-            # 3. TERCERO: Tabla COMENTARIOS (depende de PRINCIPAL)
-            if len(df_comentarios_new) > 0:
-                df_comentarios_new.to_sql(
-                    name='comentarios',
-                    con=engine,
-                    if_exists='append',
-                    index=False,
-                    chunksize=1000,
-                    method=None
-                )
-                logger.info(f"OK: Tabla COMENTARIOS actualizada con {len(df_comentarios_new)} filas nuevas")
-            
-        except Exception as e:
-            logger.warning(f"WARNING: Error con pandas to_sql, usando inserción directa con manejo de FK: {str(e)}")
-            
-            # Fallback: inserción directa con SQL respetando dependencias
-            with engine.connect() as conn:
-                try:
-                    # 1. PRIMERO: Insertar en PRINCIPAL (tabla padre)
-                    if len(df_principal_new) > 0:
-                        columns_principal = list(df_principal_new.columns)
-                        placeholders_principal = ', '.join([f':{col}' for col in columns_principal])
-                        insert_principal_query = text(f"""
-                            INSERT INTO principal ({', '.join(columns_principal)})
-                            VALUES ({placeholders_principal})
-                            ON CONFLICT (FOLIO) DO NOTHING
-                        """)
-                        
-                        for _, row in df_principal_new.iterrows():
-                            try:
-                                row_dict = row.to_dict()
-                                conn.execute(insert_principal_query, row_dict)
-                            except Exception as insert_error:
-                                logger.warning(f"WARNING: Error insertando en PRINCIPAL folio {row_dict.get('folio', 'N/A')}: {str(insert_error)}")
-                                continue
-                    
-                    # 2. SEGUNDO: Insertar en CORPORACIONES (depende de PRINCIPAL)
-                    if len(df_corporaciones_new) > 0:
-                        columns_corporaciones = list(df_corporaciones_new.columns)
-                        placeholders_corporaciones = ', '.join([f':{col}' for col in columns_corporaciones])
-                        insert_corporaciones_query = text(f"""
-                            INSERT INTO corporaciones ({', '.join(columns_corporaciones)})
-                            VALUES ({placeholders_corporaciones})
-                        """)
-                        
-                        for _, row in df_corporaciones_new.iterrows():
-                            try:
-                                row_dict = row.to_dict()
-                                conn.execute(insert_corporaciones_query, row_dict)
-                            except Exception as insert_error:
-                                logger.warning(f"WARNING: Error insertando en CORPORACIONES folio {row_dict.get('folio', 'N/A')}: {str(insert_error)}")
-                                continue
-                    
-                    # 3. TERCERO: Insertar en COMENTARIOS (depende de PRINCIPAL)
-                    if len(df_comentarios_new) > 0:
-                        columns_comentarios = list(df_comentarios_new.columns)
-                        placeholders_comentarios = ', '.join([f':{col}' for col in columns_comentarios])
-                        insert_comentarios_query = text(f"""
-                            INSERT INTO comentarios ({', '.join(columns_comentarios)})
-                            VALUES ({placeholders_comentarios})
-                            ON CONFLICT (FOLIO) DO UPDATE SET
-                            COMENTARIOS = EXCLUDED.COMENTARIOS,
-                            fecha_carga = EXCLUDED.fecha_carga
-                        """)
-                        
-                        for _, row in df_comentarios_new.iterrows():
-                            try:
-                                row_dict = row.to_dict()
-                                conn.execute(insert_comentarios_query, row_dict)
-                            except Exception as insert_error:
-                                logger.warning(f"WARNING: Error insertando en COMENTARIOS folio {row_dict.get('folio', 'N/A')}: {str(insert_error)}")
-                                continue
-                    
-                    conn.commit()
-                    logger.info("OK: Inserción directa completada respetando dependencias FK")
-                    
-                except Exception as transaction_error:
-                    conn.rollback()
-                    logger.error(f"ERROR: Error en transacción, haciendo rollback: {str(transaction_error)}")
-                    raise
-
-        # Registrar archivo como procesado
-        file_hash = calculate_file_hash(file_path)
-        with engine.connect() as conn:
-            conn.execute(
-                text("""
-                    INSERT INTO processed_files_split 
-                    (filename, file_hash, processed_date, version_estructura, 
-                     filas_principales, filas_corporaciones, filas_comentarios) 
-                    VALUES (:filename, :file_hash, :processed_date, :version_estructura,
-                           :filas_principales, :filas_corporaciones, :filas_comentarios)
-                """),
-                {
-                    "filename": filename,
-                    "file_hash": file_hash,
-                    "processed_date": datetime.now(),
-                    "version_estructura": version,
-                    "filas_principales": len(df_principal_new),
-                    "filas_corporaciones": len(df_corporaciones_new),
-                    "filas_comentarios": len(df_comentarios_new)
-                }
-            )
-            conn.commit()
 
-        logger.info(f"OK: Archivo {filename} procesado y acumulado exitosamente")
-        logger.info(f"   - Versión: {version}")
-        logger.info(f"   - Filas unificadas originales: {len(transformed_data)}")
-        logger.info(f"   - Filas principales nuevas: {len(df_principal_new)}")
-        logger.info(f"   - Filas corporaciones nuevas: {len(df_corporaciones_new)}")
-        logger.info(f"   - Filas comentarios nuevos: {len(df_comentarios_new)}")
-        
-        return True
+        # Registrar archivo como procesado (misma transacción que los datos)
+        folios = file_folio_counts(conn)
+        processed_file_id = conn.execute(
+            text("""
+                INSERT INTO processed_files_split 
+                (filename, file_hash, processed_date, version_estructura, 
+                 filas_principales, filas_corporaciones, filas_comentarios,
+                 folios_insertados, folios_actualizados, folios_sin_cambios, filas_cuarentena) 
+                VALUES (:filename, :file_hash, :processed_date, :version_estructura,
+                       :filas_principales, :filas_corporaciones, :filas_comentarios,
+                       :folios_insertados, :folios_actualizados, :folios_sin_cambios, :filas_cuarentena)
+                RETURNING id
+            """),
+            {
+                "filename": filename,
+                "file_hash": file_info["file_hash"],
+                "processed_date": datetime.now(),
+                "version_estructura": version,
+                "filas_principales": filas_principales,
+                "filas_corporaciones": filas_corporaciones,
+                "filas_comentarios": filas_comentarios,
+                "folios_insertados": folios.get('insertado', 0),
+                "folios_actualizados": folios.get('actualizado', 0),
+                "folios_sin_cambios": folios.get('sin_cambios', 0) if UPSERT_MODE else None,
+                "filas_cuarentena": filas_cuarentena
+            }
+        ).scalar()
+        save_file_stages(conn, filename, processed_file_id, medidor)
+
+    logger.info(f"OK: Archivo {filename} procesado y acumulado exitosamente")
+    logger.info(f"   - Versión: {version}")
+    logger.info(f"   - Filas unificadas originales: {total_rows}")
+    if watermark.skipped:
+        logger.info(f"   - Filas ya ingeridas en corridas anteriores (omitidas): {watermark.skipped}")
+    logger.info(f"   - Filas principales nuevas: {filas_principales}")
+    logger.info(f"   - Filas corporaciones nuevas: {filas_corporaciones}")
+    logger.info(f"   - Filas comentarios nuevos: {filas_comentarios}")
+    if filas_cuarentena:
+        logger.warning(f"   - Filas en cuarentena (ver tabla cuarentena, --replay-cuarentena): {filas_cuarentena}")
+    if UPSERT_MODE:
+        logger.info(f"   - Folios insertados / actualizados / sin cambios: {folios.get('insertado', 0)} / "
+                    f"{folios.get('actualizado', 0)} / {folios.get('sin_cambios', 0)}")
+    for linea in medidor.resumen():
+        logger.info(f"   ETAPAS: {linea}")
+    return True
+
+def process_excel_file_split(file_path: str, file_info: Dict, medidor: perfil.Medidor) -> bool:
+    """
+    Procesa un archivo Excel y lo transforma al formato unificado, luego lo divide en 3 tablas.
+    Se lee, transforma y carga por lotes de CHUNK_SIZE filas. file_info: estado del archivo armado
+    en main (tamaño, mtime, hash y marca de agua del manifiesto); medidor: etapas del archivo.
+    """
+    filename = os.path.basename(file_path)
+    try:
+        logger.info(f"\nPROCESANDO: Procesando archivo: {filename}")
+        with medidor.etapa("apertura"):
+            reader, headers, version, rows, watermark = open_new_rows(file_path, file_info)
+        try:
+            chunks = iter_split_chunks(rows, headers, version, filename, medidor, 2 + watermark.skipped)
+            return load_split_chunks(file_path, version, chunks, file_info, watermark, medidor)
+        finally:
+            reader.close()
 
     except Exception as e:
         logger.error(f"ERROR: Error procesando {filename}: {str(e)}")
@@ -759,92 +1662,408 @@ def process_excel_file_split(file_path: str) -> bool:
         logger.error(traceback.format_exc())
         return False
 
-def verify_integrity():
-    """Verifica la integridad referencial de las tablas"""
+def prepare_file_chunks(file_path: str, work_dir: str, file_info: Dict) -> Tuple[str, List[str], RowWatermark, perfil.Medidor]:
+    """
+    Trabajo de un proceso del pool: lee, transforma y divide el archivo (desde la marca de agua) y
+    guarda cada lote en work_dir como pickle. No toca la base.
+    Devuelve (version, rutas de los lotes en orden, marca de agua, etapas medidas en este proceso).
+    """
+    filename = os.path.basename(file_path)
+    logger.info(f"\nPREPARANDO: Leyendo archivo en paralelo: {filename}")
+    medidor = perfil.Medidor()
+    with medidor.etapa("apertura"):
+        reader, headers, version, rows, watermark = open_new_rows(file_path, file_info)
     try:
-        with engine.connect() as conn:
-            # Verificar folios huérfanos en CORPORACIONES
-            orphan_corporaciones = conn.execute(text("""
-                SELECT COUNT(*) FROM corporaciones c 
-                LEFT JOIN principal p ON c.FOLIO = p.FOLIO 
-                WHERE p.FOLIO IS NULL
-            """)).scalar()
-            
-            # Verificar folios huérfanos en COMENTARIOS
-            orphan_comentarios = conn.execute(text("""
-                SELECT COUNT(*) FROM comentarios c 
-                LEFT JOIN principal p ON c.FOLIO = p.FOLIO 
-                WHERE p.FOLIO IS NULL
-            """)).scalar()
-            
-            # Obtener estadísticas generales
-            total_principal = conn.execute(text("SELECT COUNT(*) FROM principal")).scalar()
-            total_corporaciones = conn.execute(text("SELECT COUNT(*) FROM corporaciones")).scalar()
-            total_comentarios = conn.execute(text("SELECT COUNT(*) FROM comentarios")).scalar()
-            
-            logger.info("INTEGRIDAD: Verificación de relaciones:")
-            logger.info(f"   - Tabla PRINCIPAL: {total_principal} registros")
-            logger.info(f"   - Tabla CORPORACIONES: {total_corporaciones} registros")
-            logger.info(f"   - Tabla COMENTARIOS: {total_comentarios} registros")
-            logger.info(f"   - Folios huérfanos en CORPORACIONES: {orphan_corporaciones}")
-            logger.info(f"   - Folios huérfanos en COMENTARIOS: {orphan_comentarios}")
-            
-            if orphan_corporaciones == 0 and orphan_comentarios == 0:
-                logger.info("✅ INTEGRIDAD: Todas las relaciones están correctas")
-                return True
+        chunk_paths = []
+        for chunk in iter_split_chunks(rows, headers, version, filename, medidor, 2 + watermark.skipped):
+            chunk_path = os.path.join(work_dir, f"lote_{len(chunk_paths):05d}.pkl")
+            pd.to_pickle(chunk, chunk_path)
+            chunk_paths.append(chunk_path)
+        return version, chunk_paths, watermark.finish(), medidor
+    finally:
+        reader.close()
+
+def iter_pickled_chunks(chunk_paths: List[str]) -> Iterator[Tuple[int, pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+    """Lotes preparados por prepare_file_chunks, en orden; cada archivo se borra al leerlo"""
+    for chunk_path in chunk_paths:
+        chunk = pd.read_pickle(chunk_path)
+        os.remove(chunk_path)
+        yield chunk
+
+def process_files_parallel(pending: List[Tuple[str, Dict]], workers: int, run_medidor: perfil.Medidor) -> Tuple[int, int]:
+    """
+    Ingesta paralela: `workers` procesos leen y transforman los archivos (la lectura es de un solo
+    núcleo) mientras este proceso, como único escritor, los carga uno por uno en el orden de
+    pending, una lista de (ruta, file_info). Así se conservan la regla de "el primer archivo gana" por folio y el orden de FK.
+    Los lectores dejan los lotes de cada archivo en disco; solo hay PARALLEL_WINDOW_PER_WORKER archivos
+    por proceso en vuelo y el siguiente se envía cuando se termina de cargar uno (disco y lectura
+    adelantada acotados aunque la corrida tenga años de archivos).
+    Las etapas de cada archivo (lectores + escritor) se suman a run_medidor. Devuelve (procesados, fallidos).
+    """
+    processed = failed = 0
+    work_root = tempfile.mkdtemp(prefix='etl_lotes_')
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            remaining = enumerate(pending)
+            in_flight = deque()
+
+            def submit_next():
+                i, (file_path, file_info) = next(remaining, (None, (None, None)))
+                if file_path is not None:
+                    work_dir = os.path.join(work_root, f"{i:05d}")
+                    os.makedirs(work_dir)
+                    in_flight.append((file_path, file_info, work_dir, pool.submit(prepare_file_chunks, file_path, work_dir, file_info)))
+
+            for _ in range(workers * PARALLEL_WINDOW_PER_WORKER):
+                submit_next()
+            while in_flight:
+                file_path, file_info, work_dir, future = in_flight.popleft()
+                filename = os.path.basename(file_path)
+                try:
+                    version, chunk_paths, watermark, medidor = future.result()
+                    logger.info(f"\nPROCESANDO: Cargando archivo: {filename}")
+                    ok = load_split_chunks(file_path, version, iter_pickled_chunks(chunk_paths), file_info, watermark, medidor)
+                    run_medidor.combinar(medidor)
+                except Exception as e:
+                    logger.error(f"ERROR: Error procesando {filename}: {str(e)}")
+                    import traceback
+                    logger.error(traceback.format_exc())
+                    ok = False
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                submit_next()
+                if ok:
+                    processed += 1
+                else:
+                    failed += 1
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+    return processed, failed
+
+def verify_integrity(full: bool = False) -> bool:
+    """
+    Verifica la integridad referencial de las tablas.
+    - Incremental (por defecto): folios huérfanos solo entre los folios que cargó la corrida
+      (folios_corrida, por índice) y totales de conteo_filas; cuesta en proporción a lo cargado.
+    - Completa (full): LEFT JOIN de huérfanos y COUNT(*) sobre las tablas completas; si conteo_filas
+      se desvió lo corrige.
+    El resultado queda en verificaciones_integridad.
+    """
+    start = time.perf_counter()
+    try:
+        with engine.begin() as conn:
+            if full:
+                folios = None
+                # Verificar folios huérfanos en CORPORACIONES
+                orphan_corporaciones = conn.execute(text("""
+                    SELECT COUNT(*) FROM corporaciones c 
+                    LEFT JOIN principal p ON c.FOLIO = p.FOLIO 
+                    WHERE p.FOLIO IS NULL
+                """)).scalar()
+                
+                # Verificar folios huérfanos en COMENTARIOS
+                orphan_comentarios = conn.execute(text("""
+                    SELECT COUNT(*) FROM comentarios c 
+                    LEFT JOIN principal p ON c.FOLIO = p.FOLIO 
+                    WHERE p.FOLIO IS NULL
+                """)).scalar()
+                
+                # Conteos reales; los mantenidos por triggers se corrigen si no coinciden
+                totals = {t: conn.execute(text(f"SELECT COUNT(*) FROM {t}")).scalar() for t in SPLIT_TABLES}
+                counters = dict(conn.execute(text("SELECT tabla, filas FROM conteo_filas")).fetchall())
+                for table_name, total in totals.items():
+                    if counters.get(table_name) != total:
+                        logger.warning(f"WARNING: conteo_filas de {table_name} decía {counters.get(table_name)}, "
+                                       f"COUNT(*) = {total}; se corrige")
+                        conn.execute(text("""
+                            INSERT INTO conteo_filas (tabla, filas, actualizado) VALUES (:tabla, :filas, now())
+                            ON CONFLICT (tabla) DO UPDATE SET filas = EXCLUDED.filas, actualizado = now()
+                        """), {"tabla": table_name, "filas": total})
             else:
-                logger.warning("⚠️ INTEGRIDAD: Se encontraron folios huérfanos")
-                return False
+                folios = conn.execute(text("SELECT COUNT(*) FROM folios_corrida")).scalar()
+                orphan_corporaciones, orphan_comentarios = (
+                    conn.execute(text(f"""
+                        SELECT COUNT(*) FROM folios_corrida f
+                        JOIN {table_name} c ON c.FOLIO = f.FOLIO
+                        WHERE NOT EXISTS (SELECT 1 FROM principal p WHERE p.FOLIO = c.FOLIO)
+                    """)).scalar()
+                    for table_name in ("corporaciones", "comentarios")
+                )
+                totals = dict(conn.execute(text("SELECT tabla, filas FROM conteo_filas")).fetchall())
+
+            ok = orphan_corporaciones == 0 and orphan_comentarios == 0
+            duration = time.perf_counter() - start
+            conn.execute(text("""
+                INSERT INTO verificaciones_integridad
+                (fecha, modo, folios_verificados, huerfanos_corporaciones, huerfanos_comentarios,
+                 total_principal, total_corporaciones, total_comentarios, duracion_s, ok)
+                VALUES (:fecha, :modo, :folios, :huerfanos_corporaciones, :huerfanos_comentarios,
+                        :total_principal, :total_corporaciones, :total_comentarios, :duracion_s, :ok)
+            """), {
+                "fecha": datetime.now(), "modo": "completa" if full else "incremental", "folios": folios,
+                "huerfanos_corporaciones": orphan_corporaciones, "huerfanos_comentarios": orphan_comentarios,
+                "total_principal": totals.get("principal"), "total_corporaciones": totals.get("corporaciones"),
+                "total_comentarios": totals.get("comentarios"), "duracion_s": duration, "ok": ok,
+            })
+
+        alcance = "tablas completas" if full else f"{folios} folios de esta corrida"
+        logger.info(f"INTEGRIDAD: Verificación de relaciones ({alcance}, {duration:.2f}s):")
+        logger.info(f"   - Tabla PRINCIPAL: {totals.get('principal')} registros")
+        logger.info(f"   - Tabla CORPORACIONES: {totals.get('corporaciones')} registros")
+        logger.info(f"   - Tabla COMENTARIOS: {totals.get('comentarios')} registros")
+        logger.info(f"   - Folios huérfanos en CORPORACIONES: {orphan_corporaciones}")
+        logger.info(f"   - Folios huérfanos en COMENTARIOS: {orphan_comentarios}")
+        
+        if ok:
+            logger.info("✅ INTEGRIDAD: Todas las relaciones están correctas")
+            return True
+        else:
+            logger.warning("⚠️ INTEGRIDAD: Se encontraron folios huérfanos")
+            return False
                 
     except Exception as e:
         logger.error(f"ERROR: Error verificando integridad: {str(e)}")
         return False
 
-def main():
-    """Función principal del proceso"""
-    data_folder = 'DATA'
+def full_verification_due() -> bool:
+    """True si nunca se hizo una verificación completa o la última tiene FULL_INTEGRITY_CHECK_DAYS días o más"""
+    with engine.connect() as conn:
+        last = conn.execute(text("SELECT MAX(fecha) FROM verificaciones_integridad WHERE modo = 'completa'")).scalar()
+    return last is None or datetime.now() - last >= timedelta(days=FULL_INTEGRITY_CHECK_DAYS)
+
+def plan_pending_files(data_folder: str, file_names: List[str]) -> Tuple[List[Tuple[str, Dict]], int]:
+    """
+    Decide con el manifiesto de ingesta cuáles de file_names hay que cargar, en el orden recibido.
+    Devuelve (pendientes como (ruta, file_info), saltados).
+    """
+    # Obtener archivos ya procesados (manifiesto y, para archivos anteriores a él, el registro con MD5)
+    manifest = get_ingest_manifest()
+    processed_files = get_processed_files()
+    logger.info(f"PROCESADOS: Archivos en el manifiesto: {len(manifest)}, registrados antes del manifiesto: "
+                f"{len(set(processed_files) - set(manifest))}")
+
+    skipped = 0
+    pending = []
+    for excel_file in file_names:
+        file_path = os.path.join(data_folder, excel_file)
+        stat = os.stat(file_path)
+        entry = manifest.get(excel_file)
+
+        # Mismo tamaño y mtime que en el manifiesto: se salta sin leer el archivo
+        if entry and entry["file_size"] == stat.st_size and entry["file_mtime_ns"] == stat.st_mtime_ns:
+            logger.info(f"SALTANDO: Saltando archivo: {excel_file} (sin cambios)")
+            skipped += 1
+            continue
+
+        legacy = entry is None and excel_file in processed_files
+        file_hash, file_md5 = calculate_file_hash(file_path, with_md5=legacy)
+        file_info = {"file_size": stat.st_size, "file_mtime_ns": stat.st_mtime_ns, "file_hash": file_hash,
+                     "filas_leidas": entry["filas_leidas"] if entry else None,
+                     "prefix_hash": entry["prefix_hash"] if entry else None}
+
+        if entry and entry["file_hash"] == file_hash:
+            logger.info(f"SALTANDO: Saltando archivo: {excel_file} (mtime cambió, contenido igual)")
+            touch_manifest(excel_file, file_info)
+            skipped += 1
+            continue
+        if legacy and processed_files[excel_file] == file_md5:
+            # Procesado antes del manifiesto: se registra sin marca de agua (si crece, se relee completo)
+            logger.info(f"SALTANDO: Saltando archivo: {excel_file} (ya procesado, se agrega al manifiesto)")
+            with engine.begin() as conn:
+                upsert_manifest(conn, excel_file, file_info)
+            skipped += 1
+            continue
+        pending.append((file_path, file_info))
+    return pending, skipped
+
+def reset_run_folios():
+    """Vacía folios_corrida al iniciar una corrida (o cada carga del daemon)"""
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE folios_corrida"))
+
+def load_pending_files(pending: List[Tuple[str, Dict]], workers: int = 1) -> Tuple[int, int, perfil.Medidor]:
+    """
+    Carga los archivos pendientes en orden (workers > 1: lectura en paralelo).
+    Devuelve (procesados, fallidos, etapas sumadas de todos los archivos).
+    """
+    run_medidor = perfil.Medidor()
+    reset_run_folios()
+    if workers > 1 and len(pending) > 1:
+        logger.info(f"PARALELO: {len(pending)} archivos con {workers} procesos de lectura")
+        processed, failed = process_files_parallel(pending, workers, run_medidor)
+        return processed, failed, run_medidor
+
+    processed = failed = 0
+    for file_path, file_info in pending:
+        medidor = perfil.Medidor()
+        if process_excel_file_split(file_path, file_info, medidor):
+            processed += 1
+        else:
+            failed += 1
+        run_medidor.combinar(medidor)
+    return processed, failed, run_medidor
+
+def use_bulk_indexes(pending: List[Tuple[str, Dict]]) -> bool:
+    """Decide si la carga de pending va sin índices secundarios (ver BULK_INDEX_MODE)"""
+    if BULK_INDEX_MODE != "auto":
+        return BULK_INDEX_MODE == "always"
+    estimated_rows = sum(file_info["file_size"] for _, file_info in pending) // BYTES_PER_ROW_ESTIMATE
+    with engine.connect() as conn:
+        existing_rows = conn.execute(text(
+            "SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE oid = 'corporaciones'::regclass"
+        )).scalar() or 0
+    bulk = estimated_rows >= BULK_LOAD_MIN_ROWS and estimated_rows >= BULK_LOAD_TABLE_FRACTION * existing_rows
+    logger.info(f"INDICES: ~{estimated_rows} filas por cargar, {existing_rows} en corporaciones: "
+                f"{'carga masiva sin índices secundarios' if bulk else 'índices se mantienen durante la carga'}")
+    return bulk
+
+def drop_secondary_indexes() -> List[str]:
+    """Quita los índices secundarios existentes antes de una carga masiva; devuelve sus nombres"""
+    names = [name for name in SECONDARY_INDEXES if not (UPSERT_MODE and name in UPSERT_LOOKUP_INDEXES)]
+    with engine.begin() as conn:
+        existing = [row[0] for row in conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND indexname = ANY(:names)"),
+            {"names": names}
+        )]
+        for name in existing:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    logger.info(f"INDICES: Quitados para la carga: {', '.join(existing) or 'ninguno'}")
+    return existing
+
+def rebuild_secondary_indexes(names: List[str]) -> Dict[str, float]:
+    """
+    Reconstruye los índices quitados por drop_secondary_indexes, con INDEX_MAINTENANCE_MEM y hasta
+    INDEX_MAINTENANCE_WORKERS procesos paralelos de PostgreSQL por índice. Devuelve segundos por índice.
+    """
+    timings = {}
+    with engine.connect() as conn:
+        conn.execute(text(f"SET maintenance_work_mem = '{INDEX_MAINTENANCE_MEM}'"))
+        conn.execute(text(f"SET max_parallel_maintenance_workers = {int(INDEX_MAINTENANCE_WORKERS)}"))
+        for name in names:
+            start = time.perf_counter()
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {SECONDARY_INDEXES[name]}"))
+            conn.commit()
+            timings[name] = time.perf_counter() - start
+            logger.info(f"INDICES: {name} reconstruido en {timings[name]:.2f}s")
+    if timings:
+        logger.info(f"INDICES: {len(timings)} índices reconstruidos en {sum(timings.values()):.2f}s")
+    return timings
+
+def analyze_tables():
+    """Actualiza las estadísticas del planificador de las tablas cargadas"""
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        conn.execute(text(f"ANALYZE {', '.join(SPLIT_TABLES)}"))
+        conn.commit()
+    logger.info(f"OK: ANALYZE de {', '.join(SPLIT_TABLES)} en {time.perf_counter() - start:.2f}s")
+
+def publish_changes(processed: int):
+    """
+    Después de cargar: estadísticas del planificador (ANALYZE) y lo que el backend lee además de
+    las tablas, diccionarios de valores y snapshots Parquet
+    """
+    if processed > 0:
+        analyze_tables()
+
+    # Refrescar diccionarios de valores para /api/values (solo si cambiaron los datos)
+    if processed > 0 or value_dictionaries_empty():
+        refresh_value_dictionaries()
+
+    # Snapshots Parquet para consultas analíticas pesadas (/api/aggregate y descargas grandes)
+    if EXPORT_PARQUET_SNAPSHOTS and analitico.ANALITICO_DISPONIBLE and (processed > 0 or not analitico.snapshot_disponible()):
+        analitico.exportar_snapshots(engine)
+
+    # Los triggers de version_datos ya la incrementaron con cada archivo confirmado; se incrementa otra
+    # vez cuando los diccionarios y snapshots de arriba ya reflejan la carga (respaldo si faltan los triggers)
+    if processed > 0:
+        bump_data_version()
+
+def bump_data_version():
+    """Incrementa version_datos; cambia el ETag de todas las respuestas del backend"""
+    try:
+        with engine.begin() as conn:
+            version = conn.execute(text("""
+                INSERT INTO version_datos (id, version, actualizado) VALUES (1, 1, :ahora)
+                ON CONFLICT (id) DO UPDATE SET version = version_datos.version + 1, actualizado = EXCLUDED.actualizado
+                RETURNING version
+            """), {"ahora": datetime.now()}).scalar()
+        logger.info(f"OK: Versión de los datos {version} (caché HTTP del backend invalidada)")
+    except Exception as e:
+        logger.warning(f"WARNING: No se pudo actualizar version_datos: {str(e)}")
+
+_run_lock_conn = None
+
+def acquire_run_lock() -> bool:
+    """
+    Toma el lock de sesión RUN_LOCK_KEY en una conexión propia que queda abierta hasta que el proceso
+    termina (al cerrarse la conexión PostgreSQL lo libera). False, sin esperar, si otro proceso ya lo
+    tiene (otro daemon o una corrida programada). Una segunda llamada en el mismo proceso no hace nada.
+    """
+    global _run_lock_conn
+    if _run_lock_conn is not None:
+        return True
+    conn = engine.connect()
+    locked = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": RUN_LOCK_KEY}).scalar()
+    conn.commit()
+    if not locked:
+        conn.close()
+        logger.error("ERROR: Ya hay otra corrida del ETL sobre esta base (pg_advisory_lock tomado), se cancela esta")
+        return False
+    _run_lock_conn = conn
+    return True
+
+def main(workers: int = 1, profile: bool = False, verify_full: bool = False):
+    """
+    Función principal del proceso (workers > 1: lectura en paralelo, ver process_files_parallel;
+    profile: perfila la carga y guarda el reporte en PROFILE_DIR; verify_full: verificación de
+    integridad completa en lugar de la incremental)
+    """
+    data_folder = DATA_FOLDER
     logger.info("INICIANDO: Iniciando proceso de transformación, unificación y acumulación de datos...")
 
     # Verificar carpeta de datos
     if not os.path.exists(data_folder):
         logger.error(f"ERROR: La carpeta {data_folder} no existe")
         return
+    if not acquire_run_lock():
+        return
 
     # Crear tablas separadas (solo una vez) con relaciones
     create_split_tables()
+    create_value_dictionary_table()
 
-    # Obtener archivos Excel
-    excel_files = [f for f in os.listdir(data_folder) if is_excel_file(f)]
+    # Obtener archivos Excel (orden alfabético: define qué archivo gana un folio repetido)
+    excel_files = sorted(f for f in os.listdir(data_folder) if lectores.is_input_file(f))
     if not excel_files:
-        logger.warning(f"ERROR: No se encontraron archivos Excel válidos en la carpeta {data_folder}")
+        logger.warning(f"ERROR: No se encontraron archivos Excel o CSV válidos en la carpeta {data_folder}")
         return
 
-    # Obtener archivos ya procesados
-    processed_files = get_processed_files()
     logger.info(f"ARCHIVOS: Encontrados {len(excel_files)} archivos Excel para procesar")
-    logger.info(f"PROCESADOS: Archivos ya procesados: {len(processed_files)}")
+    pending, skipped = plan_pending_files(data_folder, excel_files)
+    create_stage_table()
+    create_quarantine_table()
 
-    # Procesar archivos
-    processed = 0
-    skipped = 0
-    failed = 0
+    # Carga masiva: sin índices secundarios, reconstruidos al terminar (aunque la carga falle)
+    dropped_indexes = drop_secondary_indexes() if pending and use_bulk_indexes(pending) else []
 
-    for excel_file in excel_files:
-        file_path = os.path.join(data_folder, excel_file)
-        file_hash = calculate_file_hash(file_path)
-        
-        if excel_file in processed_files and processed_files[excel_file] == file_hash:
-            logger.info(f"SALTANDO: Saltando archivo: {excel_file} (ya procesado)")
-            skipped += 1
-            continue
-            
-        if process_excel_file_split(file_path):
-            processed += 1
-        else:
-            failed += 1
+    # Procesar archivos (con --profile, dentro del perfilador)
+    profiler = perfil.perfilador(os.path.join(PROFILE_DIR, f"etl_{datetime.now():%Y%m%d_%H%M%S}")) if profile else nullcontext()
+    try:
+        with profiler as profile_path:
+            processed, failed, run_medidor = load_pending_files(pending, workers)
+    finally:
+        index_timings = rebuild_secondary_indexes(dropped_indexes)
+    if profile_path:
+        logger.info(f"PERFIL: Reporte del perfilador en {profile_path}")
 
-    # Verificar integridad de las relaciones
-    verify_integrity()
+    # Verificar integridad de las relaciones: solo lo que cargó esta corrida, o completa si se pidió o toca
+    full_check = verify_full or full_verification_due()
+    if full_check or processed > 0:
+        verify_integrity(full=full_check)
+    else:
+        logger.info("INTEGRIDAD: Ningún archivo cargado en esta corrida, no hay folios que verificar")
+
+    publish_changes(processed)
 
     # Resumen final
     logger.info("\nRESUMEN: Resumen del proceso de acumulación:")
@@ -852,6 +2071,12 @@ def main():
     logger.info(f"   - Archivos saltados: {skipped}")
     logger.info(f"   - Archivos con error: {failed}")
     logger.info(f"   - Total de archivos: {len(excel_files)}")
+    if index_timings:
+        logger.info(f"   - Índices reconstruidos: {', '.join(f'{name} {secs:.2f}s' for name, secs in index_timings.items())}")
+    if run_medidor.etapas:
+        logger.info("\nETAPAS: Tiempo por etapa (suma de los archivos cargados):")
+        for linea in run_medidor.resumen():
+            logger.info(f"   {linea}")
     logger.info("\nESTRUCTURA FINAL CON RELACIONES:")
     logger.info("   - Tabla PRINCIPAL: Folios únicos (TABLA PADRE)")
     logger.info("   - Tabla CORPORACIONES: Múltiples corporaciones por folio (FK → PRINCIPAL)")
@@ -866,6 +2091,107 @@ def main():
     logger.info("   - Consultas con integridad referencial garantizada")
     logger.info("   - Eliminación automática de registros huérfanos")
 
+def _watch_filter(change, path: str) -> bool:
+    """Eventos de archivos de entrada creados o modificados (ignora borrados y temporales ~$ de Office)"""
+    return change != Change.deleted and lectores.is_input_file(os.path.basename(path))
+
+def wait_until_stable(file_path: str) -> bool:
+    """Espera a que el archivo deje de crecer (mismo tamaño y mtime en dos lecturas). False si desapareció"""
+    previous = None
+    deadline = time.monotonic() + WATCH_STABLE_TIMEOUT
+    while True:
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return False
+        current = (stat.st_size, stat.st_mtime_ns)
+        if current == previous:
+            return True
+        if time.monotonic() > deadline:
+            logger.warning(f"WARNING: {os.path.basename(file_path)} sigue cambiando tras {WATCH_STABLE_TIMEOUT}s, se reintenta en el próximo evento")
+            return False
+        previous = current
+        time.sleep(WATCH_STABLE_SECONDS)
+
+def run_daemon(workers: int = 1, verify_full: bool = False):
+    """
+    Modo daemon: vigila DATA_FOLDER con notificaciones del sistema de archivos y, ya con el watcher
+    activo, hace una corrida completa de main() para ponerse al día (lo que llegue durante esa corrida
+    queda en cola y se revisa después). Cada archivo nuevo o modificado se carga en cuanto termina de
+    escribirse, reutilizando el mismo engine (pool de conexiones) en todo el proceso.
+    Los archivos se cargan en orden de llegada (en un mismo lote de eventos, en orden alfabético).
+    verify_full: verificación de integridad completa en la corrida inicial y después de cada carga.
+    """
+    if watch is None:
+        logger.error("ERROR: El modo daemon requiere watchfiles (pip install watchfiles)")
+        return
+    if not os.path.exists(DATA_FOLDER):
+        logger.error(f"ERROR: La carpeta {DATA_FOLDER} no existe")
+        return
+    if not acquire_run_lock():
+        return
+
+    # yield_on_timeout: el primer next() vuelve en cuanto el watcher está activo; sus eventos los cubre main()
+    changes_iter = watch(DATA_FOLDER, watch_filter=_watch_filter, debounce=WATCH_DEBOUNCE_MS,
+                         yield_on_timeout=True, rust_timeout=WATCH_DEBOUNCE_MS)
+    next(changes_iter)
+    main(workers, verify_full=verify_full)
+    logger.info(f"DAEMON: Vigilando {os.path.abspath(DATA_FOLDER)} (Ctrl+C para detener)")
+    try:
+        for changes in changes_iter:
+            file_names = sorted({os.path.basename(path) for _, path in changes})
+            file_names = [f for f in file_names if wait_until_stable(os.path.join(DATA_FOLDER, f))]
+            if not file_names:
+                continue
+
+            logger.info(f"DAEMON: Cambios en {', '.join(file_names)}")
+            try:
+                pending, _ = plan_pending_files(DATA_FOLDER, file_names)
+                if not pending:
+                    continue
+                processed, failed, _ = load_pending_files(pending, workers)
+                if processed or verify_full:
+                    verify_integrity(full=verify_full)
+                publish_changes(processed)
+                logger.info(f"DAEMON: {processed} archivos cargados, {failed} con error. Esperando cambios...")
+            except Exception as e:
+                # El daemon sigue vivo; el archivo se reintenta cuando vuelva a cambiar
+                logger.error(f"ERROR: Error en el daemon procesando {', '.join(file_names)}: {str(e)}")
+    except KeyboardInterrupt:
+        pass
+    logger.info("DAEMON: Detenido")
+
 if __name__ == "__main__":
-    main()
-    logger.info("\nCOMPLETADO: Proceso de acumulación con relaciones completado")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Carga los Excel de DATA a las tablas principal, corporaciones y comentarios")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Procesos que leen y transforman archivos en paralelo (1 = secuencial)")
+    parser.add_argument("--upsert", action="store_true",
+                        help="Actualiza los folios existentes cuyo contenido cambió (por defecto solo se agregan folios nuevos)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Perfila la carga (pyinstrument si está instalado, si no cProfile) y guarda el reporte en PERFILES/")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Después de la corrida inicial, vigila DATA y carga cada archivo nuevo o modificado")
+    parser.add_argument("--bulk-indexes", choices=["auto", "always", "never"], default=BULK_INDEX_MODE,
+                        help="Quitar los índices secundarios durante la carga y reconstruirlos al final (auto: por tamaño)")
+    parser.add_argument("--verify-full", action="store_true",
+                        help="Verificación de integridad completa (recorre las tablas) en lugar de solo los folios de la corrida")
+    parser.add_argument("--replay-cuarentena", action="store_true",
+                        help="Reintenta en bloque las filas de la tabla cuarentena (después de corregirlas) y termina")
+    args = parser.parse_args()
+    if args.daemon and args.profile:
+        parser.error("--profile no se puede usar con --daemon (el reporte se escribe al terminar la corrida)")
+    UPSERT_MODE = args.upsert
+    BULK_INDEX_MODE = args.bulk_indexes
+    if args.replay_cuarentena:
+        if not acquire_run_lock():
+            raise SystemExit(1)
+        create_split_tables()
+        replayed, duplicates, remaining = replay_quarantine()
+        publish_changes(replayed)
+        logger.info(f"\nCOMPLETADO: {replayed} filas recuperadas de cuarentena, {duplicates} descartadas por folio "
+                    f"ya cargado, {remaining} siguen en cuarentena")
+    elif args.daemon:
+        run_daemon(workers=args.workers, verify_full=args.verify_full)
+    else:
+        main(workers=args.workers, profile=args.profile, verify_full=args.verify_full)
+        logger.info("\nCOMPLETADO: Proceso de acumulación con relaciones completado")
\ No newline at end of file
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""UNIÓN DE TEXTOS POR GRUPO PARA EL ETL.
+
+unir_por_grupo concatena los textos de cada grupo (por ejemplo, los comentarios o las notas de un
+FOLIO) en orden de aparición, sin una llamada de Python por grupo. Lo usan ETL.py
+(aggregate_comments) y SubirBases.py (aggregate_notes).
+"""
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+
+def unir_por_grupo(piezas: pd.DataFrame, claves: List[str], columna: str, separador: str = ' | ') -> pd.Series:
+    """
+    Une los valores de `columna` de cada grupo de `claves` con separador, en orden de aparición
+    (determinista entre corridas). El join se arma por capas: la pieza k de cada grupo se concatena
+    a todos los grupos a la vez, una pasada por posición. piezas no puede estar vacío.
+    Devuelve una Series indexada por las claves (MultiIndex si son varias), en orden de primera aparición.
+    """
+    # Grupos numerados por primera aparición; posicion = orden de la pieza dentro del grupo
+    grupos = piezas.groupby(claves, sort=False)
+    grupo = grupos.ngroup().to_numpy()
+    posicion = grupos.cumcount().to_numpy()
+    valores = piezas[columna].to_numpy(dtype=object)
+    unidos = np.empty(grupos.ngroups, dtype=object)
+    for k in range(posicion.max() + 1):
+        capa = posicion == k
+        unidos[grupo[capa]] = valores[capa] if k == 0 else unidos[grupo[capa]] + separador + valores[capa]
+
+    primeras = piezas.loc[posicion == 0, claves]
+    if len(claves) > 1:
+        indice = pd.MultiIndex.from_frame(primeras)
+    else:
+        indice = pd.Index(primeras[claves[0]].to_numpy(), name=claves[0])
+    return pd.Series(unidos, index=indice)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""MOTOR ANALÍTICO OPCIONAL SOBRE SNAPSHOTS PARQUET.
+
+Después de cada corrida del ETL se exportan principal, corporaciones y comentarios a Parquet
+particionado por año (carpeta SNAPSHOTS/<tabla>/anio=YYYY/). El backend consulta esos archivos
+con DuckDB (ejecución vectorizada y multinúcleo) para agregaciones y descargas grandes, sin
+cargar a PostgreSQL. Requiere los paquetes opcionales duckdb y pyarrow; sin ellos todo sigue
+funcionando contra PostgreSQL.
+"""
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy import text
+
+try:
+    import duckdb
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    ANALITICO_DISPONIBLE = True
+except ImportError:
+    duckdb = None
+    ANALITICO_DISPONIBLE = False
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SNAPSHOTS')
+SNAPSHOT_TABLES = ["principal", "corporaciones", "comentarios"]
+SNAPSHOT_BATCH_ROWS = 200_000  # filas leídas de PostgreSQL por lote al exportar
+
+# Las tablas hijas se particionan con el año del folio en principal
+_EXPORT_QUERIES = {
+    "principal": "SELECT p.*, COALESCE(EXTRACT(YEAR FROM p.fecha)::int, 0) AS anio FROM principal p",
+    "corporaciones": """
+        SELECT c.*, COALESCE(EXTRACT(YEAR FROM p.fecha)::int, 0) AS anio
+        FROM corporaciones c JOIN principal p ON p.folio = c.folio
+    """,
+    "comentarios": """
+        SELECT m.*, COALESCE(EXTRACT(YEAR FROM p.fecha)::int, 0) AS anio
+        FROM comentarios m JOIN principal p ON p.folio = m.folio
+    """,
+}
+
+
+def _normalize_batch(df: pd.DataFrame) -> "pa.Table":
+    """Tipos estables entre lotes: texto como string, FECHA como date"""
+    for col in df.columns:
+        if col == 'fecha':
+            df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
+        elif df[col].dtype == object:
+            df[col] = df[col].astype('string')
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def exportar_snapshots(engine, destino: str = SNAPSHOT_DIR) -> Dict[str, int]:
+    """
+    Exporta las 3 tablas a Parquet particionado por año. Se escribe en una carpeta temporal y
+    se reemplaza el snapshot anterior al final, así el backend nunca lee un snapshot a medias.
+    """
+    if not ANALITICO_DISPONIBLE:
+        logger.warning("WARNING: duckdb/pyarrow no instalados, no se exportan snapshots Parquet")
+        return {}
+
+    temporal = f"{destino}.tmp_{datetime.now():%Y%m%d%H%M%S}"
+    conteos = {}
+    try:
+        with engine.connect() as conn:
+            # Cursor del lado del servidor (lotes sin cargar la tabla completa) y un solo
+            # snapshot de la base para las 3 tablas
+            conn.execution_options(isolation_level="REPEATABLE READ", stream_results=True)
+            for tabla in SNAPSHOT_TABLES:
+                carpeta = os.path.join(temporal, tabla)
+                os.makedirs(carpeta, exist_ok=True)
+                conteos[tabla] = 0
+                lotes = pd.read_sql_query(text(_EXPORT_QUERIES[tabla]), conn, chunksize=SNAPSHOT_BATCH_ROWS)
+                for i, df in enumerate(lotes):
+                    pq.write_to_dataset(
+                        _normalize_batch(df), carpeta, partition_cols=['anio'],
+                        basename_template=f"lote{i:05d}-{{i}}.parquet"
+                    )
+                    conteos[tabla] += len(df)
+                logger.info(f"   - Snapshot {tabla}: {conteos[tabla]} filas")
+            conn.rollback()
+
+        anterior = f"{destino}.old"
+        if os.path.exists(anterior):
+            shutil.rmtree(anterior)
+        if os.path.exists(destino):
+            os.replace(destino, anterior)
+        os.replace(temporal, destino)
+        shutil.rmtree(anterior, ignore_errors=True)
+        logger.info(f"OK: Snapshots Parquet actualizados en {destino}")
+        return conteos
+    except Exception as e:
+        logger.error(f"ERROR: Error exportando snapshots Parquet: {str(e)}")
+        shutil.rmtree(temporal, ignore_errors=True)
+        return {}
+
+
+def snapshot_disponible(destino: str = SNAPSHOT_DIR) -> bool:
+    return ANALITICO_DISPONIBLE and all(os.path.isdir(os.path.join(destino, t)) for t in SNAPSHOT_TABLES)
+
+
+class MotorAnalitico:
+    """Conexión DuckDB en memoria con una vista por tabla sobre los archivos Parquet"""
+
+    def __init__(self, destino: str = SNAPSHOT_DIR, threads: Optional[int] = None):
+        self.destino = destino
+        self._conn = duckdb.connect(database=':memory:')
+        if threads:
+            self._conn.execute(f"SET threads = {int(threads)}")
+        for tabla in SNAPSHOT_TABLES:
+            patron = os.path.join(destino, tabla, '**', '*.parquet').replace("'", "''")
+            self._conn.execute(f"""
+                CREATE OR REPLACE VIEW {tabla} AS
+                SELECT * EXCLUDE (anio)
+                FROM read_parquet('{patron}', hive_partitioning = true, union_by_name = true)
+            """)
+
+    def consultar(self, sql_query: str, params: Optional[List] = None) -> pd.DataFrame:
+        """
+        Ejecuta una consulta con marcadores estilo psycopg2 (%s), como los que arma
+        build_filter_logic en backend.py. Cada llamada usa su propio cursor (seguro entre hilos).
+        """
+        cursor = self._conn.cursor()
+        try:
+            return cursor.execute(sql_query.replace('%s', '?'), params or []).df()
+        finally:
+            cursor.close()
+
+    def consultar_por_lotes(self, sql_query: str, params: Optional[List] = None, filas: int = SNAPSHOT_BATCH_ROWS):
+        """
+        Como consultar, pero devuelve (cursor, lector de lotes Arrow de hasta filas filas) para
+        recorrer el resultado sin materializarlo; quien lo llama cierra el cursor al terminar.
+        """
+        cursor = self._conn.cursor()
+        try:
+            return cursor, cursor.execute(sql_query.replace('%s', '?'), params or []).fetch_record_batch(filas)
+        except Exception:
+            cursor.close()
+            raise
+
+
+_motor = None
+_motor_lock = threading.Lock()
+
+
+def obtener_motor(destino: str = SNAPSHOT_DIR) -> Optional[MotorAnalitico]:
+    """Motor compartido del proceso, o None si no hay duckdb o aún no hay snapshots"""
+    global _motor
+    if not snapshot_disponible(destino):
+        return None
+    with _motor_lock:
+        if _motor is None or _motor.destino != destino:
+            _motor = MotorAnalitico(destino)
+        return _motor
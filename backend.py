@@ -1,14 +1,28 @@
 # -*- coding: utf-8 -*-
 # archivo que contiene toda la lógica del backend
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from pydantic import BaseModel, Field
-from typing import List, Literal, Optional, Union, Tuple
+from typing import Dict, List, Literal, Optional, Union, Tuple
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import psycopg2
+import psycopg2.pool
+import asyncio
+import hashlib
 import io
+import json
+import math
+import tempfile
 import datetime
-from fastapi.responses import StreamingResponse
+import threading
+import time
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+import analitico
 
 # 1. Creamos una "instancia" de FastAPI.
 app = FastAPI()
@@ -33,6 +47,30 @@ class QueryRequest(BaseModel):
     columns: List[str] = Field(default_factory=list)
     filters: List[FilterCondition] = Field(default_factory=list)
     file_type: str = 'xlsx'
+    use_primary: bool = False  # True para leer del primario (p. ej. justo después de una carga del ETL)
+    parallel: Optional[bool] = None  # /api/download en CSV: None = según tamaño estimado, True/False fuerza
+
+class AggregateRequest(QueryRequest):
+    group_by: List[str] = Field(default_factory=list)
+    date_bucket: Optional[Literal['day', 'week', 'month', 'year']] = None  # agrupa FECHA por periodo
+
+class SlaRequest(BaseModel):
+    group_by: List[Literal['corporacion', 'municipio', 'tipo']] = Field(default_factory=list)
+    date_bucket: Optional[Literal['day', 'week', 'month', 'year']] = 'month'  # periodo de FECHA del folio
+    metrics: List[Literal['despacho', 'llegada', 'solucion']] = Field(default_factory=lambda: list(SLA_METRICS))
+    percentiles: List[float] = Field(default_factory=lambda: [0.5, 0.9])
+    filters: List[FilterCondition] = Field(default_factory=list)
+    use_primary: bool = False
+
+# Duraciones en segundos que SubirBases.py calcula al cargar corporaciones (columnas normales, add_duration_columns)
+SLA_METRICS = {"despacho": "seg_despacho", "llegada": "seg_llegada", "solucion": "seg_solucion"}
+# Columnas de /api/sla (corporaciones unida con su folio en principal), para agrupar y filtrar
+SLA_COLUMNS = [
+    {"column_name": "corporacion", "data_type": "text", "source": "c"},
+    {"column_name": "municipio", "data_type": "text", "source": "p"},
+    {"column_name": "tipo", "data_type": "text", "source": "p"},
+    {"column_name": "fecha", "data_type": "date", "source": "p"},
+] + [{"column_name": column, "data_type": "integer", "source": "c"} for column in SLA_METRICS.values()]
 
 # --- Configuración de la Base de Datos ---
 DB_NAME = 'app_sql'
@@ -41,6 +79,58 @@ DB_PASS = '1234'
 DB_HOST = 'localhost'
 DB_PORT = '5432'
 
+# --- Réplicas de lectura ---
+# DSN de réplicas para /api/query, /api/download y /api/schema. Vacía = todo va al primario.
+# Ej. local: ["host=localhost port=5433 dbname=app_sql user=app_ri_user password=1234"]
+DB_READ_DSNS = []
+REPLICA_MAX_LAG = 30          # segundos de retraso de replicación tolerados antes de sacar una réplica
+REPLICA_HEALTH_INTERVAL = 10  # segundos entre verificaciones de salud de cada réplica
+REPLICA_CONNECT_TIMEOUT = 3   # segundos
+
+# --- Diccionarios de valores (/api/values) ---
+VALUES_CACHE_TTL = 300  # segundos que se conserva en memoria el diccionario de una columna
+_values_cache = {}  # (tabla, columna) -> (momento_de_carga, [(valor, conteo), ...])
+_values_cache_lock = threading.Lock()
+
+# --- Configuración del control de admisión ---
+# Consultas simultáneas permitidas por carril. El carril "rapida" atiende búsquedas
+# puntuales (igualdad sobre folio/id) para que no esperen detrás de exportaciones.
+ADMISSION_LIMITS = {"rapida": 8, "preview": 4, "agregado": 2, "exportacion": 2}
+# Los endpoints síncronos esperan su turno ocupando un hilo del threadpool: el total en espera
+# (todos los carriles) se limita muy por debajo de SYNC_THREADPOOL_SIZE para que siempre queden
+# hilos para el carril rápido y las rutas sin admisión; pasado el límite se responde 429.
+# Hilos ocupados como máximo: sum(ADMISSION_LIMITS) + ADMISSION_MAX_WAITING = 28 de 40
+SYNC_THREADPOOL_SIZE = 40   # hilos del threadpool de anyio (valor por defecto; solo referencia para el cálculo)
+ADMISSION_MAX_QUEUE = 8     # consultas en espera por carril antes de responder 429
+ADMISSION_MAX_WAITING = 12  # consultas en espera entre todos los carriles antes de responder 429
+ADMISSION_MAX_WAIT = 30     # segundos máximos de espera en cola
+
+# Motor analítico (DuckDB sobre snapshots Parquet, ver analitico.py). Agregaciones y descargas
+# cuyo plan estimado supere este número de filas se resuelven fuera de PostgreSQL.
+ANALYTIC_MIN_ROWS = 100_000
+
+# Exportación paralela: descargas CSV grandes que se quedan en PostgreSQL se parten en rangos de
+# id y cada rango se exporta con COPY por su propia conexión, todas dentro del mismo snapshot.
+PARALLEL_EXPORT_WORKERS = 4         # conexiones por descarga (0 = desactivado)
+PARALLEL_EXPORT_MIN_ROWS = 200_000  # filas estimadas a partir de las cuales se paraleliza
+EXPORT_SPOOL_MB = 64                # MB de cada rango en memoria antes de pasar a archivo temporal
+EXPORT_BATCH_ROWS = 100_000         # filas por lote al enviar una descarga CSV desde DuckDB
+
+# --- Resultados progresivos (/api/query/stream) ---
+PREVIEW_ROWS = 20               # filas de vista previa de /api/query
+STREAM_FETCH_ROWS = 5_000       # filas por FETCH del cursor del servidor después de la vista previa
+STREAM_PROGRESS_INTERVAL = 0.5  # segundos entre eventos de conteo parcial
+
+# --- Caché HTTP (ETag) ---
+# Las respuestas de /api/schema, /api/query, /api/aggregate y /api/sla llevan un ETag derivado de
+# la versión de los datos (version_datos, que un trigger incrementa con cada escritura en las tablas)
+# y de la estructura de las tablas; con If-None-Match igual se responde 304 sin consultar.
+CACHE_MAX_AGE = 60      # segundos que el navegador o un proxy pueden reutilizar /api/schema sin preguntar
+DATA_VERSION_TTL = 5    # segundos que se reutiliza la versión leída de la base antes de volver a leerla
+_data_version_cache = {}  # use_primary -> (momento_de_lectura, versión)
+_data_version_lock = threading.Lock()
+_schema_cache = {}  # use_primary -> (versión, esquema)
+
 # --- Funciones Auxiliares de Lógica ---
 
 def _process_single_condition(f: FilterCondition, col_type: str) -> Tuple[Optional[str], List, Optional[str]]:
@@ -172,11 +262,104 @@ def build_filter_logic(filters: List[FilterCondition], table_schema: List[dict])
     
     return final_where_clause, final_case_clause, case_params, where_only_params
 
-def run_query(sql_query: str, params=None):
+# --- Conexiones (primario y réplicas de lectura) ---
+
+class ReplicaRouter:
+    """
+    Reparte las lecturas entre las réplicas en round-robin. Cada réplica se verifica
+    como máximo cada REPLICA_HEALTH_INTERVAL segundos; se descarta si no responde o si
+    su retraso de replicación supera REPLICA_MAX_LAG. Sin réplicas sanas se usa el primario.
+    """
+    _LAG_QUERY = """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    """
+
+    def __init__(self, dsns: List[str], max_lag: float, health_interval: float):
+        self._lock = threading.Lock()
+        self._replicas = [{"dsn": dsn, "healthy": True, "lag": None, "checked": 0.0} for dsn in dsns]
+        self._next = 0
+        self.max_lag = max_lag
+        self.health_interval = health_interval
+
+    def _check(self, replica: dict):
+        try:
+            conn = psycopg2.connect(replica["dsn"], connect_timeout=REPLICA_CONNECT_TIMEOUT)
+            try:
+                cursor = conn.cursor()
+                cursor.execute(self._LAG_QUERY)
+                lag = float(cursor.fetchone()[0])
+                cursor.close()
+            finally:
+                conn.close()
+            replica["lag"] = lag
+            replica["healthy"] = lag <= self.max_lag
+            if not replica["healthy"]:
+                print(f"Advertencia: réplica con retraso de {lag:.0f} s, se omite.")
+        except psycopg2.Error as e:
+            replica["healthy"] = False
+            replica["lag"] = None
+            print(f"Advertencia: réplica no disponible ({e}).")
+
+    def _usable(self, replica: dict) -> bool:
+        with self._lock:
+            stale = time.monotonic() - replica["checked"] >= self.health_interval
+            if stale:
+                replica["checked"] = time.monotonic()  # un solo hilo verifica la réplica
+        if stale:
+            self._check(replica)
+        return replica["healthy"]
+
+    def pick(self) -> Optional[str]:
+        """DSN de la siguiente réplica sana, o None si hay que usar el primario"""
+        if not self._replicas:
+            return None
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self._replicas)
+        for i in range(len(self._replicas)):
+            replica = self._replicas[(start + i) % len(self._replicas)]
+            if self._usable(replica):
+                return replica["dsn"]
+        return None
+
+    def mark_down(self, dsn: str):
+        for replica in self._replicas:
+            if replica["dsn"] == dsn:
+                replica["healthy"] = False
+                replica["checked"] = time.monotonic()
+
+    def status(self) -> List[dict]:
+        return [
+            {"replica": i, "healthy": r["healthy"], "lagSeconds": r["lag"]}
+            for i, r in enumerate(self._replicas)
+        ]
+
+replica_router = ReplicaRouter(DB_READ_DSNS, REPLICA_MAX_LAG, REPLICA_HEALTH_INTERVAL)
+
+def get_connection(use_primary: bool = True):
+    """
+    Conexión a PostgreSQL. Las lecturas (use_primary=False) van a una réplica sana;
+    escrituras y lecturas que deben ver la última carga del ETL van al primario.
+    """
+    if not use_primary:
+        dsn = replica_router.pick()
+        if dsn:
+            try:
+                return psycopg2.connect(dsn, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+            except psycopg2.OperationalError as e:
+                print(f"Advertencia: réplica no disponible ({e}), se usa el primario.")
+                replica_router.mark_down(dsn)
+    return psycopg2.connect(
+        database=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+    )
+
+def run_query(sql_query: str, params=None, use_primary: bool = False):
     try:
-        conn = psycopg2.connect(
-            database=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
-        )
+        conn = get_connection(use_primary)
         df = pd.read_sql_query(sql_query, conn, params=params)
         conn.close()
         return df
@@ -184,6 +367,439 @@ def run_query(sql_query: str, params=None):
         print(f"Error al ejecutar la consulta: {e} \n Intente nuevamente.")
         return pd.DataFrame()
 
+def estimate_rows(sql_query: str, params=None, use_primary: bool = False) -> Optional[int]:
+    """Filas estimadas por el planificador de PostgreSQL (EXPLAIN, sin ejecutar la consulta)"""
+    try:
+        conn = get_connection(use_primary)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"EXPLAIN (FORMAT JSON) {sql_query}", params)
+                return int(cur.fetchone()[0][0]["Plan"]["Plan Rows"])
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Advertencia: no se pudo estimar la consulta: {e}")
+        return None
+
+def use_analytic_engine(table: str, count_query: str, params=None, use_primary: bool = False) -> bool:
+    """
+    Enruta por tamaño estimado: consultas grandes sobre tablas con snapshot van a DuckDB.
+    use_primary fuerza PostgreSQL porque el snapshot puede no incluir la última carga.
+    """
+    if use_primary or table not in analitico.SNAPSHOT_TABLES or not analitico.snapshot_disponible():
+        return False
+    estimated = estimate_rows(count_query, params)
+    return estimated is not None and estimated >= ANALYTIC_MIN_ROWS
+
+def run_analytic_query(sql_query: str, params=None) -> Optional[pd.DataFrame]:
+    """Ejecuta en el motor analítico; None si no está disponible o falla (se usa PostgreSQL)"""
+    try:
+        motor = analitico.obtener_motor()
+        return motor.consultar(sql_query, params) if motor else None
+    except Exception as e:
+        print(f"Advertencia: motor analítico falló ({e}), se usa PostgreSQL.")
+        return None
+
+def run_analytic_batches(sql_query: str, params=None):
+    """
+    Como run_analytic_query, pero devuelve (cursor, lector de lotes Arrow) para recorrer el
+    resultado sin pasarlo completo a pandas. None si no está disponible o falla (se usa PostgreSQL).
+    """
+    try:
+        motor = analitico.obtener_motor()
+        return motor.consultar_por_lotes(sql_query, params, EXPORT_BATCH_ROWS) if motor else None
+    except Exception as e:
+        print(f"Advertencia: motor analítico falló ({e}), se usa PostgreSQL.")
+        return None
+
+def stream_analytic_csv(cursor, reader, release):
+    """CSV de un resultado de DuckDB lote por lote (memoria acotada a un lote); al final libera la admisión"""
+    try:
+        header = True
+        for batch in reader:
+            yield batch.to_pandas().to_csv(index=False, header=header).encode('utf-8')
+            header = False
+        if header:
+            yield reader.schema.empty_table().to_pandas().to_csv(index=False).encode('utf-8')
+    finally:
+        cursor.close()
+        release()
+
+# --- Exportación paralela ---
+
+_export_pools = {}  # DSN (None = primario) -> ThreadedConnectionPool
+_export_pools_lock = threading.Lock()
+
+def get_export_pool(use_primary: bool = False):
+    """
+    Pool de conexiones para exportaciones paralelas, uno por servidor. Todas las conexiones de
+    una descarga salen del mismo pool porque un snapshot solo se importa en el mismo servidor.
+    """
+    dsn = None if use_primary else replica_router.pick()
+    with _export_pools_lock:
+        pool = _export_pools.get(dsn)
+        if pool is None:
+            maxconn = ADMISSION_LIMITS["exportacion"] * (PARALLEL_EXPORT_WORKERS + 1)
+            try:
+                if dsn:
+                    pool = psycopg2.pool.ThreadedConnectionPool(0, maxconn, dsn, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+                else:
+                    pool = psycopg2.pool.ThreadedConnectionPool(
+                        0, maxconn, database=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+                    )
+            except psycopg2.OperationalError as e:
+                if not dsn:
+                    raise
+                print(f"Advertencia: réplica no disponible ({e}), se usa el primario.")
+                replica_router.mark_down(dsn)
+                return get_export_pool(use_primary=True)
+            _export_pools[dsn] = pool
+        return pool
+
+def _return_connection(pool, conn):
+    """Devuelve la conexión al pool sin transacción abierta; si quedó rota, se descarta"""
+    try:
+        conn.rollback()
+        pool.putconn(conn)
+    except psycopg2.Error:
+        pool.putconn(conn, close=True)
+
+def _export_range(pool, snapshot: str, query: str, header: bool, imported: threading.Semaphore):
+    """
+    Importa el snapshot de la descarga y exporta un rango con COPY a un archivo temporal
+    (en memoria hasta EXPORT_SPOOL_MB). Avisa en imported apenas importó el snapshot.
+    """
+    conn, signaled, output = None, False, None
+    try:
+        conn = pool.getconn()
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        conn.set_client_encoding("UTF8")
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot,))
+            imported.release()
+            signaled = True
+            output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MB * 1024 * 1024)
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER {str(header).lower()})", output)
+        output.seek(0)
+        return output
+    except Exception:
+        if output is not None:
+            output.close()
+        raise
+    finally:
+        if not signaled:
+            imported.release()
+        if conn is not None:
+            _return_connection(pool, conn)
+
+def export_csv_parallel(table_name: str, cols: str, where_sql: str, params: List, use_primary: bool = False) -> Optional[List]:
+    """
+    Exporta la consulta como CSV en PARALLEL_EXPORT_WORKERS rangos de id, cada uno por su conexión.
+    La conexión líder abre un snapshot REPEATABLE READ y lo exporta (pg_export_snapshot); los
+    rangos lo importan, así todos ven los mismos datos aunque el ETL esté cargando. Devuelve los
+    archivos en orden de id (solo el primero lleva encabezado), o None si no se puede
+    paralelizar (tabla sin id, vacía, pool agotado o error); en ese caso se usa run_query.
+    """
+    files = []
+    try:
+        pool = get_export_pool(use_primary)
+        leader = pool.getconn()
+        try:
+            leader.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            with leader.cursor() as cur:
+                cur.execute(f'SELECT min("id"), max("id"), pg_export_snapshot() FROM {table_name}')
+                low, high, snapshot = cur.fetchone()
+                if low is None:
+                    return None
+                bounds = [low + (high - low + 1) * i // PARALLEL_EXPORT_WORKERS for i in range(PARALLEL_EXPORT_WORKERS + 1)]
+                ranges = [(lo, hi) for lo, hi in zip(bounds, bounds[1:]) if lo < hi]
+                range_where = f"({where_sql[len('WHERE '):]}) AND" if where_sql else ""
+                queries = [
+                    cur.mogrify(
+                        f'SELECT {cols} FROM {table_name} WHERE {range_where} "id" >= %s AND "id" < %s',
+                        list(params or []) + [lo, hi]
+                    ).decode()
+                    for lo, hi in ranges
+                ]
+            imported = threading.Semaphore(0)
+            with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+                futures = [
+                    executor.submit(_export_range, pool, snapshot, query, i == 0, imported)
+                    for i, query in enumerate(queries)
+                ]
+                # El snapshot exportado solo existe mientras la transacción líder siga abierta
+                for _ in futures:
+                    imported.acquire()
+                leader.rollback()
+                errors = []
+                for future in futures:
+                    try:
+                        files.append(future.result())
+                    except Exception as e:
+                        errors.append(e)
+                if errors:
+                    raise errors[0]
+            return files
+        finally:
+            _return_connection(pool, leader)
+    except Exception as e:
+        print(f"Advertencia: exportación paralela falló ({e}), se exporta con una sola conexión.")
+        for f in files:
+            f.close()
+        return None
+
+def stream_files(files: List, block_size: int = 1024 * 1024):
+    """Concatena los archivos de la exportación paralela en orden y los cierra al terminar"""
+    try:
+        for f in files:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                yield block
+    finally:
+        for f in files:
+            f.close()
+
+# --- Caché HTTP ---
+
+_SCHEMA_VERSION_QUERY = """
+    SELECT md5(string_agg(c.relname || '.' || a.attname || ':' || a.atttypid::regtype::text, ',' ORDER BY c.relname, a.attnum))
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'app_sql' AND c.relkind IN ('r', 'v', 'm', 'p') AND a.attnum > 0 AND NOT a.attisdropped
+"""
+
+def get_data_version(use_primary: bool = False) -> Optional[str]:
+    """
+    Versión de los datos (contador de version_datos) más huella de la estructura de las tablas,
+    leída como máximo cada DATA_VERSION_TTL segundos. None si no se puede leer (sin caché HTTP).
+    """
+    with _data_version_lock:
+        cached = _data_version_cache.get(use_primary)
+        if cached and time.monotonic() - cached[0] < DATA_VERSION_TTL:
+            return cached[1]
+    try:
+        conn = get_connection(use_primary)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(_SCHEMA_VERSION_QUERY)
+                schema_version = cur.fetchone()[0]
+                cur.execute("SELECT to_regclass('version_datos') IS NOT NULL")
+                data_version = 0  # el ETL aún no ha registrado ninguna corrida
+                if cur.fetchone()[0]:
+                    cur.execute("SELECT version FROM version_datos WHERE id = 1")
+                    row = cur.fetchone()
+                    data_version = row[0] if row else 0
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        print(f"Advertencia: no se pudo leer la versión de los datos: {e}")
+        return None
+    version = f"{data_version}-{schema_version}"
+    with _data_version_lock:
+        _data_version_cache[use_primary] = (time.monotonic(), version)
+    return version
+
+def response_etag(use_primary: bool, *key) -> Optional[str]:
+    """ETag de una respuesta: versión de los datos + ruta y parámetros de la consulta"""
+    version = get_data_version(use_primary)
+    if version is None:
+        return None
+    digest = hashlib.md5(json.dumps([version, *key], sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(http_request: Request, etag: Optional[str]) -> bool:
+    if etag is None:
+        return False
+    header = http_request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in candidates or "*" in candidates
+
+def set_cache_headers(response: Response, etag: Optional[str], use_primary: bool, shared: bool = False):
+    """
+    Las respuestas de POST (/api/query, /api/aggregate, /api/sla) no se reutilizan sin preguntar
+    (private, no-cache): el cliente reenvía el ETag y recibe 304 si no cambió. /api/schema (shared)
+    se reutiliza CACHE_MAX_AGE segundos, salvo con use_primary (el cliente quiere ver la última carga)
+    """
+    if etag is None:
+        return
+    response.headers["ETag"] = etag
+    if not shared:
+        response.headers["Cache-Control"] = "private, no-cache"
+    else:
+        response.headers["Cache-Control"] = "no-cache" if use_primary else f"public, max-age={CACHE_MAX_AGE}"
+
+def not_modified(etag: str, use_primary: bool, shared: bool = False) -> Response:
+    response = Response(status_code=304)
+    set_cache_headers(response, etag, use_primary, shared)
+    return response
+
+# --- Control de admisión ---
+
+class AdmissionRejected(Exception):
+    """La cola del carril está llena o se agotó el tiempo de espera."""
+    def __init__(self, lane: str, retry_after: int):
+        super().__init__(f"Carril '{lane}' saturado")
+        self.lane = lane
+        self.retry_after = retry_after
+
+class _Ticket:
+    __slots__ = ("lane", "client", "event", "granted", "released", "enqueued_at", "started_at")
+
+    def __init__(self, lane: str, client: str):
+        self.lane = lane
+        self.client = client
+        self.event = threading.Event()
+        self.granted = False
+        self.released = False
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+
+class _Lane:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.queued = 0
+        self.waiting = OrderedDict()  # cliente -> deque de tickets (turno rotativo entre clientes)
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_service = 0.0
+
+class AdmissionController:
+    """
+    Limita la concurrencia por tipo de consulta (carril). Dentro de cada carril la cola
+    es justa por cliente: cuando se libera un lugar se atiende al siguiente cliente en
+    turno rotativo, así un analista con muchas exportaciones no acapara el carril. Una consulta
+    que tendría que esperar se rechaza si su carril ya tiene max_queue en cola o si entre todos
+    los carriles ya hay max_waiting (cada espera ocupa un hilo del threadpool).
+    """
+    def __init__(self, limits: Dict[str, int], max_queue: int, max_wait: float, max_waiting: int):
+        self._lock = threading.Lock()
+        self._lanes = {name: _Lane(limit) for name, limit in limits.items()}
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+
+    def _retry_after(self, lane: _Lane) -> int:
+        """Estimación de segundos hasta que el carril tenga lugar (para el encabezado Retry-After)"""
+        avg_service = lane.total_service / lane.completed if lane.completed else 1.0
+        return max(1, min(60, math.ceil(avg_service * (lane.queued + 1) / max(lane.limit, 1))))
+
+    def _dispatch(self, lane: _Lane):
+        """Asigna los lugares libres del carril a los clientes en espera (turno rotativo)"""
+        while lane.active < lane.limit and lane.waiting:
+            client, queue = next(iter(lane.waiting.items()))
+            ticket = queue.popleft()
+            if queue:
+                lane.waiting.move_to_end(client)
+            else:
+                del lane.waiting[client]
+            lane.queued -= 1
+            self._start(lane, ticket)
+            ticket.event.set()
+
+    def _start(self, lane: _Lane, ticket: _Ticket):
+        now = time.monotonic()
+        wait = now - ticket.enqueued_at
+        ticket.granted = True
+        ticket.started_at = now
+        lane.active += 1
+        lane.admitted += 1
+        lane.total_wait += wait
+        lane.max_wait = max(lane.max_wait, wait)
+
+    def acquire(self, lane_name: str, client: str) -> _Ticket:
+        ticket = _Ticket(lane_name, client)
+        with self._lock:
+            lane = self._lanes[lane_name]
+            if lane.active < lane.limit and not lane.waiting:
+                self._start(lane, ticket)
+                return ticket
+            waiting = sum(other.queued for other in self._lanes.values())
+            if lane.queued >= self.max_queue or waiting >= self.max_waiting:
+                lane.rejected += 1
+                raise AdmissionRejected(lane_name, self._retry_after(lane))
+            lane.waiting.setdefault(client, deque()).append(ticket)
+            lane.queued += 1
+
+        if not ticket.event.wait(self.max_wait):
+            with self._lock:
+                if not ticket.granted:
+                    queue = lane.waiting.get(client)
+                    if queue is not None:
+                        queue.remove(ticket)
+                        if not queue:
+                            del lane.waiting[client]
+                    lane.queued -= 1
+                    lane.timeouts += 1
+                    raise AdmissionRejected(lane_name, self._retry_after(lane))
+        return ticket
+
+    def release(self, ticket: _Ticket):
+        """Libera el lugar del ticket; llamarlo otra vez no hace nada (respuestas en streaming)"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            lane = self._lanes[ticket.lane]
+            lane.active -= 1
+            lane.completed += 1
+            lane.total_service += time.monotonic() - ticket.started_at
+            self._dispatch(lane)
+
+    @contextmanager
+    def admit(self, lane_name: str, client: str):
+        ticket = self.acquire(lane_name, client)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "limit": lane.limit,
+                    "active": lane.active,
+                    "queueDepth": lane.queued,
+                    "clientsWaiting": len(lane.waiting),
+                    "admitted": lane.admitted,
+                    "rejected": lane.rejected,
+                    "timeouts": lane.timeouts,
+                    "avgWaitMs": round(1000 * lane.total_wait / lane.admitted, 1) if lane.admitted else 0.0,
+                    "maxWaitMs": round(1000 * lane.max_wait, 1),
+                    "avgServiceMs": round(1000 * lane.total_service / lane.completed, 1) if lane.completed else 0.0,
+                }
+                for name, lane in self._lanes.items()
+            }
+
+admission = AdmissionController(ADMISSION_LIMITS, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT, ADMISSION_MAX_WAITING)
+
+def classify_query(request: QueryRequest) -> str:
+    """Las búsquedas puntuales (igualdad sobre folio o id, sin OR) van al carril rápido"""
+    point_lookup = any(f.column in ("folio", "id") and f.operator == "=" for f in request.filters)
+    has_or = any(f.logical == "OR" for f in request.filters[1:])
+    return "rapida" if point_lookup and not has_or else "preview"
+
+def client_id(http_request: Request) -> str:
+    return http_request.client.host if http_request.client else "desconocido"
+
+@app.exception_handler(AdmissionRejected)
+def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": f"Servidor ocupado (carril {exc.lane}). Intente nuevamente en {exc.retry_after} s."},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # --- Endpoints de la API ---
 
 @app.get("/")
@@ -191,10 +807,20 @@ def read_root():
     return {"message": "¡Hola! Mi servidor SQL está funcionando:)."}
 
 @app.get("/api/schema")
-def get_schema():
-    conn = psycopg2.connect(
-        database=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
-    )
+def read_schema(http_request: Request, response: Response, use_primary: bool = False):
+    etag = response_etag(use_primary, "schema")
+    if etag_matches(http_request, etag):
+        return not_modified(etag, use_primary, shared=True)
+    set_cache_headers(response, etag, use_primary, shared=True)
+    return get_schema(use_primary)
+
+def get_schema(use_primary: bool = False):
+    """Columnas y tipos de cada tabla; se vuelve a leer solo cuando cambia la versión de los datos"""
+    version = get_data_version(use_primary)
+    cached = _schema_cache.get(use_primary)
+    if version is not None and cached and cached[0] == version:
+        return cached[1]
+    conn = get_connection(use_primary)
     cursor = conn.cursor()
     cursor.execute("""
         SELECT table_name 
@@ -215,16 +841,123 @@ def get_schema():
         
     cursor.close()
     conn.close()
+    if version is not None:
+        _schema_cache[use_primary] = (version, schema)
     return schema
 
-@app.post("/api/query")
-def handle_query(request: QueryRequest):
+def _get_column_dictionary(table: str, column: str) -> List[Tuple[str, int]]:
+    """
+    Devuelve los valores distintos de una columna (ordenados por frecuencia) desde
+    diccionario_valores, que el ETL refresca en cada corrida. Se cachea en memoria (las
+    columnas sin valores no, para verlas en cuanto el ETL llene su diccionario).
+    """
+    key = (table, column)
+    with _values_cache_lock:
+        cached = _values_cache.get(key)
+    if cached and time.monotonic() - cached[0] < VALUES_CACHE_TTL:
+        return cached[1]
+
+    conn = get_connection(use_primary=False)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT valor, conteo
+            FROM diccionario_valores
+            WHERE tabla = %s AND columna = %s
+            ORDER BY conteo DESC, valor
+        """, (table, column))
+        values = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+
+    if values:
+        with _values_cache_lock:
+            _values_cache[key] = (time.monotonic(), values)
+    return values
+
+def _fuzzy_column_values(table: str, column: str, text_value: str, limit: int) -> Optional[List[Tuple[str, int]]]:
+    """Búsqueda difusa por trigramas (pg_trgm). Devuelve None si la extensión no está disponible."""
+    conn = get_connection(use_primary=False)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT valor, conteo
+            FROM diccionario_valores
+            WHERE tabla = %s AND columna = %s AND valor %% %s
+            ORDER BY similarity(valor, %s) DESC, conteo DESC
+            LIMIT %s
+        """, (table, column, text_value, text_value, limit))
+        values = cursor.fetchall()
+        cursor.close()
+        return values
+    except psycopg2.Error as e:
+        print(f"Advertencia: búsqueda difusa no disponible ({e}), se usa coincidencia parcial.")
+        return None
+    finally:
+        conn.close()
+
+@app.get("/api/values")
+def get_column_values(
+    table: str,
+    column: str,
+    prefix: str = "",
+    limit: int = Query(20, ge=1, le=200),
+    fuzzy: bool = False
+):
+    """
+    Valores más frecuentes de una columna de filtro, con autocompletado por prefijo
+    y búsqueda difusa opcional (trigramas) para corregir la escritura.
+    """
+    table_schema = get_schema(False).get(table)
+    if table_schema is None:
+        raise HTTPException(status_code=400, detail=f"Tabla '{table}' no encontrada")
+    if not any(col["column_name"] == column for col in table_schema):
+        raise HTTPException(status_code=400, detail=f"La tabla '{table}' no tiene la columna '{column}'")
+    try:
+        values = _get_column_dictionary(table, column)
+    except psycopg2.Error as e:
+        # diccionario_valores aún no existe (el ETL no ha corrido con esta versión)
+        print(f"Advertencia: no se pudo leer diccionario_valores: {e}")
+        raise HTTPException(status_code=503, detail="Diccionario de valores no disponible; ejecute el ETL")
+    if not values:
+        raise HTTPException(status_code=404, detail=f"La columna {table}.{column} no tiene diccionario de valores")
+
+    search = prefix.strip().upper()
+    if not search:
+        matches = values[:limit]
+    elif fuzzy:
+        matches = _fuzzy_column_values(table, column, search, limit)
+        if matches is None:
+            matches = [v for v in values if search in v[0].upper()][:limit]
+    else:
+        # Los filtros de texto se comparan en mayúsculas, el autocompletado también
+        matches = [v for v in values if v[0].upper().startswith(search)][:limit]
+
+    return {
+        "table": table,
+        "column": column,
+        "values": [{"value": valor, "count": conteo} for valor, conteo in matches]
+    }
+
+@app.get("/api/replicas")
+def get_replica_status():
+    """Estado de salud y retraso de cada réplica de lectura"""
+    return replica_router.status()
+
+@app.get("/api/admission")
+def get_admission_metrics():
+    """Profundidad de cola, tiempos de espera y rechazos por carril"""
+    return admission.metrics()
+
+def build_query(request: QueryRequest) -> Tuple[str, Optional[List]]:
+    """Consulta de /api/query (con la columna de coincidencia de filtro) y sus parámetros"""
     # Usar comillas dobles para nombres de columnas y tablas
     cols_list = [f'"{c}"' for c in request.columns] if request.columns else ["*"]
     cols = ", ".join(cols_list)
     table_name = f'"{request.table}"'
     
-    schema = get_schema()
+    schema = get_schema(request.use_primary)
     table_schema_data = schema.get(request.table, [])
     
     # --- INICIO DE LA CORRECCIÓN ---
@@ -236,45 +969,329 @@ def handle_query(request: QueryRequest):
         
         # Manejar el SELECT * correctamente con la nueva columna
         if cols == "*":
-            query = f"SELECT {table_name}.*, {case_sql} FROM {table_name} {where_sql};"
+            query = f"SELECT {table_name}.*, {case_sql} FROM {table_name} {where_sql}"
         else:
-            query = f"SELECT {cols}, {case_sql} FROM {table_name} {where_sql};"
+            query = f"SELECT {cols}, {case_sql} FROM {table_name} {where_sql}"
         
         # 2. Combinar las DOS listas de parámetros correctas
         #    Los parámetros del CASE (WHEN...THEN...) + los parámetros del WHERE
         params_totales = case_params + where_only_params
-        df = run_query(query, params_totales)
     else:
         # Sin filtros, consulta normal
-        query = f"SELECT {cols} FROM {table_name};"
-        df = run_query(query) # No hay parámetros
-    
+        query = f"SELECT {cols} FROM {table_name}"
+        params_totales = None # No hay parámetros
+
     # --- FIN DE LA CORRECCIÓN ---
+    return query, params_totales
+
+@app.post("/api/query")
+def handle_query(request: QueryRequest, http_request: Request, response: Response):
+    # Mismo cuerpo y misma versión de los datos = mismo resultado
+    etag = response_etag(request.use_primary, "query", request.model_dump())
+    if etag_matches(http_request, etag):
+        return not_modified(etag, request.use_primary)
+
+    query, params_totales = build_query(request)
+    with admission.admit(classify_query(request), client_id(http_request)):
+        df = run_query(query, params_totales, request.use_primary)
     
     total_count = len(df)
-    preview_data = df.head(20).to_dict(orient='records')
+    preview_data = df.head(PREVIEW_ROWS).to_dict(orient='records')
+    set_cache_headers(response, etag, request.use_primary)
     
     return {
         "totalCount": total_count,
         "previewData": preview_data
     }
 
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+def _stream_rows(query: str, params, use_primary: bool, emit, cancelled: threading.Event, holder: dict):
+    """
+    Hilo productor de /api/query/stream: recorre el resultado con un cursor del lado del servidor
+    (FETCH por lotes, sin cargar el resultado) y emite la vista previa apenas llegan las primeras
+    filas, conteos parciales cada STREAM_PROGRESS_INTERVAL segundos y el conteo exacto al final.
+    La conexión queda en holder para que el consumidor pueda cancelar la consulta en el servidor.
+    """
+    conn = None
+    try:
+        conn = get_connection(use_primary)
+        holder["conn"] = conn
+        if cancelled.is_set():
+            return  # el cliente se fue antes de que hubiera conexión que cancelar
+        with conn.cursor(name="query_stream") as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchmany(PREVIEW_ROWS)
+            columns = [col[0] for col in cursor.description]
+            emit("preview", {"columns": columns, "previewData": [dict(zip(columns, row)) for row in rows]})
+            count = len(rows)
+            last_progress = time.monotonic()
+            while len(rows) and not cancelled.is_set():
+                rows = cursor.fetchmany(STREAM_FETCH_ROWS)
+                count += len(rows)
+                if time.monotonic() - last_progress >= STREAM_PROGRESS_INTERVAL:
+                    emit("progress", {"count": count})
+                    last_progress = time.monotonic()
+        if not cancelled.is_set():
+            emit("done", {"totalCount": count})
+    except Exception as e:
+        if not cancelled.is_set():
+            print(f"Error al ejecutar la consulta: {e} \n Intente nuevamente.")
+            emit("error", {"detail": "Error al ejecutar la consulta"})
+    finally:
+        if conn is not None:
+            conn.close()
+        emit(None, None)
+
+@app.post("/api/query/stream")
+async def stream_query(request: QueryRequest, http_request: Request):
+    """
+    Variante progresiva de /api/query con Server-Sent Events (mismo cuerpo). Eventos: preview
+    (columnas y primeras PREVIEW_ROWS filas), progress (conteo parcial), done (conteo exacto) o
+    error. Si el cliente se desconecta se cancela la consulta en PostgreSQL.
+    """
+    query, params = await asyncio.to_thread(build_query, request)
+    ticket = await asyncio.to_thread(admission.acquire, classify_query(request), client_id(http_request))
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+    holder = {}
+
+    def stop():
+        # Fin normal, desconexión o cancelación: el productor deja de leer, la consulta se cancela
+        # en el servidor si seguía corriendo y se libera el lugar en admisión. También corre como
+        # tarea de fondo de la respuesta, por si el cliente se fue antes de empezar a leer
+        cancelled.set()
+        conn = holder.get("conn")
+        if conn is not None and not conn.closed:
+            try:
+                conn.cancel()
+            except psycopg2.Error:
+                pass
+        admission.release(ticket)
+
+    def emit(event, data):
+        # Tras una desconexión nadie lee la cola y el lazo de eventos puede ya estar cerrado
+        if cancelled.is_set() or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, (event, data))
+        except RuntimeError:
+            pass  # el lazo se cerró entre la verificación y la llamada
+
+    async def event_stream():
+        # El productor arranca con la respuesta: si nunca se empieza a leer, no queda un hilo consultando
+        threading.Thread(
+            target=_stream_rows, args=(query, params, request.use_primary, emit, cancelled, holder), daemon=True
+        ).start()
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(events.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    if await http_request.is_disconnected():
+                        break
+                    continue
+                if event is None:
+                    break
+                yield _sse(event, data)
+        finally:
+            stop()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(stop)
+    )
+
+@app.post("/api/aggregate")
+def aggregate_query(request: AggregateRequest, http_request: Request, response: Response):
+    """
+    Conteo de registros agrupado por columnas y, opcionalmente, por periodo de FECHA.
+    Usa los mismos filtros que /api/query.
+    """
+    etag = response_etag(request.use_primary, "aggregate", request.model_dump())
+    if etag_matches(http_request, etag):
+        return not_modified(etag, request.use_primary)
+    schema = get_schema(request.use_primary)
+    table_schema_data = schema.get(request.table, [])
+    if not table_schema_data:
+        raise HTTPException(status_code=404, detail=f"Tabla '{request.table}' no encontrada")
+    known_columns = {col["column_name"] for col in table_schema_data}
+    unknown = [c for c in request.group_by if c not in known_columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Columnas desconocidas: {', '.join(unknown)}")
+    if request.date_bucket and "fecha" not in known_columns:
+        raise HTTPException(status_code=400, detail=f"La tabla '{request.table}' no tiene columna fecha")
+
+    table_name = f'"{request.table}"'
+    where_sql, _, _, where_only_params = build_filter_logic(request.filters, table_schema_data)
+
+    group_exprs = [f'"{c}"' for c in request.group_by]
+    select_exprs = list(group_exprs)
+    if request.date_bucket:
+        # date_trunc existe con la misma firma en PostgreSQL y DuckDB
+        bucket = f"CAST(date_trunc('{request.date_bucket}', \"fecha\") AS DATE)"
+        group_exprs.insert(0, bucket)
+        select_exprs.insert(0, f'{bucket} AS "periodo"')
+    select_exprs.append('COUNT(*) AS "total"')
+
+    query = f"SELECT {', '.join(select_exprs)} FROM {table_name} {where_sql}"
+    if group_exprs:
+        positions = ", ".join(str(i + 1) for i in range(len(group_exprs)))
+        query += f" GROUP BY {positions} ORDER BY {positions}"
+
+    scan_query = f"SELECT 1 FROM {table_name} {where_sql}"
+    with admission.admit("agregado", client_id(http_request)):
+        df, engine_used = None, "postgres"
+        if use_analytic_engine(request.table, scan_query, where_only_params, request.use_primary):
+            df = run_analytic_query(query, where_only_params)
+            engine_used = "duckdb" if df is not None else engine_used
+        if df is None:
+            df = run_query(query, where_only_params, request.use_primary)
+
+    if "periodo" in df.columns:
+        # DuckDB devuelve DATE como datetime64; misma salida que PostgreSQL
+        df["periodo"] = pd.to_datetime(df["periodo"]).dt.date
+
+    set_cache_headers(response, etag, request.use_primary)
+    return {
+        "engine": engine_used,
+        "rows": df.to_dict(orient='records')
+    }
+
+def use_parallel_export(request: QueryRequest, table_schema: List[dict], query: str, params=None) -> bool:
+    """Solo CSV (xlsx se arma completo en memoria) y tablas con columna id para partir en rangos"""
+    if request.file_type == 'xlsx' or request.parallel is False or PARALLEL_EXPORT_WORKERS < 2:
+        return False
+    if not any(col["column_name"] == "id" for col in table_schema):
+        return False
+    if request.parallel:
+        return True
+    estimated = estimate_rows(query, params, request.use_primary)
+    return estimated is not None and estimated >= PARALLEL_EXPORT_MIN_ROWS
+
+@app.post("/api/sla")
+def sla_query(request: SlaRequest, http_request: Request, response: Response):
+    """
+    Percentiles de las duraciones de atención (despacho, llegada y solución, en segundos desde que
+    se recibió la llamada) agrupados por corporación, municipio, tipo y periodo de FECHA.
+    Los filtros aceptan las columnas de SLA_COLUMNS.
+    """
+    if not request.metrics:
+        raise HTTPException(status_code=400, detail="Indique al menos una métrica")
+    if not request.percentiles or any(not 0 < p < 1 for p in request.percentiles):
+        raise HTTPException(status_code=400, detail="Los percentiles deben estar entre 0 y 1 (ej. 0.5, 0.9)")
+    etag = response_etag(request.use_primary, "sla", request.model_dump())
+    if etag_matches(http_request, etag):
+        return not_modified(etag, request.use_primary)
+
+    columns = ", ".join(f'{col["source"]}."{col["column_name"]}"' for col in SLA_COLUMNS)
+    where_sql, _, _, where_only_params = build_filter_logic(request.filters, SLA_COLUMNS)
+
+    group_exprs = [f'"{c}"' for c in request.group_by]
+    select_exprs = list(group_exprs)
+    if request.date_bucket:
+        bucket = f"CAST(date_trunc('{request.date_bucket}', \"fecha\") AS DATE)"
+        group_exprs.insert(0, bucket)
+        select_exprs.insert(0, f'{bucket} AS "periodo"')
+    select_exprs.append('COUNT(*) AS "total"')
+    # Un solo ordenamiento por métrica para todos los percentiles (percentile_cont con arreglo,
+    # igual en PostgreSQL y DuckDB)
+    percentiles = ", ".join(repr(float(p)) for p in request.percentiles)
+    for metric in request.metrics:
+        select_exprs.append(
+            f'percentile_cont(ARRAY[{percentiles}]) WITHIN GROUP (ORDER BY "{SLA_METRICS[metric]}") AS "{metric}"'
+        )
+
+    source = f"""
+        WITH sla AS (
+            SELECT {columns}
+            FROM corporaciones c JOIN principal p ON p."folio" = c."folio"
+        )
+    """
+    query = f"{source} SELECT {', '.join(select_exprs)} FROM sla {where_sql}"
+    if group_exprs:
+        positions = ", ".join(str(i + 1) for i in range(len(group_exprs)))
+        query += f" GROUP BY {positions} ORDER BY {positions}"
+
+    scan_query = f"{source} SELECT 1 FROM sla {where_sql}"
+    with admission.admit("agregado", client_id(http_request)):
+        df, engine_used = None, "postgres"
+        if use_analytic_engine("corporaciones", scan_query, where_only_params, request.use_primary):
+            df = run_analytic_query(query, where_only_params)
+            engine_used = "duckdb" if df is not None else engine_used
+        if df is None:
+            df = run_query(query, where_only_params, request.use_primary)
+
+    if "periodo" in df.columns:
+        df["periodo"] = pd.to_datetime(df["periodo"]).dt.date
+
+    # Un campo por métrica y percentil: llegada_p50, llegada_p90...
+    labels = [f"p{p * 100:g}" for p in request.percentiles]
+    for metric in request.metrics:
+        if metric not in df.columns:
+            continue
+        values = [list(v) if v is not None and not isinstance(v, float) else [None] * len(labels) for v in df.pop(metric)]
+        for i, label in enumerate(labels):
+            df[f"{metric}_{label}"] = [None if v[i] is None else round(float(v[i]), 1) for v in values]
+
+    set_cache_headers(response, etag, request.use_primary)
+    return {
+        "engine": engine_used,
+        "rows": df.astype(object).where(df.notna(), None).to_dict(orient='records')
+    }
+
 @app.post("/api/download")
-def download_file(request: QueryRequest):
+def download_file(request: QueryRequest, http_request: Request):
     cols_list = [f'"{c}"' for c in request.columns] if request.columns else ["*"]
     cols = ", ".join(cols_list)
     table_name = f'"{request.table}"'
     
-    schema = get_schema()
+    schema = get_schema(request.use_primary)
     table_schema_data = schema.get(request.table, [])
     
     # Solo necesitamos la lógica del WHERE para la descarga
     where_sql, _, _, where_only_params = build_filter_logic(request.filters, table_schema_data)
 
     # Consulta de descarga SIN la columna de coincidencia
-    query = f"SELECT {cols} FROM {table_name} {where_sql};"
+    query = f"SELECT {cols} FROM {table_name} {where_sql}"
     
-    df = run_query(query, where_only_params)
+    ticket = admission.acquire("exportacion", client_id(http_request))
+    streaming = False
+    try:
+        df = None
+        if use_analytic_engine(request.table, query, where_only_params, request.use_primary):
+            if request.file_type == 'xlsx':
+                df = run_analytic_query(query, where_only_params)
+            else:
+                batches = run_analytic_batches(query, where_only_params)
+                if batches is not None:
+                    # El CSV se arma lote por lote mientras se envía; la descarga conserva su lugar
+                    # en el carril hasta terminar (o hasta que la tarea de fondo lo libere)
+                    streaming = True
+                    release = lambda: admission.release(ticket)
+                    return StreamingResponse(
+                        stream_analytic_csv(*batches, release),
+                        media_type='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=resultado.csv'},
+                        background=BackgroundTask(release)
+                    )
+        if df is None and use_parallel_export(request, table_schema_data, query, where_only_params):
+            files = export_csv_parallel(table_name, cols, where_sql, where_only_params, request.use_primary)
+            if files is not None:
+                return StreamingResponse(
+                    stream_files(files),
+                    media_type='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=resultado.csv'}
+                )
+        if df is None:
+            df = run_query(query, where_only_params, request.use_primary)
+    finally:
+        if not streaming:
+            admission.release(ticket)
     
     buffer = io.BytesIO()
     if request.file_type == 'xlsx':
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""BENCHMARK DE THROUGHPUT DEL ETL (SubirBases.py) POR ETAPA.
+
+Genera (una sola vez) libros sintéticos deterministas en cada estructura, corre cada etapa
+del ETL por separado y mide tiempo de pared, CPU, memoria y filas/segundo. La carga se hace
+contra un PostgreSQL local en un esquema aparte (por defecto "bench_etl") que se vacía antes de
+cada caso, así los resultados son comparables entre commits.
+
+Uso:
+    python benchmarks/bench_etl.py --filas 10k,100k
+    python benchmarks/bench_etl.py --filas 1m --estructura 2024 --memoria
+    python benchmarks/bench_etl.py --comparar benchmarks/resultados/etl_<commit>.json
+"""
+import argparse
+import importlib.metadata
+import json
+import os
+import sys
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from comun import BENCH_DIR, REPO_DIR, metadatos
+
+sys.path.insert(0, REPO_DIR)
+
+import openpyxl  # noqa: E402
+import pandas as pd  # noqa: E402
+from sqlalchemy import create_engine, text  # noqa: E402
+
+import SubirBases  # noqa: E402
+from perfil import Medidor  # noqa: E402
+from generador import ESTRUCTURAS, asegurar_libro, parse_tamano  # noqa: E402
+
+
+def preparar_esquema(esquema: str):
+    """Apunta SubirBases a un esquema de benchmark y lo deja vacío"""
+    engine = create_engine(
+        SubirBases.connection_string,
+        connect_args={"options": f"-c search_path={esquema},public"},
+        pool_pre_ping=True
+    )
+    with engine.connect() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {esquema}"))
+        conn.commit()
+    SubirBases.engine = engine
+    SubirBases.create_split_tables()
+    SubirBases.create_quarantine_table()
+    return engine
+
+
+def vaciar_tablas(engine):
+    with engine.connect() as conn:
+        conn.execute(text("TRUNCATE principal, corporaciones, comentarios RESTART IDENTITY CASCADE"))
+        conn.commit()
+
+
+def correr_caso(ruta: str, medidor: Medidor, con_bd: bool) -> Tuple[int, str]:
+    """
+    Corre las etapas de process_excel_file_split (por lotes de CHUNK_SIZE) sobre un libro, con las
+    mismas mediciones por etapa que guarda el ETL en etapas_archivo. Devuelve (filas leídas, lector usado).
+    """
+    filename = os.path.basename(ruta)
+
+    with medidor.etapa("apertura"):
+        lector, headers, version = SubirBases.open_workbook(ruta)
+    lotes = SubirBases.iter_split_chunks(lector.filas(), headers, version, filename, medidor)
+
+    total = 0
+    with (SubirBases.engine.begin() if con_bd else nullcontext()) as conn:
+        if con_bd:
+            SubirBases.reset_file_staging(conn)
+        for filas, df_principal, df_corporaciones, df_comentarios in lotes:
+            total += filas
+            if not con_bd:
+                continue
+            with medidor.etapa("carga", len(df_principal) + len(df_corporaciones) + len(df_comentarios)):
+                SubirBases.load_chunk(conn, df_principal, df_corporaciones, df_comentarios, filename)
+    lector.close()
+    return total, lector.nombre
+
+
+def version_calamine():
+    try:
+        return importlib.metadata.version("python-calamine")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def imprimir(resultados: List[Dict]):
+    print(f"\n{'caso':<28}{'etapa':<20}{'filas':>10}{'pared s':>10}{'cpu s':>10}{'filas/s':>12}{'rss MB':>9}")
+    for caso in resultados:
+        for e in caso["etapas"]:
+            fps = f"{e['filas_por_s']:.0f}" if e.get("filas_por_s") else "-"
+            print(f"{caso['caso']:<28}{e['etapa']:<20}{e['filas']:>10}{e['pared_s']:>10.3f}{e['cpu_s']:>10.3f}{fps:>12}{e['rss_mb']:>9.1f}")
+        print(f"{caso['caso']:<28}{'TOTAL (' + caso['lector'] + ')':<20}{caso['filas']:>10}{caso['pared_s']:>10.3f}")
+
+
+def comparar(actual: List[Dict], ruta_base: str):
+    """Muestra la razón de tiempos actual/base por caso y etapa (< 1.0 = más rápido)"""
+    with open(ruta_base, encoding="utf-8") as f:
+        base = json.load(f)
+    base_por_caso = {c["caso"]: {e["etapa"]: e for e in c["etapas"]} for c in base["resultados"]}
+    print(f"\nCOMPARACIÓN contra {base['metadatos'].get('commit')} ({ruta_base})")
+    print(f"{'caso':<28}{'etapa':<20}{'base s':>10}{'actual s':>10}{'razón':>8}")
+    for caso in actual:
+        etapas_base = base_por_caso.get(caso["caso"], {})
+        for e in caso["etapas"]:
+            b = etapas_base.get(e["etapa"])
+            if b and b["pared_s"] > 0:
+                print(f"{caso['caso']:<28}{e['etapa']:<20}{b['pared_s']:>10.3f}{e['pared_s']:>10.3f}{e['pared_s'] / b['pared_s']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark por etapa del ETL")
+    parser.add_argument("--estructura", choices=ESTRUCTURAS + ["todas"], default="todas")
+    parser.add_argument("--filas", default="10k,100k", help="Tamaños separados por coma: 10k,100k,1m")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--lote", type=int, default=SubirBases.CHUNK_SIZE, help="Filas por lote (CHUNK_SIZE del ETL)")
+    parser.add_argument("--lector", choices=["auto", "calamine", "openpyxl"], default=SubirBases.READER_BACKEND,
+                        help="Lector de Excel (READER_BACKEND del ETL)")
+    parser.add_argument("--datos", default=os.path.join(BENCH_DIR, "datos"), help="Carpeta de libros generados")
+    parser.add_argument("--esquema", default="bench_etl", help="Esquema de PostgreSQL para la carga")
+    parser.add_argument("--sin-bd", action="store_true", help="Solo etapas en memoria (sin PostgreSQL)")
+    parser.add_argument("--memoria", action="store_true", help="Mide el pico de memoria Python con tracemalloc (más lento)")
+    parser.add_argument("--salida", default=os.path.join(BENCH_DIR, "resultados"))
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    estructuras = ESTRUCTURAS if args.estructura == "todas" else [args.estructura]
+    SubirBases.CHUNK_SIZE = args.lote
+    SubirBases.READER_BACKEND = args.lector
+    etiquetas = [e.strip() for e in args.filas.split(",") if e.strip()]
+    engine = None if args.sin_bd else preparar_esquema(args.esquema)
+
+    resultados = []
+    for estructura in estructuras:
+        for etiqueta in etiquetas:
+            ruta = asegurar_libro(args.datos, estructura, etiqueta, args.semilla)
+            if engine is not None:
+                vaciar_tablas(engine)
+            medidor = Medidor(memoria=args.memoria)
+            inicio = time.perf_counter()
+            filas, lector = correr_caso(ruta, medidor, con_bd=engine is not None)
+            resultados.append({
+                "caso": f"{estructura}/{etiqueta}",
+                "estructura": estructura,
+                "lector": lector,
+                "filas": filas,
+                "filas_objetivo": parse_tamano(etiqueta),
+                "pared_s": round(time.perf_counter() - inicio, 4),
+                "etapas": medidor.etapas,
+            })
+
+    imprimir(resultados)
+
+    os.makedirs(args.salida, exist_ok=True)
+    meta = metadatos(pandas=pd.__version__, openpyxl=openpyxl.__version__, python_calamine=version_calamine())
+    ruta_json = os.path.join(args.salida, f"etl_{meta['commit'] or 'sin-git'}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(ruta_json, "w", encoding="utf-8") as f:
+        json.dump({"metadatos": meta, "parametros": vars(args), "resultados": resultados}, f, indent=2, ensure_ascii=False)
+    print(f"\nRESULTADOS: {ruta_json}")
+
+    if args.comparar:
+        comparar(resultados, args.comparar)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Utilidades compartidas por los benchmarks: memoria residente y metadatos de la corrida."""
+import math
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+sys.path.insert(0, REPO_DIR)
+
+from perfil import rss_mb  # noqa: E402  (reexportado para los benchmarks)
+
+
+def rss_arbol_mb(pid: int) -> Optional[float]:
+    """RSS del proceso más sus hijos (p. ej. uvicorn con varios workers); requiere psutil para los hijos"""
+    try:
+        import psutil
+        proceso = psutil.Process(pid)
+        return sum(p.memory_info().rss for p in [proceso] + proceso.children(recursive=True)) / 1024 / 1024
+    except ImportError:
+        return rss_mb(pid)
+    except Exception:
+        return None
+
+
+def percentil(valores: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano (valores ya ordenados)"""
+    if not valores:
+        return None
+    indice = max(0, min(len(valores) - 1, math.ceil(p / 100 * len(valores)) - 1))
+    return valores[indice]
+
+
+def metadatos(**extra) -> Dict:
+    def git(*args):
+        try:
+            return subprocess.check_output(["git", *args], cwd=REPO_DIR, text=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    datos = {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "cambios_sin_commit": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+    datos.update(extra)
+    return datos
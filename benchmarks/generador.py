@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""GENERADOR DETERMINISTA DE DATOS SINTÉTICOS PARA BENCHMARKS DEL ETL Y DEL BACKEND.
+
+Produce libros Excel en cada estructura que reconoce detect_version_structure
+("2015-2023", "2024", "principal"). Con la misma semilla y tamaño el contenido es idéntico,
+así los tiempos son comparables entre commits.
+
+Uso:
+    python benchmarks/generador.py --estructura 2024 --filas 100k --salida benchmarks/datos
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+import openpyxl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from SubirBases import COLUMN_MAPPING, DURATION_SOURCE_KIND, get_column_index  # noqa: E402
+
+ESTRUCTURAS = ["2015-2023", "2024", "principal"]
+
+# Nombre de archivo por estructura: detect_version_structure usa el año del nombre
+NOMBRES_ARCHIVO = {
+    "2015-2023": "bench_2019_{etiqueta}_s{semilla}.xlsx",
+    "2024": "bench_2024_{etiqueta}_s{semilla}.xlsx",
+    "principal": "bench_principal_{etiqueta}_s{semilla}.xlsx",
+}
+
+MUNICIPIOS = ["CHIHUAHUA", "JUAREZ", "DELICIAS", "CUAUHTEMOC", "PARRAL", "NUEVO CASAS GRANDES", "CAMARGO", "JIMENEZ"]
+CORPORACIONES = ["POLICIA MUNICIPAL", "POLICIA ESTATAL", "BOMBEROS", "CRUZ ROJA", "GUARDIA NACIONAL", "TRANSITO"]
+ORIGENES = ["TELEFONO", "APP", "RADIO", "BOTON DE PANICO"]
+PALABRAS = ["reporta", "persona", "vehiculo", "lesionado", "domicilio", "calle", "esquina", "ruido",
+            "agresion", "robo", "choque", "incendio", "auxilio", "unidad", "arribo", "sin novedad"]
+
+
+def parse_tamano(etiqueta: str) -> int:
+    """'10k' -> 10000, '1m' -> 1000000, '2500' -> 2500"""
+    etiqueta = etiqueta.strip().lower()
+    if etiqueta.endswith("k"):
+        return int(float(etiqueta[:-1]) * 1_000)
+    if etiqueta.endswith("m"):
+        return int(float(etiqueta[:-1]) * 1_000_000)
+    return int(etiqueta)
+
+
+def _hora(rnd: random.Random, base: datetime, minutos: int) -> str:
+    return (base + timedelta(minutes=minutos, seconds=rnd.randint(0, 59))).strftime("%H:%M:%S")
+
+
+def _como_duraciones(registro: Dict) -> Dict:
+    """DESP/LLEG/LIBR como tiempo transcurrido desde RCBD (H:MM:SS), como los traen TIEMPO_* en 2015-2023 y 2024"""
+    inicio = datetime.strptime(registro["RCBD"], "%H:%M:%S")
+    for columna in ("DESP", "LLEG", "LIBR"):
+        segundos = int((datetime.strptime(registro[columna], "%H:%M:%S") - inicio).total_seconds()) % 86400
+        registro[columna] = f"{segundos // 3600}:{segundos // 60 % 60:02d}:{segundos % 60:02d}"
+    return registro
+
+
+def generar_registros(filas: int, semilla: int = 42, folio_inicial: int = 1_000_000) -> Iterator[Dict]:
+    """
+    Genera registros en formato unificado (llaves = columnas destino de COLUMN_MAPPING["principal"]).
+    Cerca de un tercio de los folios se repite en 2-3 filas (varias corporaciones por incidente).
+    """
+    rnd = random.Random(semilla)
+    colonias = [f"COLONIA {i:03d}" for i in range(300)]
+    tipos = [f"INCIDENTE TIPO {i:02d}" for i in range(60)]
+    operadores = [f"OPERADOR {i:02d}" for i in range(40)]
+    inicio = datetime(2015, 1, 1)
+
+    folio = folio_inicial
+    generadas = 0
+    while generadas < filas:
+        folio += 1
+        repeticiones = 1 if rnd.random() < 0.66 else rnd.randint(2, 3)
+        fecha = inicio + timedelta(days=rnd.randint(0, 3650), minutes=rnd.randint(0, 1439))
+        comun = {
+            "FOLIO": str(folio),
+            "FECHA": fecha,
+            "TELEFONO": str(rnd.randint(6140000000, 6149999999)),
+            "UBICACION": f"CALLE {rnd.randint(1, 999)} Y {rnd.randint(1, 999)}",
+            "COLONIA": rnd.choice(colonias),
+            "MUNICIPIO": rnd.choice(MUNICIPIOS),
+            "TIPO": rnd.choice(tipos),
+            "OPERADOR": rnd.choice(operadores),
+            "DESPACHADOR": rnd.choice(operadores),
+            "ORIGEN": rnd.choice(ORIGENES),
+            "CHFNAME": f"DENUNCIANTE {rnd.randint(1, 5000)}",
+            "LATITUD": f"{28.6 + rnd.random():.6f}",
+            "LONGITUD": f"{-106.1 - rnd.random():.6f}",
+            "SECTOR": f"SECTOR {rnd.randint(1, 12)}",
+            "CLSDESC": rnd.choice(["PROCEDENTE", "IMPROCEDENTE", "FALSA ALARMA"]),
+        }
+        for _ in range(repeticiones):
+            if generadas >= filas:
+                break
+            despacho = rnd.randint(1, 15)
+            registro = dict(comun)
+            registro.update({
+                "CORPORACION": rnd.choice(CORPORACIONES),
+                "RCBD": fecha.strftime("%H:%M:%S"),
+                "DESP": _hora(rnd, fecha, despacho),
+                "LLEG": _hora(rnd, fecha, despacho + rnd.randint(3, 40)),
+                "LIBR": _hora(rnd, fecha, despacho + rnd.randint(45, 180)),
+                "UNIDAD": f"U-{rnd.randint(100, 999)}",
+                "COMENTARIOS": " ".join(rnd.choice(PALABRAS) for _ in range(rnd.randint(4, 14))),
+                "MTVOCIERRE": rnd.choice(["ATENDIDO", "SIN ELEMENTOS", "CANCELADO", ""]),
+                "NOTACIERRE": rnd.choice(["", "SE RETIRA UNIDAD", "SE CANALIZA"]),
+                "NOTASUSR": "",
+            })
+            yield registro
+            generadas += 1
+
+
+def encabezados_y_posiciones(estructura: str) -> Tuple[List[str], Dict[str, List[int]]]:
+    """Encabezados de la hoja y posiciones (0-based) donde va cada columna destino"""
+    mapping = COLUMN_MAPPING[estructura]
+    if estructura == "principal":
+        headers = list(mapping.keys())
+        return headers, {destino: [i] for i, destino in enumerate(headers)}
+
+    posiciones = {}
+    nombres = {}
+    for destino, (nombre_origen, refs) in mapping.items():
+        refs = refs if isinstance(refs, list) else [refs]
+        nombres_origen = nombre_origen.split(" + ") if len(refs) > 1 else [nombre_origen]
+        posiciones[destino] = [get_column_index(ref) for ref in refs]
+        for indice, nombre in zip(posiciones[destino], nombres_origen):
+            nombres[indice] = nombre
+    ancho = max(nombres) + 1
+    headers = [nombres.get(i, f"COLUMNA_{i + 1}") for i in range(ancho)]
+    return headers, posiciones
+
+
+def escribir_libro(ruta: str, estructura: str, filas: int, semilla: int = 42):
+    """Escribe un .xlsx sintético con la estructura indicada"""
+    headers, posiciones = encabezados_y_posiciones(estructura)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Hoja1")
+    ws.append(headers)
+    duraciones = DURATION_SOURCE_KIND.get(estructura) == "duracion"
+    for registro in generar_registros(filas, semilla):
+        if duraciones:
+            registro = _como_duraciones(registro)
+        fila = [None] * len(headers)
+        for destino, indices in posiciones.items():
+            valor = registro.get(destino)
+            if len(indices) > 1:
+                # Columnas combinadas (descripción + responsable): se reparte el texto
+                palabras = (valor or "").split(" ")
+                mitad = len(palabras) // 2
+                partes = [" ".join(palabras[:mitad]), " ".join(palabras[mitad:])]
+                for indice, parte in zip(indices, partes):
+                    fila[indice] = parte or None
+            else:
+                fila[indices[0]] = valor if valor != "" else None
+        ws.append(fila)
+    wb.save(ruta)
+
+
+def ruta_libro(carpeta: str, estructura: str, etiqueta: str, semilla: int = 42) -> str:
+    return os.path.join(carpeta, NOMBRES_ARCHIVO[estructura].format(etiqueta=etiqueta, semilla=semilla))
+
+
+def asegurar_libro(carpeta: str, estructura: str, etiqueta: str, semilla: int = 42) -> str:
+    """Genera el libro solo si no existe (la generación de 1M filas tarda varios minutos)"""
+    os.makedirs(carpeta, exist_ok=True)
+    ruta = ruta_libro(carpeta, estructura, etiqueta, semilla)
+    if not os.path.exists(ruta):
+        print(f"GENERANDO: {ruta}")
+        escribir_libro(ruta, estructura, parse_tamano(etiqueta), semilla)
+    return ruta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera libros Excel sintéticos para benchmarks")
+    parser.add_argument("--estructura", choices=ESTRUCTURAS + ["todas"], default="todas")
+    parser.add_argument("--filas", default="10k", help="Tamaños separados por coma: 10k,100k,1m")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", default=os.path.join(os.path.dirname(__file__), "datos"))
+    args = parser.parse_args()
+
+    estructuras = ESTRUCTURAS if args.estructura == "todas" else [args.estructura]
+    for estructura in estructuras:
+        for etiqueta in args.filas.split(","):
+            print(asegurar_libro(args.salida, estructura, etiqueta, args.semilla))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""PRUEBA DE CARGA REPRODUCIBLE DEL BACKEND (backend.py).
+
+1. (Opcional) Siembra un PostgreSQL local con un conjunto sintético de principal/corporaciones/
+   comentarios a la escala indicada, usando el mismo generador que bench_etl.py.
+2. (Opcional) Levanta uvicorn con backend:app para poder medir su memoria (RSS).
+3. Reproduce una mezcla realista de /api/schema, /api/query (varias formas de filtro) y
+   /api/download con la concurrencia indicada. La secuencia de peticiones depende solo de la semilla.
+4. Reporta throughput, percentiles de latencia, tasa de errores y RSS del servidor.
+
+Uso:
+    python benchmarks/loadtest_api.py --sembrar 200k --limpiar        # solo contra una base local
+    python benchmarks/loadtest_api.py --lanzar --concurrencia 16 --duracion 60
+    python benchmarks/loadtest_api.py --url http://c5-staging:8000 --pid 1234 --peticiones 2000
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from comun import BENCH_DIR, REPO_DIR, metadatos, percentil, rss_arbol_mb
+
+sys.path.insert(0, REPO_DIR)
+
+import httpx  # noqa: E402
+import pandas as pd  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+import SubirBases  # noqa: E402
+from generador import CORPORACIONES, MUNICIPIOS, generar_registros, parse_tamano  # noqa: E402
+
+FOLIO_INICIAL_SINTETICO = 9_000_000_000  # folios sintéticos fuera del rango real
+
+# Mezcla de peticiones: (tipo, peso)
+MEZCLA = [
+    ("schema", 10),
+    ("query_igual", 20),        # municipio = X
+    ("query_contiene", 10),     # tipo contiene X
+    ("query_rango_fecha", 15),  # fecha between
+    ("query_folio", 20),        # búsqueda puntual (carril rápido)
+    ("query_or", 10),           # municipio = X OR municipio = Y
+    ("query_corporacion", 5),   # tabla corporaciones
+    ("download_csv", 8),        # un mes de principal
+    ("download_xlsx", 2),       # una semana de principal
+]
+
+
+# --- Siembra ---
+
+def sembrar(filas: int, semilla: int, limpiar: bool, lote: int = 50_000):
+    """Inserta registros sintéticos en la base configurada en SubirBases.py"""
+    SubirBases.create_split_tables()
+    if limpiar:
+        with SubirBases.engine.connect() as conn:
+            conn.execute(text("TRUNCATE principal, corporaciones, comentarios RESTART IDENTITY CASCADE"))
+            conn.commit()
+    else:
+        with SubirBases.engine.connect() as conn:
+            existe = conn.execute(
+                text("SELECT 1 FROM principal WHERE FOLIO = :folio"), {"folio": str(FOLIO_INICIAL_SINTETICO + 1)}
+            ).first()
+        if existe:
+            print("SIEMBRA: ya existen folios sintéticos, se omite (use --limpiar para regenerar)")
+            return
+
+    SubirBases.create_quarantine_table()
+    with SubirBases.engine.begin() as conn:
+        SubirBases.reset_file_staging(conn)
+    inicio = time.perf_counter()
+    pendientes = []
+    cargadas = 0
+    for registro in generar_registros(filas, semilla, folio_inicial=FOLIO_INICIAL_SINTETICO):
+        pendientes.append(registro)
+        if len(pendientes) >= lote:
+            cargadas += _cargar_lote(pendientes)
+            pendientes = []
+    if pendientes:
+        cargadas += _cargar_lote(pendientes)
+    print(f"SIEMBRA: {cargadas} filas en {time.perf_counter() - inicio:.1f} s")
+
+
+def _cargar_lote(registros: List[Dict]) -> int:
+    """
+    Carga un lote por el mismo camino que el ETL (load_chunk): un folio partido entre dos lotes
+    conserva su primera aparición en principal, suma sus corporaciones y combina sus notas
+    """
+    df = pd.DataFrame(registros)
+    df.columns = [c.lower() for c in df.columns]
+    df['fecha'] = pd.to_datetime(df['fecha']).dt.date
+    df['fecha_carga'] = datetime.now()
+    df['version_estructura'] = 'principal'  # el generador escribe DESP/LLEG/LIBR como horas del día
+    df['origen_archivo'] = 'loadtest'
+    df_principal, df_corporaciones, df_comentarios = SubirBases.split_data_into_tables(df, 'loadtest')
+    with SubirBases.engine.begin() as conn:
+        SubirBases.load_chunk(conn, df_principal, df_corporaciones, df_comentarios, 'loadtest')
+    return len(df)
+
+
+# --- Generación de peticiones ---
+
+def construir_peticion(tipo: str, rnd: random.Random, filas_sembradas: int):
+    """Devuelve (método, ruta, cuerpo) para el tipo de petición"""
+    if tipo == "schema":
+        return "GET", "/api/schema", None
+    if tipo == "query_igual":
+        filtros = [{"column": "municipio", "operator": "=", "value": rnd.choice(MUNICIPIOS)}]
+        return "POST", "/api/query", {"table": "principal", "columns": [], "filters": filtros}
+    if tipo == "query_contiene":
+        filtros = [{"column": "tipo", "operator": "contains", "value": f"TIPO {rnd.randint(0, 59):02d}"}]
+        return "POST", "/api/query", {"table": "principal", "columns": ["folio", "fecha", "tipo"], "filters": filtros}
+    if tipo == "query_rango_fecha":
+        inicio = datetime(2015, 1, 1) + timedelta(days=rnd.randint(0, 3600))
+        filtros = [{"column": "fecha", "operator": "between",
+                    "value": [inicio.date().isoformat(), (inicio + timedelta(days=rnd.randint(1, 30))).date().isoformat()]}]
+        return "POST", "/api/query", {"table": "principal", "columns": [], "filters": filtros}
+    if tipo == "query_folio":
+        folio = FOLIO_INICIAL_SINTETICO + rnd.randint(1, max(1, int(filas_sembradas * 0.75)))
+        filtros = [{"column": "folio", "operator": "=", "value": str(folio)}]
+        return "POST", "/api/query", {"table": "principal", "columns": [], "filters": filtros}
+    if tipo == "query_or":
+        a, b = rnd.sample(MUNICIPIOS, 2)
+        filtros = [{"column": "municipio", "operator": "=", "value": a},
+                   {"column": "municipio", "operator": "=", "value": b, "logical": "OR"}]
+        return "POST", "/api/query", {"table": "principal", "columns": ["folio", "municipio"], "filters": filtros}
+    if tipo == "query_corporacion":
+        filtros = [{"column": "corporacion", "operator": "=", "value": rnd.choice(CORPORACIONES)}]
+        return "POST", "/api/query", {"table": "corporaciones", "columns": [], "filters": filtros}
+    if tipo in ("download_csv", "download_xlsx"):
+        dias = 30 if tipo == "download_csv" else 7
+        inicio = datetime(2015, 1, 1) + timedelta(days=rnd.randint(0, 3600))
+        filtros = [{"column": "fecha", "operator": "between",
+                    "value": [inicio.date().isoformat(), (inicio + timedelta(days=dias)).date().isoformat()]}]
+        return "POST", "/api/download", {"table": "principal", "columns": [], "filters": filtros,
+                                         "file_type": "csv" if tipo == "download_csv" else "xlsx"}
+    raise ValueError(tipo)
+
+
+def secuencia(semilla: int, total: int, filas_sembradas: int) -> List[tuple]:
+    """Lista fija de peticiones (tipo, método, ruta, cuerpo): depende solo de la semilla"""
+    rnd = random.Random(semilla)
+    tipos = [t for t, _ in MEZCLA]
+    pesos = [p for _, p in MEZCLA]
+    return [(tipo, *construir_peticion(tipo, rnd, filas_sembradas))
+            for tipo in rnd.choices(tipos, weights=pesos, k=total)]
+
+
+# --- Ejecución ---
+
+class MuestreoRSS(threading.Thread):
+    """Muestrea la memoria residente del servidor cada `intervalo` segundos"""
+
+    def __init__(self, pid: Optional[int], intervalo: float = 0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.intervalo = intervalo
+        self.muestras: List[float] = []
+        self._alto = threading.Event()
+
+    def run(self):
+        while not self._alto.is_set():
+            valor = rss_arbol_mb(self.pid) if self.pid else None
+            if valor is not None:
+                self.muestras.append(valor)
+            self._alto.wait(self.intervalo)
+
+    def detener(self):
+        self._alto.set()
+        self.join()
+
+
+def ejecutar(url: str, peticiones: List[tuple], concurrencia: int, duracion: Optional[float],
+             timeout: float) -> List[Dict]:
+    resultados: List[Dict] = []
+    lock = threading.Lock()
+    siguiente = [0]
+    limite = time.perf_counter() + duracion if duracion else None
+
+    def trabajador():
+        with httpx.Client(base_url=url, timeout=timeout) as client:
+            while True:
+                with lock:
+                    if siguiente[0] >= len(peticiones) or (limite and time.perf_counter() >= limite):
+                        return
+                    tipo, metodo, ruta, cuerpo = peticiones[siguiente[0]]
+                    siguiente[0] += 1
+                inicio = time.perf_counter()
+                try:
+                    r = client.request(metodo, ruta, json=cuerpo)
+                    estado, tamano = r.status_code, len(r.content)
+                except httpx.HTTPError as e:
+                    estado, tamano = f"error: {type(e).__name__}", 0
+                registro = {"tipo": tipo, "ms": (time.perf_counter() - inicio) * 1000, "estado": estado, "bytes": tamano}
+                with lock:
+                    resultados.append(registro)
+
+    hilos = [threading.Thread(target=trabajador) for _ in range(concurrencia)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return resultados
+
+
+def resumir(registros: List[Dict], segundos: float) -> Dict:
+    latencias = sorted(r["ms"] for r in registros)
+    errores = [r for r in registros if not (isinstance(r["estado"], int) and r["estado"] < 400)]
+    return {
+        "peticiones": len(registros),
+        "errores": len(errores),
+        "tasa_error": round(len(errores) / len(registros), 4) if registros else 0,
+        "rechazadas_429": sum(1 for r in registros if r["estado"] == 429),
+        "throughput_rps": round(len(registros) / segundos, 2) if segundos > 0 else None,
+        "p50_ms": round(percentil(latencias, 50) or 0, 1),
+        "p90_ms": round(percentil(latencias, 90) or 0, 1),
+        "p99_ms": round(percentil(latencias, 99) or 0, 1),
+        "max_ms": round(latencias[-1], 1) if latencias else 0,
+        "mb_respuesta": round(sum(r["bytes"] for r in registros) / 1024 / 1024, 2),
+    }
+
+
+def lanzar_servidor(puerto: int, workers: int) -> subprocess.Popen:
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend:app", "--port", str(puerto), "--workers", str(workers)],
+        cwd=REPO_DIR
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    for _ in range(60):
+        try:
+            httpx.get(url + "/", timeout=1)
+            return proceso
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    proceso.terminate()
+    raise RuntimeError("El servidor uvicorn no respondió")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del backend")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sembrar", help="Filas sintéticas a sembrar antes de la prueba (ej. 200k). SOLO bases locales")
+    parser.add_argument("--limpiar", action="store_true", help="Vacía las tablas antes de sembrar")
+    parser.add_argument("--filas-sembradas", default="200k", help="Escala sembrada (para elegir folios existentes)")
+    parser.add_argument("--lanzar", action="store_true", help="Levanta uvicorn backend:app para medir su RSS")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="Workers de uvicorn con --lanzar")
+    parser.add_argument("--pid", type=int, help="PID del servidor ya levantado (para medir RSS)")
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--peticiones", type=int, default=500)
+    parser.add_argument("--duracion", type=float, help="Segundos máximos de prueba (corta la secuencia)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", default=os.path.join(BENCH_DIR, "resultados"))
+    args = parser.parse_args()
+
+    if args.sembrar:
+        sembrar(parse_tamano(args.sembrar), args.semilla, args.limpiar)
+        args.filas_sembradas = args.sembrar
+
+    servidor = None
+    pid = args.pid
+    url = args.url
+    if args.lanzar:
+        servidor = lanzar_servidor(args.puerto, args.workers)
+        pid = servidor.pid
+        url = f"http://127.0.0.1:{args.puerto}"
+
+    muestreo = MuestreoRSS(pid)
+    muestreo.start()
+    try:
+        inicio = time.perf_counter()
+        peticiones = secuencia(args.semilla, args.peticiones, parse_tamano(args.filas_sembradas))
+        registros = ejecutar(url, peticiones, args.concurrencia, args.duracion, args.timeout)
+        segundos = time.perf_counter() - inicio
+    finally:
+        muestreo.detener()
+        if servidor is not None:
+            servidor.terminate()
+            servidor.wait()
+
+    por_tipo = {tipo: resumir([r for r in registros if r["tipo"] == tipo], segundos) for tipo, _ in MEZCLA}
+    total = resumir(registros, segundos)
+    rss = {
+        "inicio_mb": round(muestreo.muestras[0], 1) if muestreo.muestras else None,
+        "max_mb": round(max(muestreo.muestras), 1) if muestreo.muestras else None,
+        "fin_mb": round(muestreo.muestras[-1], 1) if muestreo.muestras else None,
+    }
+
+    print(f"\n{'tipo':<20}{'n':>7}{'err %':>8}{'rps':>9}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for tipo, r in list(por_tipo.items()) + [("TOTAL", total)]:
+        if r["peticiones"]:
+            print(f"{tipo:<20}{r['peticiones']:>7}{100 * r['tasa_error']:>8.1f}{r['throughput_rps']:>9.1f}"
+                  f"{r['p50_ms']:>10.1f}{r['p90_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}")
+    if rss["max_mb"] is not None:
+        print(f"\nRSS servidor: inicio {rss['inicio_mb']} MB, máximo {rss['max_mb']} MB, fin {rss['fin_mb']} MB")
+    else:
+        print("\nRSS servidor: no disponible (use --lanzar o --pid)")
+
+    os.makedirs(args.salida, exist_ok=True)
+    meta = metadatos(url=url, workers=args.workers if args.lanzar else None)
+    ruta_json = os.path.join(args.salida, f"api_{meta['commit'] or 'sin-git'}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(ruta_json, "w", encoding="utf-8") as f:
+        json.dump({"metadatos": meta, "parametros": vars(args), "total": total, "por_tipo": por_tipo,
+                   "rss_servidor": rss, "duracion_s": round(segundos, 2)}, f, indent=2, ensure_ascii=False)
+    print(f"RESULTADOS: {ruta_json}")
+
+
+if __name__ == "__main__":
+    main()
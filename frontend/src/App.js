@@ -1,4 +1,4 @@
-import React, {useState, useEffect} from 'react';
+import React, {useState, useEffect, useRef} from 'react';
 import axios from 'axios';
 import { 
   Container, Typography, Box, FormControl, InputLabel, Select, 
@@ -11,6 +11,8 @@ import { DatePicker } from '@mui/x-date-pickers/DatePicker';
 import dayjs from 'dayjs';
 
 const API_URL = 'http://127.0.0.1:8000';
+// Espera después de la última tecla antes de pedir sugerencias de valores
+const VALUE_OPTIONS_DEBOUNCE_MS = 250;
 
 function App() {
   const [schema, setSchema] = useState({});
@@ -25,6 +27,14 @@ function App() {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
   const [totalCount, setTotalCount] = useState(0);
+  const [valueOptions, setValueOptions] = useState({});
+  const [counting, setCounting] = useState(false);
+  // Vista previa en curso: se cancela si se pide otra o se cambia de tabla
+  const previewController = useRef(null);
+  // Sugerencias pendientes por filtro: { timer, controller } de la última petición
+  const valueRequests = useRef({});
+  // Columnas ("tabla.columna") sin diccionario de valores: no se vuelven a consultar
+  const columnsWithoutDictionary = useRef(new Set());
 
   useEffect(() => {
     setLoading(true);
@@ -48,6 +58,7 @@ function App() {
     setSelectedColumns([]);
     setFilters([]);
     setPreviewData([]);
+    if (previewController.current) previewController.current.abort();
   };
   
   const handlePreview = () => {
@@ -65,15 +76,68 @@ function App() {
       filters: filters.filter(f => f.column && f.value) 
     };
 
-    axios.post(`${API_URL}/api/query`, payload)
-      .then(response => {
-        setPreviewData(response.data.previewData || []);
-        setTotalCount(response.data.totalCount || 0); setLoading(false);
+    if (previewController.current) previewController.current.abort();
+    const controller = new AbortController();
+    previewController.current = controller;
+    setTotalCount(0);
+    setCounting(true);
+
+    // Resultados progresivos (Server-Sent Events): la vista previa llega primero y el conteo se
+    // actualiza hasta el total exacto. axios no entrega el cuerpo por partes, por eso se usa fetch
+    const handleEvent = (event, data) => {
+      if (event === 'preview') {
+        setPreviewData(data.previewData || []);
+        setTotalCount((data.previewData || []).length);
+        setLoading(false);
+      } else if (event === 'progress') {
+        setTotalCount(data.count);
+      } else if (event === 'done') {
+        setTotalCount(data.totalCount);
+        setCounting(false);
+      } else if (event === 'error') {
+        throw new Error(data.detail);
+      }
+    };
+
+    fetch(`${API_URL}/api/query/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(payload),
+      signal: controller.signal
+    })
+      .then(async response => {
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        for (;;) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          // Cada evento termina con una línea vacía: "event: <nombre>\ndata: <json>\n\n"
+          let end;
+          while ((end = buffer.indexOf('\n\n')) >= 0) {
+            const block = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+            const fields = {};
+            block.split('\n').forEach(line => {
+              const colon = line.indexOf(':');
+              if (colon > 0) fields[line.slice(0, colon)] = line.slice(colon + 1).trim();
+            });
+            if (fields.event && fields.data) handleEvent(fields.event, JSON.parse(fields.data));
+          }
+        }
       })
       .catch(err => {
+        if (err.name === 'AbortError') return;
         setError('Error al obtener el preview de los datos.');
-        setLoading(false);
         console.error(err);
+      })
+      .finally(() => {
+        if (previewController.current !== controller) return;
+        previewController.current = null;
+        setLoading(false);
+        setCounting(false);
       });
   };
 
@@ -111,11 +175,56 @@ function App() {
       });
   };
 
+  // Sugerencias de valores para filtros de texto (columnas con diccionario en /api/values). Al
+  // escribir se pide VALUE_OPTIONS_DEBOUNCE_MS después de la última tecla; cada petición cancela
+  // la anterior del mismo filtro y solo se usa la respuesta de la última
+  const fetchValueOptions = (filterId, column, prefix, delay = VALUE_OPTIONS_DEBOUNCE_MS) => {
+    if (!selectedTable || !column) return;
+    const dictionaryKey = `${selectedTable}.${column}`;
+    const pending = valueRequests.current[filterId];
+    if (pending) {
+      clearTimeout(pending.timer);
+      if (pending.controller) pending.controller.abort();
+    }
+    if (columnsWithoutDictionary.current.has(dictionaryKey)) {
+      delete valueRequests.current[filterId];
+      setValueOptions(prev => ({ ...prev, [filterId]: [] }));
+      return;
+    }
+    const request = {};
+    valueRequests.current[filterId] = request;
+    request.timer = setTimeout(() => {
+      request.controller = new AbortController();
+      axios.get(`${API_URL}/api/values`, {
+        params: { table: selectedTable, column, prefix, limit: 20 },
+        signal: request.controller.signal
+      })
+        .then(response => {
+          if (valueRequests.current[filterId] !== request) return;
+          setValueOptions(prev => ({ ...prev, [filterId]: response.data.values.map(v => v.value) }));
+        })
+        .catch(err => {
+          if (axios.isCancel(err) || valueRequests.current[filterId] !== request) return;
+          // La columna no tiene diccionario (404) o no existe (400): se escribe el valor libremente
+          // y no se vuelve a pedir; un 503 (diccionario aún no creado) sí se reintenta
+          const status = err.response && err.response.status;
+          if (status === 404 || status === 400) columnsWithoutDictionary.current.add(dictionaryKey);
+          setValueOptions(prev => ({ ...prev, [filterId]: [] }));
+        });
+    }, delay);
+  };
+
   const addFilter = () => {
     setFilters([...filters, { id: Date.now(), column: '', operator: '=', value: '', logical: 'AND' }]);
   };
 
   const removeFilter = (id) => {
+    const pending = valueRequests.current[id];
+    if (pending) {
+      clearTimeout(pending.timer);
+      if (pending.controller) pending.controller.abort();
+      delete valueRequests.current[id];
+    }
     setFilters(filters.filter(f => f.id !== id));
   };
 
@@ -316,7 +425,19 @@ return (
                     } else if (dataTypeCategory === 'numeric') {
                       return <TextField label="Valor" type="number" value={filter.value} onChange={(e) => handleFilterChange(filter.id, 'value', e.target.value)} sx={{ minWidth: 200 }} />;
                     } else {
-                      return <TextField label="Valor" type="text" value={filter.value} onChange={(e) => handleFilterChange(filter.id, 'value', e.target.value)} sx={{ minWidth: 200 }} />;
+                      return (
+                        <Autocomplete
+                          freeSolo
+                          options={valueOptions[filter.id] || []}
+                          inputValue={filter.value}
+                          onOpen={() => fetchValueOptions(filter.id, filter.column, filter.value, 0)}
+                          onInputChange={(e, newValue) => {
+                            handleFilterChange(filter.id, 'value', newValue);
+                            fetchValueOptions(filter.id, filter.column, newValue);
+                          }}
+                          renderInput={(params) => <TextField {...params} label="Valor" sx={{ minWidth: 200 }} />}
+                        />
+                      );
                     }
                   })()
                 )}
@@ -346,7 +467,7 @@ return (
         
         {previewData.length > 0 && (
           <Typography variant="h6" sx={{ marginBottom: 1 }}>
-            Mostrando {previewData.length} de {totalCount} registros encontrados.
+            Mostrando {previewData.length} de {totalCount} registros encontrados{counting ? ' (contando...)' : '.'}
           </Typography>
         )}
 
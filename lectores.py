@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""LECTORES DE ARCHIVOS DE ENTRADA PARA EL ETL.
+
+Todos entregan los encabezados y luego las filas de datos como tuplas (celda vacía = None), que
+es lo que esperan detect_version_structure y transform_rows:
+- calamine: lector nativo (Rust) para .xlsx/.xlsm/.xls, mucho más rápido que openpyxl. Carga la
+  hoja completa en memoria, así que solo se usa para archivos de hasta CALAMINE_MAX_MB.
+- openpyxl: lector en streaming (read_only), memoria acotada; respaldo para .xlsx/.xlsm.
+- csv: archivos .csv y .tsv (separador por extensión), en streaming.
+python-calamine es opcional (pip install python-calamine).
+"""
+import csv
+import logging
+import os
+import time
+from datetime import date, datetime, time as dt_time
+from typing import Iterator, List, Optional
+
+import openpyxl
+
+try:
+    from python_calamine import CalamineWorkbook
+    CALAMINE_DISPONIBLE = True
+except ImportError:
+    CalamineWorkbook = None
+    CALAMINE_DISPONIBLE = False
+
+logger = logging.getLogger(__name__)
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+TEXT_EXTENSIONS = ('.csv', '.tsv')
+CALAMINE_MAX_MB = 50  # archivos más grandes se leen en streaming con openpyxl (memoria acotada)
+CSV_ENCODINGS = ('utf-8-sig', 'latin-1')
+
+
+def is_input_file(filename: str) -> bool:
+    """Verifica si el archivo es un Excel o CSV/TSV válido (ignora archivos temporales de Office)"""
+    return filename.lower().endswith(EXCEL_EXTENSIONS + TEXT_EXTENSIONS) and not filename.startswith('~$')
+
+
+class Lector:
+    """Base: encabezados() una vez y después filas(); mide el tiempo pasado dentro del lector"""
+    nombre = ""
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.filas_leidas = 0
+        self.segundos = 0.0
+
+    def encabezados(self) -> List:
+        raise NotImplementedError
+
+    def _filas(self) -> Iterator[tuple]:
+        raise NotImplementedError
+
+    def filas(self) -> Iterator[tuple]:
+        """Filas de datos (sin el encabezado)"""
+        iterador = self._filas()
+        while True:
+            inicio = time.perf_counter()
+            try:
+                fila = next(iterador)
+            except StopIteration:
+                self.segundos += time.perf_counter() - inicio
+                return
+            self.segundos += time.perf_counter() - inicio
+            self.filas_leidas += 1
+            yield fila
+
+    def close(self):
+        velocidad = f", {self.filas_leidas / self.segundos:.0f} filas/s" if self.segundos > 0 else ""
+        logger.info(f"LECTOR: {self.nombre} leyó {self.filas_leidas} filas de {os.path.basename(self.ruta)} "
+                    f"en {self.segundos:.2f}s{velocidad}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LectorCalamine(Lector):
+    nombre = "calamine"
+
+    def __init__(self, ruta: str):
+        super().__init__(ruta)
+        inicio = time.perf_counter()
+        self._libro = CalamineWorkbook.from_path(ruta)
+        self._rows = iter(self._libro.get_sheet_by_index(0).iter_rows())
+        self.segundos += time.perf_counter() - inicio
+
+    @staticmethod
+    def _normalizar(fila: list) -> tuple:
+        # Mismos valores que openpyxl: None en celdas vacías, enteros sin ".0", fechas como datetime
+        return tuple(
+            None if v == '' else
+            int(v) if v.__class__ is float and v.is_integer() else
+            datetime.combine(v, dt_time()) if v.__class__ is date else v
+            for v in fila
+        )
+
+    def encabezados(self) -> List:
+        return list(self._normalizar(next(self._rows, [])))
+
+    def _filas(self) -> Iterator[tuple]:
+        for fila in self._rows:
+            yield self._normalizar(fila)
+
+    def close(self):
+        self._libro.close()
+        super().close()
+
+
+class LectorOpenpyxl(Lector):
+    nombre = "openpyxl"
+
+    def __init__(self, ruta: str):
+        super().__init__(ruta)
+        self._libro = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+        self._rows = self._libro.active.iter_rows(values_only=True)
+
+    def encabezados(self) -> List:
+        return list(next(self._rows, ()))
+
+    def _filas(self) -> Iterator[tuple]:
+        return self._rows
+
+    def close(self):
+        self._libro.close()
+        super().close()
+
+
+class LectorCSV(Lector):
+    nombre = "csv"
+
+    def __init__(self, ruta: str):
+        super().__init__(ruta)
+        self._archivo = open(ruta, newline='', encoding=self._detectar_codificacion(ruta))
+        delimitador = '\t' if ruta.lower().endswith('.tsv') else ','
+        self._rows = csv.reader(self._archivo, delimiter=delimitador)
+
+    @staticmethod
+    def _detectar_codificacion(ruta: str) -> str:
+        """UTF-8 si el inicio del archivo decodifica como UTF-8; si no, latin-1 (exportaciones de Windows)"""
+        with open(ruta, 'rb') as f:
+            muestra = f.read(1024 * 1024)
+        for codificacion in CSV_ENCODINGS:
+            try:
+                muestra.decode(codificacion)
+                return codificacion
+            except UnicodeDecodeError as e:
+                # Un carácter multibyte cortado al final de la muestra no cuenta como error
+                if e.start >= len(muestra) - 3:
+                    return codificacion
+        return CSV_ENCODINGS[-1]
+
+    def encabezados(self) -> List:
+        return [v if v != '' else None for v in next(self._rows, [])]
+
+    def _filas(self) -> Iterator[tuple]:
+        for fila in self._rows:
+            yield tuple(v if v != '' else None for v in fila)
+
+    def close(self):
+        self._archivo.close()
+        super().close()
+
+
+def abrir_lector(ruta: str, preferido: Optional[str] = None) -> Lector:
+    """
+    Elige el lector según extensión, tamaño y paquetes instalados.
+    preferido: "calamine" u "openpyxl" para forzar uno (None/"auto" = automático).
+    """
+    extension = os.path.splitext(ruta)[1].lower()
+    tamano_mb = os.path.getsize(ruta) / 1024 / 1024
+
+    if extension in TEXT_EXTENSIONS:
+        lector, motivo = LectorCSV, "archivo de texto"
+    elif preferido == "openpyxl" and extension != '.xls':
+        lector, motivo = LectorOpenpyxl, "forzado por configuración"
+    elif not CALAMINE_DISPONIBLE:
+        if extension == '.xls':
+            raise ValueError(f"{os.path.basename(ruta)}: los .xls requieren python-calamine (pip install python-calamine)")
+        lector, motivo = LectorOpenpyxl, "python-calamine no instalado"
+    elif preferido == "calamine" or extension == '.xls':
+        lector, motivo = LectorCalamine, "forzado por configuración" if preferido == "calamine" else "formato .xls"
+    elif tamano_mb > CALAMINE_MAX_MB:
+        lector, motivo = LectorOpenpyxl, f"{tamano_mb:.0f} MB > CALAMINE_MAX_MB, lectura en streaming"
+    else:
+        lector, motivo = LectorCalamine, "lector nativo"
+
+    logger.info(f"LECTOR: {lector.nombre} para {os.path.basename(ruta)} ({motivo})")
+    return lector(ruta)
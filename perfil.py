@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""MEDICIÓN POR ETAPA DEL ETL.
+
+Medidor acumula, por etapa (lectura, transformación, split, carga...), tiempo de pared, CPU,
+memoria residente y filas/s sumando todos los lotes de un archivo. Lo usan SubirBases.py (que
+guarda cada archivo en la tabla etapas_archivo) y benchmarks/bench_etl.py.
+perfilador() envuelve una corrida con un perfilador: pyinstrument (por muestreo) si está
+instalado (pip install pyinstrument), o cProfile de la biblioteca estándar.
+"""
+import cProfile
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+
+def rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """Memoria residente en MB del proceso indicado (por defecto el actual)"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class Medidor:
+    """Acumula tiempo de pared, CPU y memoria por etapa (sumando todos los lotes del archivo)"""
+
+    def __init__(self, memoria: bool = False):
+        self.memoria = memoria
+        self.etapas: List[Dict] = []
+        self._por_nombre: Dict[str, Dict] = {}
+
+    def _registro(self, nombre: str) -> Dict:
+        registro = self._por_nombre.get(nombre)
+        if registro is None:
+            registro = {"etapa": nombre, "filas": 0, "pared_s": 0.0, "cpu_s": 0.0, "rss_mb": 0.0, "filas_por_s": None}
+            self._por_nombre[nombre] = registro
+            self.etapas.append(registro)
+        return registro
+
+    def _sumar(self, nombre: str, filas: int, pared: float, cpu: float, rss: float, pico_python: Optional[float] = None):
+        registro = self._registro(nombre)
+        registro["filas"] += filas
+        registro["pared_s"] = round(registro["pared_s"] + pared, 4)
+        registro["cpu_s"] = round(registro["cpu_s"] + cpu, 4)
+        registro["filas_por_s"] = round(registro["filas"] / registro["pared_s"], 1) if registro["pared_s"] > 0 and registro["filas"] else None
+        registro["rss_mb"] = max(registro["rss_mb"], round(rss, 1))
+        if pico_python is not None:
+            registro["pico_python_mb"] = max(registro.get("pico_python_mb", 0), round(pico_python, 1))
+
+    @contextmanager
+    def etapa(self, nombre: str, filas: int = 0):
+        """Mide el bloque; las filas se pueden fijar al entrar o después con medicion["filas"]"""
+        if self.memoria:
+            tracemalloc.start()
+        inicio_pared = time.perf_counter()
+        inicio_cpu = time.process_time()
+        medicion = {"filas": filas}
+        try:
+            yield medicion
+        finally:
+            pared = time.perf_counter() - inicio_pared
+            cpu = time.process_time() - inicio_cpu
+            pico_python = None
+            if self.memoria:
+                _, pico = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                pico_python = pico / 1024 / 1024
+            self._sumar(nombre, medicion["filas"], pared, cpu, rss_mb() or 0, pico_python)
+
+    def combinar(self, otro: "Medidor") -> "Medidor":
+        """Suma las etapas de otro medidor (p. ej. el de un proceso lector del modo paralelo)"""
+        for registro in otro.etapas:
+            self._sumar(registro["etapa"], registro["filas"], registro["pared_s"], registro["cpu_s"],
+                        registro["rss_mb"], registro.get("pico_python_mb"))
+        return self
+
+    def resumen(self) -> List[str]:
+        """Tabla de texto con una línea por etapa, para el log"""
+        lineas = [f"{'etapa':<16}{'filas':>10}{'pared s':>10}{'cpu s':>10}{'filas/s':>12}{'rss MB':>9}"]
+        for e in self.etapas:
+            fps = f"{e['filas_por_s']:.0f}" if e["filas_por_s"] else "-"
+            lineas.append(f"{e['etapa']:<16}{e['filas']:>10}{e['pared_s']:>10.3f}{e['cpu_s']:>10.3f}{fps:>12}{e['rss_mb']:>9.1f}")
+        return lineas
+
+
+@contextmanager
+def perfilador(ruta_base: str):
+    """
+    Perfila el bloque y guarda el resultado en ruta_base + ".html" (pyinstrument) o ".prof"
+    (cProfile; se abre con snakeviz o pstats). Entrega la ruta del archivo que se va a escribir.
+    Solo ve el proceso actual (no los procesos lectores del modo paralelo).
+    """
+    os.makedirs(os.path.dirname(ruta_base) or ".", exist_ok=True)
+    if Profiler is not None:
+        profiler = Profiler()
+        ruta = ruta_base + ".html"
+        profiler.start()
+        try:
+            yield ruta
+        finally:
+            profiler.stop()
+            with open(ruta, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+    else:
+        profiler = cProfile.Profile()
+        ruta = ruta_base + ".prof"
+        profiler.enable()
+        try:
+            yield ruta
+        finally:
+            profiler.disable()
+            profiler.dump_stats(ruta)